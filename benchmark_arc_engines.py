@@ -0,0 +1,106 @@
+'''
+Times the arc engines of the DataManager on an input trial, and checks that the 'duckdb' engine
+gives the same arcs as the 'numpy' engine: the same labels, trips and columns in the same order,
+with every arc filter (profit quantile, arcs per trip and arc budget) and both arc storages. The tsp
+and the two tour limit models are both checked unless one is given.
+
+Usage: python benchmark_arc_engines.py [trial_name] [tsp|two_tour_limit] [num_trips]
+'''
+import sys
+import time
+
+import numpy
+
+sys.path.insert(0, "scripts")
+import arc_sql
+import data_manager as dm
+import file_manager as fm
+from utils import read_csv_with_log, read_empty_miles
+
+# --- CONFIG ---
+TRIAL_NAME = sys.argv[1] if len(sys.argv) > 1 else 'trial10'
+MODELS = [sys.argv[2]] if len(sys.argv) > 2 else ['tsp', 'two_tour_limit']
+NUM_TRIPS = int(sys.argv[3]) if len(sys.argv) > 3 else 2000
+ARC_FILTERS = [
+	{'max_deadhead': 500, 'trip_eligibility_quantile': 0.9},
+	{'max_deadhead': None, 'trip_eligibility_quantile': 0.97},
+	{'max_deadhead': 500, 'arcs_per_trip': 10},
+	{'max_deadhead': None, 'arcs_per_trip': 8, 'arc_budget': 10000},
+	#the default quantile of 0, which still filters the tours by their truncated minimum
+	{'max_deadhead': 500}
+]
+ARC_SETUPS = [('numpy', 'memory'), ('numpy', 'disk'), ('duckdb', 'memory'), ('duckdb', 'disk')]
+
+
+def timed(label: str, function: callable):
+	'''
+	runs function and prints its run time
+	'''
+	start = time.time()
+	result = function()
+	print(label.ljust(60), str(round(time.time() - start, 2)).rjust(10), 's')
+	return result
+
+
+def same_arcs(expected: dm.DataManager, actual: dm.DataManager, is_sorted: bool) -> bool:
+	'''
+	returns whether two DataManagers hold the same arcs and the same trip-arc index, comparing the
+	arcs by label when the arcs of actual are not sorted
+	'''
+	expected_df = expected.arc_store.to_frame()
+	actual_df = actual.arc_store.to_frame()
+	if not is_sorted:
+		expected_df = expected_df.sort_index()
+		actual_df = actual_df.sort_index()
+	if not expected_df.index.equals(actual_df.index):
+		return False
+	for column in expected_df.columns:
+		if not numpy.array_equal(expected_df[column].values, actual_df[column].values):
+			print('  column', column, 'differs')
+			return False
+	for tt in expected.trip_df.index:
+		if set(expected.arc_index.incident(tt)) != set(actual.arc_index.incident(tt)):
+			print('  arcs of trip', tt, 'differ')
+			return False
+	return True
+
+
+if __name__ == '__main__':
+	if not arc_sql.is_available():
+		sys.exit('The duckdb and pyarrow packages are needed to compare the arc engines')
+	file_manager = fm.FileManager(top_level_folder='./', input_dataset=TRIAL_NAME)
+	trip_columns = file_manager.params['data']['trips']
+	trip_df = read_csv_with_log(
+		filename='trips',
+		unique_columns=[trip_columns['columns']['trip_id']],
+		required_columns=[trip_columns['columns'][x[0]] for x in trip_columns['columnRequired'].items() if x[1]],
+		identifier='Trips',
+		file_manager=file_manager)
+	if not NUM_TRIPS is None:
+		trip_df = trip_df.iloc[:NUM_TRIPS]
+	empty_miles_df = read_empty_miles(file_manager)
+
+	num_differences = 0
+	for model in MODELS:
+		for arc_filter in ARC_FILTERS:
+			print(model, arc_filter)
+			data_managers = {}
+			for arc_engine, arc_storage in ARC_SETUPS:
+				data_managers[(arc_engine, arc_storage)] = timed('  DataManager ' + arc_engine + ' ' + arc_storage, lambda: dm.DataManager(file_manager,
+					use_tours=model == 'two_tour_limit',
+					trip_df=trip_df.copy(),
+					empty_miles_df=empty_miles_df.copy(),
+					deadhead_matrix=file_manager.deadhead_matrix,
+					arc_engine=arc_engine,
+					arc_storage=arc_storage,
+					**arc_filter))
+			expected = data_managers[('numpy', 'memory')]
+			print('  arcs:', len(expected.arc_store))
+			for (arc_engine, arc_storage), actual in data_managers.items():
+				if actual is expected:
+					continue
+				#disk arcs that are not pruned are stored in the order they were read in
+				is_same = same_arcs(expected, actual, arc_storage == 'memory')
+				num_differences += not is_same
+				print('  ' + arc_engine + ' ' + arc_storage + ' arcs are', 'the same' if is_same else 'DIFFERENT')
+	sys.exit(1 if num_differences > 0 else 0)
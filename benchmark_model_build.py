@@ -0,0 +1,138 @@
+'''
+Times model construction for the optimization models on an input trial, comparing the
+original rule-based Pyomo construction (one .loc lookup per variable and one Python sum per
+trip) with the array-based construction in define_model and the matrix backend.
+
+Usage: python benchmark_model_build.py [trial_name] [tsp|two_tour_limit] [num_trips]
+'''
+import os
+import sys
+import time
+
+import pyomo.environ as pe
+
+sys.path.insert(0, "scripts")
+import data_manager as dm
+import file_manager as fm
+from optimization.freight_model_tsp import FreightModelTSP
+from optimization.freight_model_two_tour_limit import FreightModelTwoTourLimit
+from utils import read_csv_with_log, read_empty_miles
+
+# --- CONFIG ---
+TRIAL_NAME = sys.argv[1] if len(sys.argv) > 1 else 'trial10'
+MODEL = sys.argv[2] if len(sys.argv) > 2 else 'tsp'
+NUM_TRIPS = int(sys.argv[3]) if len(sys.argv) > 3 else None
+MAX_DEADHEAD = 500
+TRIP_ELIGIBILITY_QUANTILE = 0.97
+MARGIN_TARGET = 0.1
+MARGIN_WEIGHT = 0.5
+
+
+def legacy_tsp_model(opt: FreightModelTSP) -> pe.ConcreteModel:
+	'''
+	the rule-based construction of FreightModelTSP.define_model before it moved to arrays
+	'''
+	data_manager = opt.data_manager
+	#the legacy construction looked arcs up by label in a DataFrame
+	potential_trip_df = data_manager.arc_store.to_frame()
+	model = pe.ConcreteModel(name="Modified Traveling Salesman Problem")
+	trip_set = pe.Set(initialize=data_manager.trip_df.index.values, doc='Trips')
+	model.XX = pe.Var(potential_trip_df.index.values, domain=pe.Binary)
+
+	def objective_rule(model):
+		if data_manager.margin_target <= 0:
+			return sum(model.XX[x] * int(potential_trip_df.loc[x, 'profit_adj']) for x in potential_trip_df.index.values)
+		else:
+			return sum(model.XX[x] * int(potential_trip_df.loc[x, 'profit_adj']) for x in potential_trip_df.index.values) +\
+				sum(model.XX[x] * int(potential_trip_df.loc[x, 'margin_improvement'])
+					for x in potential_trip_df.index.values) * opt.margin_weight
+	model.obj = pe.Objective(rule=objective_rule, sense=pe.maximize)
+
+	def constraint_equal_connections(model, tt: int):
+		other_trips_from = data_manager.arc_index.outgoing(tt)
+		other_trips_to = data_manager.arc_index.incoming(tt)
+		if len(other_trips_from) == 0:
+			return pe.Constraint.Skip
+		return sum(model.XX[x] for x in other_trips_from) == sum(model.XX[x] for x in other_trips_to)
+	model.constraint_equal_connections = pe.Constraint(trip_set, rule=constraint_equal_connections)
+
+	def constraint_ticket_prior_connection(model, tt: int):
+		other_trips_to = data_manager.arc_index.incoming(tt)
+		if len(other_trips_to) == 0:
+			return pe.Constraint.Skip
+		return sum(model.XX[x] for x in other_trips_to) <= 1
+	model.constraintTripPriorConnection = pe.Constraint(trip_set, rule=constraint_ticket_prior_connection)
+	return model
+
+
+def legacy_two_tour_model(opt: FreightModelTwoTourLimit) -> pe.ConcreteModel:
+	'''
+	the rule-based construction of FreightModelTwoTourLimit.define_model before it moved to arrays
+	'''
+	data_manager = opt.data_manager
+	#the legacy construction looked arcs up by label in a DataFrame
+	potential_trip_df = data_manager.arc_store.to_frame()
+	model = pe.ConcreteModel(name="Two Trip Limit Model")
+	trip_set = pe.Set(initialize=data_manager.trip_df.index.values, doc='Trips')
+	model.XX = pe.Var(potential_trip_df.index.values, domain=pe.Binary)
+
+	def objective_rule(model):
+		if data_manager.margin_target <= 0:
+			return sum(model.XX[idx] * int(potential_trip_df.loc[idx, 'profit_adj']) for idx in potential_trip_df.index.values)
+		else:
+			return sum(model.XX[idx] * int(potential_trip_df.loc[idx, 'profit_adj']) for idx in potential_trip_df.index.values) +\
+				sum(model.XX[idx] * int(potential_trip_df.loc[idx, 'margin_improvement'])
+					for idx in potential_trip_df.index.values) * opt.margin_weight
+	model.obj = pe.Objective(rule=objective_rule, sense=pe.maximize)
+
+	def trip_post_connection_limit(model, tt: int):
+		trips = data_manager.arc_index.incident(tt)
+		if len(trips) == 0:
+			return pe.Constraint.Skip
+		return sum(model.XX[x] for x in trips) <= 1
+	model.tripPostConnectionLimit = pe.Constraint(trip_set, rule=trip_post_connection_limit)
+	return model
+
+
+def timed(label: str, function: callable):
+	'''
+	runs function and prints its run time
+	'''
+	start = time.time()
+	result = function()
+	print(label.ljust(40), str(round(time.time() - start, 2)).rjust(10), 's')
+	return result
+
+
+if __name__ == '__main__':
+	file_manager = fm.FileManager(top_level_folder='./', input_dataset=TRIAL_NAME)
+	trip_columns = file_manager.params['data']['trips']
+	trip_df = read_csv_with_log(
+		filename='trips',
+		unique_columns=[trip_columns['columns']['trip_id']],
+		required_columns=[trip_columns['columns'][x[0]] for x in trip_columns['columnRequired'].items() if x[1]],
+		identifier='Trips',
+		file_manager=file_manager)
+	if not NUM_TRIPS is None:
+		trip_df = trip_df.iloc[:NUM_TRIPS]
+	empty_miles_df = read_empty_miles(file_manager)
+
+	data_manager = timed('DataManager', lambda: dm.DataManager(file_manager,
+		use_tours=MODEL == 'two_tour_limit',
+		max_deadhead=MAX_DEADHEAD,
+		trip_eligibility_quantile=TRIP_ELIGIBILITY_QUANTILE,
+		margin_target=MARGIN_TARGET,
+		trip_df=trip_df,
+		empty_miles_df=empty_miles_df,
+		deadhead_matrix=file_manager.deadhead_matrix))
+	print('trips:', len(data_manager.trip_df), 'arcs:', len(data_manager.arc_store))
+
+	model_class = FreightModelTwoTourLimit if MODEL == 'two_tour_limit' else FreightModelTSP
+	legacy_builder = legacy_two_tour_model if MODEL == 'two_tour_limit' else legacy_tsp_model
+	opt = model_class(data_manager, file_manager, verbose=False, margin_weight=MARGIN_WEIGHT)
+
+	timed('legacy rule-based define_model', lambda: legacy_builder(opt))
+	timed('array-based define_model', opt.define_model)
+	matrix_model = timed('define_matrix_model', opt.define_matrix_model)
+	timed('Pyomo LP write', lambda: opt.model.write(os.path.join(file_manager.output_folder, 'benchmark_model.lp'), io_options={'symbolic_solver_labels': False}))
+	timed('MatrixModel LP write', lambda: matrix_model.write_lp(os.path.join(file_manager.output_folder, 'benchmark_matrix_model.lp')))
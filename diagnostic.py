@@ -1,6 +1,10 @@
+import sys
 import pandas as pd
-import numpy as np
 from itertools import permutations, combinations
+
+sys.path.insert(0, "scripts")
+from deadhead_matrix import DeadheadMatrix
+from zip_codes import zip3_codes
  
 # --- CONFIG (set these to match the run you’re debugging) ---
 MODEL = "tsp"            # "tsp" or "two_tour"
@@ -14,6 +18,7 @@ TRIP_IDS_TO_EXPLAIN = ["<PUT_ONE_OR_MORE_TRIP_IDS_HERE>"]
 # --- LOAD THE INPUTS YOUR RUN SAVED ---
 trip_df = pd.read_csv("output/trip_df.csv", index_col=0)  # has normalized columns already
 em = pd.read_csv("output/empty_miles_df.csv", index_col=[0,1])  # MultiIndex (origin_zip,destination_zip)
+dhm = DeadheadMatrix.from_empty_miles_df(em)  # dense zip3 x zip3 lookup, same as the optimizer uses
  
 # Normalize (same as DataManager) ---------------------------------------------
 trip_df = trip_df.copy()
@@ -49,8 +54,10 @@ def explain_tsp_for(idx):
     df = df.join(trip_df[["trip_orgn_zip","must_take_flag"]]
                  .rename(columns={"trip_orgn_zip":"trip_orgn_zip2","must_take_flag":"must_take_dest"}), on="t2")
  
-    # Merge empty miles cost for the connection
-    df = df.join(em, on=[("trip_dst_zip1","trip_orgn_zip2")])
+    # Gather empty miles cost for the connection
+    dst1, orgn2 = zip3_codes(df["trip_dst_zip1"]), zip3_codes(df["trip_orgn_zip2"])
+    df["empty_cost"] = dhm.empty_cost[dst1, orgn2]
+    df["empty_miles"] = dhm.empty_miles[dst1, orgn2]
  
     report = {}
  
@@ -113,14 +120,11 @@ def explain_two_tour_for(idx):
                                      "trip_profit":"trip_profit2","must_take_flag":"must_take_dest",
                                      "trip_revenue":"revenue2"}), on="t2")
  
-    # Two deadheads
+    # Two deadheads, gathered from the deadhead matrix (NaN where missing)
     df = df.assign(
-        deadhead1 = em.lookup(df["trip_dst_zip1"].values, df["trip_orgn_zip2"].values) if not em.empty else np.nan,
-        deadhead2 = em.lookup(df["trip_dst_zip2"].values, df["trip_orgn_zip1"].values) if not em.empty else np.nan,
+        deadhead1 = dhm.empty_cost[zip3_codes(df["trip_dst_zip1"]), zip3_codes(df["trip_orgn_zip2"])],
+        deadhead2 = dhm.empty_cost[zip3_codes(df["trip_dst_zip2"]), zip3_codes(df["trip_orgn_zip1"])],
     )
-    # Safer alternative if lookup is unavailable:
-    # df = df.join(em.rename(columns={"empty_cost":"deadhead1"}), on=[("trip_dst_zip1","trip_orgn_zip2")])
-    # df = df.join(em.rename(columns={"empty_cost":"deadhead2"}), on=[("trip_dst_zip2","trip_orgn_zip1")])
  
     report = {}
     miss_mask = df["deadhead1"].isna() | df["deadhead2"].isna()
@@ -0,0 +1,511 @@
+'''
+This file contains the array-backed arc builder used by the DataManager. Candidate connections
+between trips are enumerated by integer trip position in fixed-size blocks, so the full set of
+trip permutations is never materialized as Python objects, and deadhead lookups are done with a
+single gather against the DeadheadMatrix instead of a MultiIndex merge. When a maximum deadhead is
+set, only pairs of zip3 buckets within the deadhead radius are visited.
+'''
+
+import numpy
+
+from deadhead_matrix import DeadheadMatrix, MISSING_MILES
+from zip_codes import NUM_ZIP3
+
+#the maximum number of candidate (t1, t2) pairs evaluated at once when enumerating arcs
+ARC_BLOCK_SIZE = 4000000
+
+#the columns of the arc blocks and their types when no arcs are enumerated
+TRIP_ARC_DTYPES = {'t1': numpy.int64, 't2': numpy.int64, 'empty_miles': numpy.int32, 'empty_cost': numpy.float32}
+TOUR_ARC_DTYPES = {'t1': numpy.int64, 't2': numpy.int64, 'deadhead1': numpy.float32, 'deadhead2': numpy.float32}
+
+
+def enumerate_trip_arcs(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float=None,
+		profit_cutoff: float=-2000,
+		block_size: int=ARC_BLOCK_SIZE) -> dict:
+	"""Enumerates every ordered pair of distinct trips (t1, t2), by trip position, and keeps
+	the pairs that have a deadhead entry and pass the profit and deadhead filters. The pairs
+	are evaluated in blocks of rows of t1, so peak memory is bounded by block_size rather
+	than by the square of the number of trips.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix to gather empty miles and
+			costs from
+		max_deadhead (float, optional): The maximum empty miles for a connection, unless
+			t1 is a must-take trip. Defaults to None (no limit).
+		profit_cutoff (float, optional): Connections with a profit at or below this value
+			are removed, unless either trip is a must-take trip. Defaults to -2000.
+		block_size (int, optional): The maximum number of pairs evaluated at once.
+
+	Returns:
+		dict: the trip positions 't1' and 't2' of the surviving arcs (sorted by t1, then t2),
+			their 'empty_miles' and 'empty_cost', and 'missing_pairs', the unique
+			(destination, origin) codes of pairs without a deadhead entry, encoded as
+			destination * (NUM_ZIP3 + 1) + origin.
+	"""
+	return collect_blocks(trip_arc_blocks(dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff, block_size))
+
+
+def trip_arc_blocks(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float=None,
+		profit_cutoff: float=-2000,
+		block_size: int=ARC_BLOCK_SIZE):
+	'''
+	yields the arcs of enumerate_trip_arcs one block at a time, each with the missing pairs of its block
+	'''
+	num_trips = len(dst_codes)
+	rows = numpy.arange(num_trips)
+	for t1, t2 in _row_blocks(rows, num_trips, block_size):
+		yield _score_block(t1, t2, dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff)
+
+
+def enumerate_neighbor_arcs(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float,
+		profit_cutoff: float=-2000,
+		block_size: int=ARC_BLOCK_SIZE) -> dict:
+	"""Enumerates the same arcs as enumerate_trip_arcs when a maximum deadhead is set, without
+	visiting all pairs of trips. Trips are bucketed by destination zip3 and by origin zip3,
+	and pairs are only generated between a destination bucket and the origin buckets within
+	max_deadhead of it, so the work scales with the number of surviving arcs. Must-take trips
+	keep their connections beyond the deadhead radius, so their rows are enumerated in full.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix to gather empty miles and
+			costs from
+		max_deadhead (float): The maximum empty miles for a connection, unless t1 is a
+			must-take trip
+		profit_cutoff (float, optional): Connections with a profit at or below this value
+			are removed, unless either trip is a must-take trip. Defaults to -2000.
+		block_size (int, optional): The maximum number of pairs evaluated at once.
+
+	Returns:
+		dict: the same fields as enumerate_trip_arcs
+	"""
+	arcs = collect_blocks(neighbor_arc_blocks(dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff, block_size))
+	order = numpy.lexsort((arcs['t2'], arcs['t1']))
+	return {key: value if key == 'missing_pairs' else value[order] for key, value in arcs.items()}
+
+
+def neighbor_arc_blocks(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float,
+		profit_cutoff: float=-2000,
+		block_size: int=ARC_BLOCK_SIZE):
+	'''
+	yields the arcs of enumerate_neighbor_arcs one block at a time, in enumeration order rather than
+	sorted, and at least one block. The missing pairs only depend on the zip3 buckets, so they are
+	found up front and carried by the first block.
+	'''
+	num_trips = len(dst_codes)
+	num_codes = NUM_ZIP3 + 1
+	dst_counts = numpy.bincount(dst_codes, minlength=num_codes)
+	orgn_counts = numpy.bincount(orgn_codes, minlength=num_codes)
+	#a missing (destination, origin) pair is reported if any two distinct trips connect through it
+	same_trip = numpy.bincount(dst_codes.astype(numpy.int64) * num_codes + orgn_codes, minlength=num_codes * num_codes).reshape(num_codes, num_codes)
+	connected = numpy.outer(dst_counts, orgn_counts) > same_trip
+	missing_pairs = numpy.flatnonzero((deadhead_matrix.empty_miles == MISSING_MILES) & connected).astype(numpy.int64)
+	no_missing_pairs = numpy.zeros(0, dtype=numpy.int64)
+
+	#only zip3 pairs within the deadhead radius that have trips on both sides produce arcs
+	pair_dst, pair_orgn = deadhead_matrix.neighbor_pairs(max_deadhead)
+	for t1, t2 in _bucket_pair_blocks(dst_codes, orgn_codes, pair_dst, pair_orgn, block_size):
+		block = _score_block(t1, t2, dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff)
+		block['missing_pairs'] = missing_pairs
+		missing_pairs = no_missing_pairs
+		yield block
+
+	#must-take trips also connect to trips beyond the deadhead radius
+	for t1, t2 in _row_blocks(numpy.flatnonzero(must_take), num_trips, block_size):
+		block = _score_block(t1, t2, dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff)
+		beyond_radius = block['empty_miles'] > max_deadhead
+		block = {key: value[beyond_radius] for key, value in block.items() if key != 'missing_pairs'}
+		block['missing_pairs'] = missing_pairs
+		missing_pairs = no_missing_pairs
+		yield block
+
+	#when no block carried the missing pairs, an empty block carries them and gives the columns
+	if not missing_pairs is no_missing_pairs:
+		yield dict(collect_blocks([]), missing_pairs=missing_pairs)
+
+
+def enumerate_tour_arcs(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float=None,
+		profit_cutoff: float=-2000,
+		block_size: int=ARC_BLOCK_SIZE) -> dict:
+	"""Enumerates the tours of the two tour limit model: unordered pairs of distinct trips
+	(t1 < t2, by trip position), where t1 is followed by t2 and t2 by t1. Both deadheads are
+	gathered in the same pass, and the filters are applied block by block, so only the
+	surviving tours are materialized. A tour with a must-take trip is always kept; any other
+	tour is kept when its profit is above profit_cutoff and, with a maximum deadhead, when both
+	deadhead costs are under max_deadhead (the tour filters have always compared the deadhead
+	cost to max_deadhead). Tours with a missing deadhead are removed.
+
+	Without a maximum deadhead the upper triangle of the trip pairs is evaluated in blocks of
+	rows. With one, tours are generated between the destination buckets and the origin buckets
+	whose deadhead cost is under max_deadhead, as in enumerate_neighbor_arcs, and the tours of
+	must-take trips are enumerated in full.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix to gather empty costs from
+		max_deadhead (float, optional): The maximum deadhead cost of both connections, unless
+			either trip is a must-take trip. Defaults to None (no limit).
+		profit_cutoff (float, optional): Tours with a profit at or below this value are removed,
+			unless either trip is a must-take trip. Defaults to -2000.
+		block_size (int, optional): The maximum number of pairs evaluated at once.
+
+	Returns:
+		dict: the trip positions 't1' and 't2' of the surviving tours (sorted by t1, then t2),
+			the deadhead costs 'deadhead1' (t1 to t2) and 'deadhead2' (t2 to t1), and
+			'missing_pairs', the unique (destination, origin) codes of the pairs without a
+			deadhead entry that were evaluated, encoded as destination * (NUM_ZIP3 + 1) + origin.
+	"""
+	arcs = collect_blocks(tour_arc_blocks(dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff, block_size))
+	if not max_deadhead is None:
+		order = numpy.lexsort((arcs['t2'], arcs['t1']))
+		arcs = {key: value if key == 'missing_pairs' else value[order] for key, value in arcs.items()}
+	return arcs
+
+
+def tour_arc_blocks(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float=None,
+		profit_cutoff: float=-2000,
+		block_size: int=ARC_BLOCK_SIZE):
+	'''
+	yields the tours of enumerate_tour_arcs one block at a time, in enumeration order rather than
+	sorted, each with the missing pairs of its block. An empty block is yielded when there are no
+	candidate tours, so the columns are always given.
+	'''
+	num_trips = len(dst_codes)
+	if max_deadhead is None:
+		rows = numpy.arange(num_trips)
+		pair_blocks = _triangle_blocks(rows, num_trips, block_size)
+	else:
+		#the first deadhead of every tour that is not kept for a must-take trip is under max_deadhead
+		pair_dst, pair_orgn = numpy.nonzero(deadhead_matrix.empty_cost < max_deadhead)
+		pair_blocks = _bucket_pair_blocks(dst_codes, orgn_codes, pair_dst, pair_orgn, block_size)
+
+	is_empty = True
+	for t1, t2 in pair_blocks:
+		if not max_deadhead is None:
+			#each tour is generated from both of its directions, and the must-take tours are added below
+			is_tour = (t1 < t2) & ~must_take[t1] & ~must_take[t2]
+			t1, t2 = t1[is_tour], t2[is_tour]
+		is_empty = False
+		yield _score_tour_block(t1, t2, dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff)
+
+	if not max_deadhead is None:
+		for t1, t2 in _row_blocks(numpy.flatnonzero(must_take), num_trips, block_size):
+			#a tour of two must-take trips is enumerated from its first trip
+			is_tour = (t1 != t2) & ~(must_take[t2] & (t2 < t1))
+			t1, t2 = numpy.minimum(t1[is_tour], t2[is_tour]), numpy.maximum(t1[is_tour], t2[is_tour])
+			is_empty = False
+			yield _score_tour_block(t1, t2, dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff)
+
+	if is_empty:
+		yield collect_blocks([], dtypes=TOUR_ARC_DTYPES)
+
+
+def _bucket_pair_blocks(dst_codes: numpy.ndarray, orgn_codes: numpy.ndarray, pair_dst: numpy.ndarray, pair_orgn: numpy.ndarray,
+		block_size: int):
+	'''
+	yields (t1, t2) position arrays pairing every trip with destination bucket pair_dst[i] with every
+	trip with origin bucket pair_orgn[i], a few bucket pairs at a time
+	'''
+	num_codes = NUM_ZIP3 + 1
+	dst_offsets, dst_order = group_members(dst_codes, num_codes)
+	orgn_offsets, orgn_order = group_members(orgn_codes, num_codes)
+	dst_counts = numpy.diff(dst_offsets)
+	orgn_counts = numpy.diff(orgn_offsets)
+	pair_sizes = dst_counts[pair_dst] * orgn_counts[pair_orgn]
+	occupied = pair_sizes > 0
+	pair_dst = pair_dst[occupied]
+	pair_orgn = pair_orgn[occupied]
+	pair_sizes = pair_sizes[occupied]
+	pair_ends = numpy.cumsum(pair_sizes)
+
+	start = 0
+	while start < len(pair_sizes):
+		block_start = pair_ends[start] - pair_sizes[start]
+		stop = max(start + 1, numpy.searchsorted(pair_ends, block_start + block_size, side='right'))
+		sizes = pair_sizes[start:stop]
+		pair_id = numpy.repeat(numpy.arange(start, stop), sizes)
+		local = numpy.arange(sizes.sum()) - numpy.repeat(pair_ends[start:stop] - sizes - block_start, sizes)
+		num_orgn = orgn_counts[pair_orgn[pair_id]]
+		t1 = dst_order[dst_offsets[pair_dst[pair_id]] + local // num_orgn]
+		t2 = orgn_order[orgn_offsets[pair_orgn[pair_id]] + local % num_orgn]
+		yield t1, t2
+		start = stop
+
+
+def _triangle_blocks(rows: numpy.ndarray, num_trips: int, block_size: int):
+	'''
+	yields (t1, t2) position arrays pairing each of the rows with every later trip, a few rows at a time
+	'''
+	row_sizes = num_trips - 1 - rows
+	row_ends = numpy.cumsum(row_sizes)
+	start = 0
+	while start < len(rows):
+		block_start = row_ends[start] - row_sizes[start]
+		stop = max(start + 1, numpy.searchsorted(row_ends, block_start + block_size, side='right'))
+		sizes = row_sizes[start:stop]
+		t1 = numpy.repeat(rows[start:stop], sizes)
+		t2 = t1 + 1 + numpy.arange(sizes.sum()) - numpy.repeat(row_ends[start:stop] - sizes - block_start, sizes)
+		yield t1, t2
+		start = stop
+
+
+def _row_blocks(rows: numpy.ndarray, num_trips: int, block_size: int):
+	'''
+	yields (t1, t2) position arrays pairing each of the rows with every trip, a few rows at a time
+	'''
+	rows_per_block = max(1, block_size // max(num_trips, 1))
+	all_trips = numpy.arange(num_trips)
+	for start in range(0, len(rows), rows_per_block):
+		block_rows = rows[start:start + rows_per_block]
+		yield numpy.repeat(block_rows, num_trips), numpy.tile(all_trips, len(block_rows))
+
+
+def _score_block(
+		t1: numpy.ndarray,
+		t2: numpy.ndarray,
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float,
+		profit_cutoff: float) -> dict:
+	'''
+	gathers the deadhead of a block of candidate arcs and applies the self-loop, missing
+	deadhead, profit and max deadhead filters
+	'''
+	off_diagonal = t1 != t2
+	t1 = t1[off_diagonal]
+	t2 = t2[off_diagonal]
+	dst1 = dst_codes[t1]
+	orgn2 = orgn_codes[t2]
+	cost = deadhead_matrix.empty_cost[dst1, orgn2]
+	miles = deadhead_matrix.empty_miles[dst1, orgn2]
+	missing = numpy.isnan(cost)
+
+	must_take_orgn = must_take[t1]
+	keep = ~missing & (must_take_orgn | must_take[t2] | (trip_profit[t1] - cost > profit_cutoff))
+	if max_deadhead is not None:
+		keep &= (miles <= max_deadhead) | must_take_orgn
+	return {
+		't1': t1[keep],
+		't2': t2[keep],
+		'empty_miles': miles[keep],
+		'empty_cost': cost[keep],
+		'missing_pairs': numpy.unique(dst1[missing].astype(numpy.int64) * (NUM_ZIP3 + 1) + orgn2[missing])
+	}
+
+
+def _score_tour_block(
+		t1: numpy.ndarray,
+		t2: numpy.ndarray,
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float,
+		profit_cutoff: float) -> dict:
+	'''
+	gathers both deadheads of a block of candidate tours and applies the missing deadhead, profit
+	and max deadhead filters
+	'''
+	dst1 = dst_codes[t1]
+	orgn1 = orgn_codes[t1]
+	dst2 = dst_codes[t2]
+	orgn2 = orgn_codes[t2]
+	deadhead1 = deadhead_matrix.empty_cost[dst1, orgn2]
+	deadhead2 = deadhead_matrix.empty_cost[dst2, orgn1]
+	missing1 = numpy.isnan(deadhead1)
+	missing2 = numpy.isnan(deadhead2)
+
+	is_must_take = must_take[t1] | must_take[t2]
+	keep = ~missing1 & ~missing2 & (is_must_take | (trip_profit[t1] + trip_profit[t2] - deadhead1 - deadhead2 > profit_cutoff))
+	if max_deadhead is not None:
+		keep &= is_must_take | ((deadhead1 < max_deadhead) & (deadhead2 < max_deadhead))
+	return {
+		't1': t1[keep],
+		't2': t2[keep],
+		'deadhead1': deadhead1[keep],
+		'deadhead2': deadhead2[keep],
+		'missing_pairs': numpy.unique(numpy.concatenate((
+			dst1[missing1].astype(numpy.int64) * (NUM_ZIP3 + 1) + orgn2[missing1],
+			dst2[missing2].astype(numpy.int64) * (NUM_ZIP3 + 1) + orgn1[missing2])))
+	}
+
+
+def collect_blocks(blocks: iter, dtypes: dict=TRIP_ARC_DTYPES) -> dict:
+	'''
+	concatenates the per-block arc arrays, with the union of the missing pairs of the blocks. dtypes
+	gives the columns when there are no blocks.
+	'''
+	blocks = list(blocks)
+	missing_pairs = [block.pop('missing_pairs') for block in blocks]
+	if len(blocks) == 0:
+		arcs = {key: numpy.zeros(0, dtype=dtype) for key, dtype in dtypes.items()}
+	else:
+		arcs = {key: numpy.concatenate([block[key] for block in blocks]) for key in blocks[0].keys()}
+	arcs['missing_pairs'] = numpy.unique(numpy.concatenate(missing_pairs)) if missing_pairs else numpy.zeros(0, dtype=numpy.int64)
+	return arcs
+
+
+def combination_index(t1: numpy.ndarray, t2: numpy.ndarray, num_trips: int) -> numpy.ndarray:
+	"""Returns the position of each (t1, t2) pair, with t1 < t2, in itertools.combinations(range(num_trips), 2),
+	which is the index the tours have always been labelled with.
+
+	Args:
+		t1 (numpy.ndarray): The trip positions of the first trip of each tour
+		t2 (numpy.ndarray): The trip positions of the second trip of each tour
+		num_trips (int): The number of trips
+
+	Returns:
+		numpy.ndarray: The tour labels, as int64
+	"""
+	t1 = t1.astype(numpy.int64)
+	t2 = t2.astype(numpy.int64)
+	return t1 * (2 * num_trips - t1 - 1) // 2 + t2 - t1 - 1
+
+
+def permutation_index(t1: numpy.ndarray, t2: numpy.ndarray, num_trips: int) -> numpy.ndarray:
+	"""Returns the position of each (t1, t2) pair in itertools.permutations(range(num_trips), 2),
+	which is the index the arcs have always been labelled with.
+
+	Args:
+		t1 (numpy.ndarray): The trip positions of the first trip of each arc
+		t2 (numpy.ndarray): The trip positions of the second trip of each arc
+		num_trips (int): The number of trips
+
+	Returns:
+		numpy.ndarray: The arc labels, as int64
+	"""
+	t1 = t1.astype(numpy.int64)
+	t2 = t2.astype(numpy.int64)
+	return t1 * (num_trips - 1) + t2 - (t2 > t1)
+
+
+def group_quantile(group_ids: numpy.ndarray, values: numpy.ndarray, quantile: float, num_groups: int) -> numpy.ndarray:
+	"""Computes a per-group quantile of values with linear interpolation, matching
+	pandas' groupby().quantile(). Groups without any values are NaN.
+
+	Args:
+		group_ids (numpy.ndarray): The group of each value, between 0 and num_groups - 1
+		values (numpy.ndarray): The values to take the quantile of
+		quantile (float): The quantile, between 0 and 1
+		num_groups (int): The number of groups
+
+	Returns:
+		numpy.ndarray: A float64 array with the quantile of each group
+	"""
+	values = values.astype(numpy.float64)
+	order = numpy.lexsort((values, group_ids))
+	sorted_values = values[order]
+	counts = numpy.bincount(group_ids, minlength=num_groups)
+	starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+
+	result = numpy.full(num_groups, numpy.nan)
+	has_values = counts > 0
+	float_idx = quantile * (counts[has_values] - 1)
+	idx = float_idx.astype(numpy.int64)
+	frac = float_idx % 1
+	lower = sorted_values[starts[has_values] + idx]
+	upper = sorted_values[starts[has_values] + numpy.minimum(idx + 1, counts[has_values] - 1)]
+	result[has_values] = numpy.where(frac == 0, lower, lower + (upper - lower) * frac)
+	return result
+
+
+def group_members(group_ids: numpy.ndarray, num_groups: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+	"""Sorts items by group with a single stable argsort, returning CSR-style offsets. The
+	members of group g are order[offsets[g]:offsets[g + 1]], in their original order.
+
+	Args:
+		group_ids (numpy.ndarray): The group of each item, between 0 and num_groups - 1
+		num_groups (int): The number of groups
+
+	Returns:
+		tuple[numpy.ndarray, numpy.ndarray]: The offsets (length num_groups + 1) and the
+			item positions sorted by group
+	"""
+	order = numpy.argsort(group_ids, kind='stable')
+	offsets = numpy.zeros(num_groups + 1, dtype=numpy.int64)
+	numpy.cumsum(numpy.bincount(group_ids, minlength=num_groups), out=offsets[1:])
+	return offsets, order
+
+
+def group_members_chunked(group_ids: numpy.ndarray, num_groups: int, order: numpy.ndarray, chunk_size: int) -> numpy.ndarray:
+	"""Computes the same offsets and order as group_members with a counting sort that reads group_ids
+	and writes order chunk_size items at a time, so both can be memory-mapped arrays larger than memory.
+
+	Args:
+		group_ids (numpy.ndarray): The group of each item, between 0 and num_groups - 1
+		num_groups (int): The number of groups
+		order (numpy.ndarray): An int64 array with one entry per item, filled with the item positions
+			sorted by group
+		chunk_size (int): The number of items read at once
+
+	Returns:
+		numpy.ndarray: The offsets (length num_groups + 1)
+	"""
+	num_items = len(group_ids)
+	counts = numpy.zeros(num_groups, dtype=numpy.int64)
+	for start in range(0, num_items, chunk_size):
+		counts += numpy.bincount(group_ids[start:start + chunk_size], minlength=num_groups)
+	offsets = numpy.zeros(num_groups + 1, dtype=numpy.int64)
+	numpy.cumsum(counts, out=offsets[1:])
+
+	#the next free slot of each group; chunks are placed in position order, so the sort is stable
+	cursors = offsets[:-1].copy()
+	for start in range(0, num_items, chunk_size):
+		chunk = numpy.asarray(group_ids[start:start + chunk_size], dtype=numpy.int64)
+		chunk_order = numpy.argsort(chunk, kind='stable')
+		chunk_groups = chunk[chunk_order]
+		chunk_counts = numpy.bincount(chunk, minlength=num_groups)
+		ranks = numpy.arange(len(chunk)) - (numpy.cumsum(chunk_counts) - chunk_counts)[chunk_groups]
+		order[cursors[chunk_groups] + ranks] = start + chunk_order
+		cursors += chunk_counts
+	return offsets
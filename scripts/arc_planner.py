@@ -0,0 +1,221 @@
+'''
+This file contains the arc planner, which picks how far to prune the arcs of a trip set before
+the DataManager builds them. It samples the trips, enumerates the arcs of the sample with the same
+deadhead and profit filters as the DataManager, and scales the sample up to estimate the number of
+arcs that survive the filters and the number kept at each candidate number of arcs per trip. The
+loosest level whose estimated memory and model build time fit the limits is chosen. The per-arc
+costs below were measured on the pyomo 6.6 / pandas 2.1 stack and are rough by design; the arc
+budget returned with the plan caps the model size if the estimate is low.
+'''
+
+import ctypes
+import logging
+import os
+
+import numpy
+
+import arc_builder
+from deadhead_matrix import DeadheadMatrix
+
+logger = logging.getLogger("__main__")
+
+#the number of trips sampled to estimate the arc counts
+PLANNER_SAMPLE_SIZE = 1500
+
+#candidate numbers of arcs per trip, loosest first; None keeps every arc
+ARCS_PER_TRIP_LEVELS = [None, 400, 200, 100, 50, 25, 15, 10, 5]
+
+#memory limit used when the machine memory cannot be read, and the share of machine memory used otherwise
+DEFAULT_MEMORY_LIMIT_MB = 4096
+MEMORY_SHARE = 0.5
+
+#target time, in seconds, to build the arcs and the model
+DEFAULT_BUILD_TIME_TARGET = 600
+
+#bytes and seconds per kept arc for the arc table and the model of each backend
+MODEL_ARC_COSTS = {
+	'pyomo': (950, 45e-6),
+	'matrix': (400, 6e-6),
+	'network': (300, 3e-6),
+	'lagrangian': (300, 3e-6)
+}
+
+#bytes and seconds per arc surviving the filters of the DataManager, before pruning
+ENUMERATION_COSTS = {
+	'trips': (250, 0.6e-6),
+	'tours': (250, 0.3e-6)
+}
+
+#seconds per pair of trips scanned by the tour enumeration when there is no maximum deadhead
+TOUR_PAIR_SECONDS = 0.04e-6
+
+#constraint nonzeros per arc: the flow rows for trips and the trip limit rows for tours
+NONZEROS_PER_ARC = {
+	'trips': 3,
+	'tours': 2
+}
+
+
+def machine_memory_mb() -> float:
+	'''
+	returns the physical memory of the machine in megabytes, or None if it cannot be read
+	'''
+	try:
+		import psutil
+		return psutil.virtual_memory().total / 2**20
+	except ImportError:
+		pass
+	if hasattr(os, 'sysconf') and 'SC_PHYS_PAGES' in os.sysconf_names:
+		return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2**20
+	if os.name == 'nt':
+		class MemoryStatus(ctypes.Structure):
+			_fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+				('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+				('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+				('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+				('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+		status = MemoryStatus()
+		status.dwLength = ctypes.sizeof(MemoryStatus)
+		if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+			return status.ullTotalPhys / 2**20
+	return None
+
+
+def default_memory_limit_mb() -> float:
+	'''
+	returns the memory limit used when none is given: MEMORY_SHARE of the machine memory, or
+	DEFAULT_MEMORY_LIMIT_MB if it cannot be read
+	'''
+	machine_memory = machine_memory_mb()
+	return DEFAULT_MEMORY_LIMIT_MB if machine_memory is None else machine_memory * MEMORY_SHARE
+
+
+def sample_trip_degrees(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float,
+		use_tours: bool) -> tuple[numpy.ndarray, numpy.ndarray]:
+	"""Enumerates the arcs among a set of trips with the filters of the DataManager and counts the
+	arcs where each trip is first (t1) and second (t2).
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix
+		max_deadhead (float): The maximum deadhead, or None
+		use_tours (bool): Whether the arcs are tours (unordered pairs) or trip permutations
+
+	Returns:
+		tuple[numpy.ndarray, numpy.ndarray]: The number of arcs where each trip is t1 and where it is t2
+	"""
+	num_trips = len(dst_codes)
+	if not use_tours:
+		enumerate_arcs = arc_builder.enumerate_trip_arcs if max_deadhead is None else arc_builder.enumerate_neighbor_arcs
+		arcs = enumerate_arcs(dst_codes=dst_codes, orgn_codes=orgn_codes, trip_profit=trip_profit, must_take=must_take,
+			deadhead_matrix=deadhead_matrix, max_deadhead=max_deadhead)
+		t1, t2 = arcs['t1'], arcs['t2']
+	else:
+		arcs = arc_builder.enumerate_tour_arcs(dst_codes=dst_codes, orgn_codes=orgn_codes, trip_profit=trip_profit,
+			must_take=must_take, deadhead_matrix=deadhead_matrix, max_deadhead=max_deadhead)
+		t1, t2 = arcs['t1'], arcs['t2']
+	return numpy.bincount(t1, minlength=num_trips), numpy.bincount(t2, minlength=num_trips)
+
+
+def plan_arc_budget(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float,
+		use_tours: bool,
+		model_backend: str='pyomo',
+		memory_limit_mb: float=None,
+		build_time_target: float=None,
+		sample_size: int=PLANNER_SAMPLE_SIZE,
+		seed: int=0) -> dict:
+	"""Estimates the arc count, constraint nonzeros, memory and build time of each level in
+	ARCS_PER_TRIP_LEVELS from a sample of the trips and picks the loosest level that fits the
+	memory limit and the build time target. The memory used to enumerate the arcs before pruning
+	does not depend on the level, so it is only compared to the limit to warn that the trips should
+	be split. The number of arcs kept at a level is estimated as the
+	sum over trips of min(k, arcs leaving) + min(k, arcs entering), which overcounts the arcs that
+	are in the top k of both of their trips.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix
+		max_deadhead (float): The maximum deadhead, or None
+		use_tours (bool): Whether the arcs are tours (unordered pairs) or trip permutations
+		model_backend (str, optional): The model backend, one of the keys of MODEL_ARC_COSTS. Defaults to 'pyomo'.
+		memory_limit_mb (float, optional): The memory limit in megabytes. Defaults to MEMORY_SHARE of the
+			machine memory, or DEFAULT_MEMORY_LIMIT_MB if it cannot be read.
+		build_time_target (float, optional): The target build time in seconds. Defaults to DEFAULT_BUILD_TIME_TARGET.
+		sample_size (int, optional): The number of trips to sample. Defaults to PLANNER_SAMPLE_SIZE.
+		seed (int, optional): The seed of the sample. Defaults to 0.
+
+	Returns:
+		dict: The chosen 'arcs_per_trip' (None for no pruning) and 'arc_budget' (None for no budget), the
+			'estimated_arcs', 'estimated_nonzeros', 'estimated_memory_mb' and 'estimated_build_seconds' of
+			the chosen level, the 'unpruned_arcs' estimate and the 'memory_limit_mb' and 'build_time_target' used
+	"""
+	if memory_limit_mb is None:
+		memory_limit_mb = default_memory_limit_mb()
+	if build_time_target is None:
+		build_time_target = DEFAULT_BUILD_TIME_TARGET
+	arc_type = 'tours' if use_tours else 'trips'
+	arc_bytes, arc_seconds = MODEL_ARC_COSTS.get(model_backend, MODEL_ARC_COSTS['pyomo'])
+	enumeration_bytes, enumeration_seconds = ENUMERATION_COSTS[arc_type]
+
+	num_trips = len(dst_codes)
+	sample = numpy.arange(num_trips)
+	if num_trips > sample_size:
+		sample = numpy.sort(numpy.random.RandomState(seed).choice(num_trips, sample_size, replace=False))
+	out_degree, in_degree = sample_trip_degrees(dst_codes[sample], orgn_codes[sample], trip_profit[sample],
+		must_take[sample], deadhead_matrix, max_deadhead, use_tours)
+	#a trip in the sample sees len(sample) - 1 of the num_trips - 1 other trips
+	pair_scale = (num_trips - 1) / max(len(sample) - 1, 1)
+	trip_scale = num_trips / len(sample)
+	out_degree = out_degree * pair_scale
+	in_degree = in_degree * pair_scale
+	unpruned_arcs = out_degree.sum() * trip_scale
+	enumeration_mb = unpruned_arcs * enumeration_bytes / 2**20
+	enumeration_time = unpruned_arcs * enumeration_seconds
+	if use_tours and max_deadhead is None:
+		enumeration_time += num_trips * (num_trips - 1) / 2 * TOUR_PAIR_SECONDS
+
+	plan = None
+	for arcs_per_trip in ARCS_PER_TRIP_LEVELS:
+		if arcs_per_trip is None:
+			arcs = unpruned_arcs
+		else:
+			arcs = min(unpruned_arcs, (numpy.minimum(out_degree, arcs_per_trip).sum() + numpy.minimum(in_degree, arcs_per_trip).sum()) * trip_scale)
+		plan = {
+			'arcs_per_trip': arcs_per_trip,
+			'estimated_arcs': int(arcs),
+			'estimated_nonzeros': int(arcs * NONZEROS_PER_ARC[arc_type]),
+			'estimated_memory_mb': round(arcs * arc_bytes / 2**20, 1),
+			'estimated_build_seconds': round(enumeration_time + arcs * arc_seconds, 1)
+		}
+		if plan['estimated_memory_mb'] <= memory_limit_mb and plan['estimated_build_seconds'] <= build_time_target:
+			break
+
+	#the budget holds the model to the limits even if the arcs were underestimated
+	budget = int(min(memory_limit_mb * 2**20 / arc_bytes, max(build_time_target - enumeration_time, 0) / arc_seconds))
+	plan['arc_budget'] = None if plan['arcs_per_trip'] is None and budget >= unpruned_arcs else max(budget, num_trips)
+	plan['unpruned_arcs'] = int(unpruned_arcs)
+	plan['enumeration_memory_mb'] = round(enumeration_mb, 1)
+	plan['memory_limit_mb'] = round(memory_limit_mb, 1)
+	plan['build_time_target'] = build_time_target
+	if enumeration_mb > memory_limit_mb:
+		logger.warning('Enumerating the arcs of ' + str(num_trips) + ' trips is estimated to need ' + str(round(enumeration_mb)) +
+			' MB, over the memory limit of ' + str(round(memory_limit_mb)) + ' MB; consider splitting the trips.')
+	return plan
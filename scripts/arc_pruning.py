@@ -0,0 +1,162 @@
+'''
+This file contains the arc pruning stage used by the DataManager and the arc pricing loop. Each
+trip keeps its best k outgoing and best k incoming arcs, and must-take trips always keep their
+best MUST_TAKE_ARCS_PER_TRIP arcs in each direction. The arcs are ranked within each trip once, over CSR-sorted arrays, so that the k
+meeting an arc budget can be found by a binary search instead of re-filtering the arc table. This
+replaces the per-trip profit quantile, whose output size depends on the data.
+'''
+
+import logging
+
+import numpy
+
+from arc_builder import group_members
+
+logger = logging.getLogger("__main__")
+
+#the number of arcs in each direction kept for a must-take trip regardless of the arc budget
+MUST_TAKE_ARCS_PER_TRIP = 25
+
+
+def group_rank(group_ids: numpy.ndarray, scores: numpy.ndarray, num_groups: int) -> numpy.ndarray:
+	"""Ranks items within their group by descending score, with ties kept in position order.
+	Items are grouped with group_members, and only the groups with more than one item are
+	sorted by score.
+
+	Args:
+		group_ids (numpy.ndarray): The group of each item, between 0 and num_groups - 1
+		scores (numpy.ndarray): The score of each item
+		num_groups (int): The number of groups
+
+	Returns:
+		numpy.ndarray: The rank of each item in its group, starting at 0
+	"""
+	offsets, order = group_members(group_ids, num_groups)
+	sizes = numpy.diff(offsets)
+	#sort the members of the groups with more than one item by (group, -score)
+	in_large_group = sizes[group_ids[order]] > 1
+	members = order[in_large_group]
+	order[in_large_group] = members[numpy.lexsort((-scores[members], group_ids[members]))]
+	ranks = numpy.empty(len(group_ids), dtype=numpy.int64)
+	ranks[order] = numpy.arange(len(order)) - offsets[group_ids[order]]
+	return ranks
+
+
+def prune_arcs(t1: numpy.ndarray, t2: numpy.ndarray, scores: numpy.ndarray, num_trips: int,
+	arcs_per_trip: int=None, arc_budget: int=None, must_keep_trips: numpy.ndarray=None) -> numpy.ndarray:
+	"""Selects the arcs_per_trip highest scoring arcs leaving and entering each trip, plus the
+	best MUST_TAKE_ARCS_PER_TRIP arcs leaving and entering each of must_keep_trips, which are kept
+	whatever the budget. With an arc_budget, the number of arcs per trip is lowered to the largest
+	value whose selection fits in the budget, and the budget left over is filled with the
+	highest scoring arcs of the next rank, so the selection has exactly arc_budget arcs unless
+	there are fewer arcs or more must-keep arcs than that.
+
+	Args:
+		t1 (numpy.ndarray): The trip position of the first trip of each arc
+		t2 (numpy.ndarray): The trip position of the second trip of each arc
+		scores (numpy.ndarray): The score of each arc; higher is better
+		num_trips (int): The number of trips
+		arcs_per_trip (int, optional): The number of arcs to keep per trip and direction. Defaults to None (no limit).
+		arc_budget (int, optional): The maximum number of arcs to keep. Defaults to None (no limit).
+		must_keep_trips (numpy.ndarray, optional): A boolean array of the trips whose best arcs are always kept,
+			by trip position. Defaults to None.
+
+	Returns:
+		numpy.ndarray: A boolean array indicating which arcs are kept
+	"""
+	if len(scores) == 0:
+		return numpy.zeros(0, dtype=bool)
+	out_rank = group_rank(t1, scores, num_trips)
+	in_rank = group_rank(t2, scores, num_trips)
+	must_keep = numpy.zeros(len(scores), dtype=bool)
+	if not must_keep_trips is None:
+		must_keep = (must_keep_trips[t1] & (out_rank < MUST_TAKE_ARCS_PER_TRIP)) | (must_keep_trips[t2] & (in_rank < MUST_TAKE_ARCS_PER_TRIP))
+	#an arc is in the top k of a trip if it is in the top k of either of its trips
+	rank = numpy.minimum(out_rank, in_rank)
+	max_rank = int(rank.max()) + 1
+	if arcs_per_trip is None:
+		arcs_per_trip = max_rank
+	is_kept = must_keep | (rank < arcs_per_trip)
+	if arc_budget is None or is_kept.sum() <= arc_budget:
+		return is_kept
+
+	num_must_keep = int(must_keep.sum())
+	if num_must_keep >= arc_budget:
+		logger.warning(str(num_must_keep) + ' must-take arcs exceed the arc budget of ' + str(arc_budget) + '; keeping only the must-take arcs.')
+		return must_keep.copy()
+	#the largest k whose top k arcs fit in the budget, then the best arcs of rank k to fill it
+	optional_ranks = numpy.sort(rank[~must_keep])
+	level_counts = numpy.searchsorted(optional_ranks, numpy.arange(max_rank + 1), side='left')
+	arcs_per_trip = int(numpy.searchsorted(level_counts, arc_budget - num_must_keep, side='right')) - 1
+	is_kept = must_keep | (rank < arcs_per_trip)
+	remaining = arc_budget - int(is_kept.sum())
+	next_level = numpy.flatnonzero(~must_keep & (rank == arcs_per_trip))
+	if remaining > 0 and len(next_level) > 0:
+		best = numpy.argpartition(-scores[next_level], min(remaining, len(next_level)) - 1)[:remaining]
+		is_kept[next_level[best]] = True
+	return is_kept
+
+
+def trip_arc_limits(num_trips: int, arcs_per_trip: int=None, must_keep_trips: numpy.ndarray=None) -> numpy.ndarray:
+	"""Returns the number of arcs in each direction that a trip can keep in prune_arcs before the arc
+	budget: arcs_per_trip, or MUST_TAKE_ARCS_PER_TRIP if more for must_keep_trips. An arc outside the
+	top limit arcs of both of its trips is never kept.
+
+	Args:
+		num_trips (int): The number of trips
+		arcs_per_trip (int, optional): The number of arcs to keep per trip and direction. Defaults to None (no limit).
+		must_keep_trips (numpy.ndarray, optional): A boolean array of the trips whose best arcs are always kept,
+			by trip position. Defaults to None.
+
+	Returns:
+		numpy.ndarray: The limit of each trip, by trip position, or None without arcs_per_trip
+	"""
+	if arcs_per_trip is None:
+		return None
+	limits = numpy.full(num_trips, arcs_per_trip, dtype=numpy.int64)
+	if not must_keep_trips is None:
+		limits[must_keep_trips] = max(arcs_per_trip, MUST_TAKE_ARCS_PER_TRIP)
+	return limits
+
+
+def prune_arc_chunks(chunks: iter, num_trips: int, arcs_per_trip: int=None, arc_budget: int=None,
+	must_keep_trips: numpy.ndarray=None) -> numpy.ndarray:
+	"""Selects the same arcs as prune_arcs from arcs read one chunk at a time. Only the arcs that are
+	in the top arcs_per_trip (or MUST_TAKE_ARCS_PER_TRIP for must_keep_trips) of one of their trips
+	among the arcs read so far are carried to the next chunk. The top arcs of a trip are always
+	carried, so an arc that is dropped is not in the top arcs of its trips, and the ranks of the
+	carried arcs below the limit are their ranks among all arcs. Memory is bounded by the chunk size
+	and the number of trips times the limit, not by the number of arcs. Without arcs_per_trip every
+	arc can meet the budget, so all chunks are read into memory.
+
+	The carried arcs are kept in label order, so ties are broken as prune_arcs breaks them for arcs
+	sorted by label, whatever the order the chunks are read in.
+
+	Args:
+		chunks (iter): The (labels, t1, t2, scores) arrays of consecutive chunks of arcs
+		num_trips (int): The number of trips
+		arcs_per_trip (int, optional): The number of arcs to keep per trip and direction. Defaults to None (no limit).
+		arc_budget (int, optional): The maximum number of arcs to keep. Defaults to None (no limit).
+		must_keep_trips (numpy.ndarray, optional): A boolean array of the trips whose best arcs are always kept,
+			by trip position. Defaults to None.
+
+	Returns:
+		numpy.ndarray: The positions of the arcs kept, in label order
+	"""
+	limits = trip_arc_limits(num_trips, arcs_per_trip, must_keep_trips)
+	positions, labels, t1, t2, scores = [numpy.zeros(0, dtype=numpy.int64)] * 5
+	num_arcs = 0
+	for chunk_labels, chunk_t1, chunk_t2, chunk_scores in chunks:
+		positions = numpy.concatenate((positions, numpy.arange(num_arcs, num_arcs + len(chunk_t1))))
+		labels = numpy.concatenate((labels, chunk_labels))
+		t1 = numpy.concatenate((t1, chunk_t1))
+		t2 = numpy.concatenate((t2, chunk_t2))
+		scores = numpy.concatenate((scores, chunk_scores))
+		num_arcs += len(chunk_t1)
+		order = numpy.argsort(labels, kind='stable')
+		if not limits is None:
+			order = order[(group_rank(t1[order], scores[order], num_trips) < limits[t1[order]]) |
+				(group_rank(t2[order], scores[order], num_trips) < limits[t2[order]])]
+		positions, labels, t1, t2, scores = positions[order], labels[order], t1[order], t2[order], scores[order]
+	keep = prune_arcs(t1, t2, scores, num_trips, arcs_per_trip=arcs_per_trip, arc_budget=arc_budget, must_keep_trips=must_keep_trips)
+	return positions[keep]
@@ -0,0 +1,256 @@
+'''
+This file contains the DuckDB arc engine, an alternative to arc_builder for the arc pipeline of the
+DataManager. The trips and the deadhead pairs are registered as Arrow tables in an embedded DuckDB
+database, and the self-join of the trips through the deadheads, the profit and deadhead filters, the
+top arcs of each trip and the per-trip profit quantile are one SQL query. DuckDB runs the query on all
+cores and spills to its temporary directory when the arcs do not fit in memory. The arcs are read back
+as Arrow record batches, sorted by (t1, t2), and handed over as NumPy arrays in the blocks of
+arc_builder, without a pandas round trip.
+
+duckdb and pyarrow are optional dependencies; they are only imported when the engine is used.
+'''
+
+import importlib.util
+
+import numpy
+
+from arc_builder import ARC_BLOCK_SIZE, TOUR_ARC_DTYPES, TRIP_ARC_DTYPES, collect_blocks
+from deadhead_matrix import DeadheadMatrix
+from zip_codes import NUM_ZIP3
+
+#the arc engines of the DataManager: arc_builder on NumPy arrays, or SQL on DuckDB
+ARC_ENGINES = ['numpy', 'duckdb']
+
+
+def is_available() -> bool:
+	'''
+	returns whether duckdb and pyarrow are installed
+	'''
+	return all(importlib.util.find_spec(name) is not None for name in ('duckdb', 'pyarrow'))
+
+
+def trip_arc_blocks(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float=None,
+		profit_cutoff: float=-2000,
+		arc_limits: numpy.ndarray=None,
+		quantile: float=None,
+		use_32bit: bool=True,
+		temp_directory: str=None,
+		block_size: int=ARC_BLOCK_SIZE):
+	"""Yields the arcs of arc_builder.enumerate_trip_arcs (or enumerate_neighbor_arcs with a maximum
+	deadhead) in blocks of at most block_size arcs, sorted by (t1, t2), and at least one block. The
+	first block carries the missing pairs. The arcs are scored as DataManager.trip_arc_columns scores
+	them, and are filtered in SQL by either:
+		- arc_limits: the arcs in the top arc_limits[t1] arcs leaving t1 or the top arc_limits[t2]
+		  arcs entering t2, ties ranked in (t1, t2) order. arc_pruning.prune_arcs keeps the same arcs
+		  from these as from all arcs, and applies the arc budget.
+		- quantile: the arcs whose adjusted profit is at least the profit quantile of t1 or of t2.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix to join empty miles and costs from
+		max_deadhead (float, optional): The maximum empty miles for a connection, unless t1 is a
+			must-take trip. Defaults to None (no limit).
+		profit_cutoff (float, optional): Connections with a profit at or below this value are
+			removed, unless either trip is a must-take trip. Defaults to -2000.
+		arc_limits (numpy.ndarray, optional): The number of arcs kept in each direction of each trip,
+			from arc_pruning.trip_arc_limits. Defaults to None (no limit).
+		quantile (float, optional): The per-trip profit quantile, when there are no arc_limits.
+			Defaults to None (no filter).
+		use_32bit (bool, optional): Whether the arcs are scored with 32 bit values, as in
+			DataManager.trip_arc_columns. Defaults to True.
+		temp_directory (str, optional): The folder DuckDB spills to. Defaults to None (the DuckDB default).
+		block_size (int, optional): The maximum number of arcs in a block.
+
+	Yields:
+		dict: The 't1', 't2', 'empty_miles', 'empty_cost' and 'missing_pairs' of a block of arcs
+	"""
+	profit = 'CAST(a.profit AS DOUBLE) - CAST(d.empty_cost AS DOUBLE)'
+	arcs = f'''
+		SELECT a.pos AS t1, b.pos AS t2, d.empty_miles, d.empty_cost, {profit} AS profit,
+			a.must_take OR b.must_take AS is_must_take, a.arc_limit AS limit1, b.arc_limit AS limit2
+		FROM trips a
+		JOIN deadheads d ON d.origin = a.dst
+		JOIN trips b ON b.orgn = d.destination
+		WHERE a.pos <> b.pos
+			AND (a.must_take OR b.must_take OR {profit} > $profit_cutoff)
+			{'' if max_deadhead is None else 'AND (d.empty_miles <= $max_deadhead OR a.must_take)'}'''
+	score = 'profit + 10000 * CAST(is_must_take AS INTEGER)'
+	if use_32bit:
+		#the adjusted profit is truncated to an int32 and the profit and its quantiles are float32
+		score = f'CAST(trunc({score}) AS INTEGER)'
+		quantile_values = 'CAST(CAST(profit AS FLOAT) AS DOUBLE)'
+		threshold = 'CAST(CAST({} AS FLOAT) AS DOUBLE)'
+	else:
+		quantile_values = 'profit'
+		threshold = '{}'
+	yield from _arc_blocks(arcs, score, quantile_values, threshold, True, ['t1', 't2', 'empty_miles', 'empty_cost'], TRIP_ARC_DTYPES,
+		dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff, arc_limits, quantile, temp_directory, block_size)
+
+
+def tour_arc_blocks(
+		dst_codes: numpy.ndarray,
+		orgn_codes: numpy.ndarray,
+		trip_profit: numpy.ndarray,
+		must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix,
+		max_deadhead: float=None,
+		profit_cutoff: float=-2000,
+		arc_limits: numpy.ndarray=None,
+		quantile: float=None,
+		temp_directory: str=None,
+		block_size: int=ARC_BLOCK_SIZE):
+	"""Yields the tours of arc_builder.enumerate_tour_arcs in blocks of at most block_size tours,
+	sorted by (t1, t2), and at least one block. The first block carries the missing pairs, which
+	are the pairs without a deadhead entry that any two distinct trips connect through. The tours
+	are scored by their float64 adjusted profit, and are filtered in SQL by either
+	arc_limits, as in trip_arc_blocks, or the arcs whose adjusted profit is at least the truncated
+	profit quantile of t1.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		must_take (numpy.ndarray): A boolean array indicating the must-take trips
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix to join empty costs from
+		max_deadhead (float, optional): The maximum deadhead cost of both connections, unless
+			either trip is a must-take trip. Defaults to None (no limit).
+		profit_cutoff (float, optional): Tours with a profit at or below this value are removed,
+			unless either trip is a must-take trip. Defaults to -2000.
+		arc_limits (numpy.ndarray, optional): The number of tours kept for each trip and direction,
+			from arc_pruning.trip_arc_limits. Defaults to None (no limit).
+		quantile (float, optional): The per-trip profit quantile, when there are no arc_limits.
+			Defaults to None (no filter).
+		temp_directory (str, optional): The folder DuckDB spills to. Defaults to None (the DuckDB default).
+		block_size (int, optional): The maximum number of tours in a block.
+
+	Yields:
+		dict: The 't1', 't2', 'deadhead1', 'deadhead2' and 'missing_pairs' of a block of tours
+	"""
+	profit = 'CAST(a.profit + b.profit AS DOUBLE) - CAST(d1.empty_cost AS DOUBLE) - CAST(d2.empty_cost AS DOUBLE)'
+	deadhead_filter = 'AND (a.must_take OR b.must_take OR (d1.empty_cost < $max_deadhead AND d2.empty_cost < $max_deadhead))'
+	arcs = f'''
+		SELECT a.pos AS t1, b.pos AS t2, d1.empty_cost AS deadhead1, d2.empty_cost AS deadhead2, {profit} AS profit,
+			a.must_take OR b.must_take AS is_must_take, a.arc_limit AS limit1, b.arc_limit AS limit2
+		FROM trips a
+		JOIN deadheads d1 ON d1.origin = a.dst
+		JOIN trips b ON b.orgn = d1.destination AND a.pos < b.pos
+		JOIN deadheads d2 ON d2.origin = b.dst AND d2.destination = a.orgn
+		WHERE (a.must_take OR b.must_take OR {profit} > $profit_cutoff)
+			{'' if max_deadhead is None else deadhead_filter}'''
+	yield from _arc_blocks(arcs, 'profit + 10000 * CAST(is_must_take AS INTEGER)', 'profit', 'trunc({})', False,
+		['t1', 't2', 'deadhead1', 'deadhead2'], TOUR_ARC_DTYPES,
+		dst_codes, orgn_codes, trip_profit, must_take, deadhead_matrix, max_deadhead, profit_cutoff, arc_limits, quantile, temp_directory, block_size)
+
+
+def _arc_blocks(arcs: str, score: str, quantile_values: str, threshold: str, use_t2_quantile: bool, columns: list, dtypes: dict,
+		dst_codes: numpy.ndarray, orgn_codes: numpy.ndarray, trip_profit: numpy.ndarray, must_take: numpy.ndarray,
+		deadhead_matrix: DeadheadMatrix, max_deadhead: float, profit_cutoff: float, arc_limits: numpy.ndarray,
+		quantile: float, temp_directory: str, block_size: int):
+	'''
+	runs the arcs query with the arc limit or quantile filter on the score, and yields its columns in
+	blocks. threshold formats the quantiles the scores are compared to.
+	'''
+	import duckdb
+	import pyarrow
+
+	if not arc_limits is None:
+		#row_number ranks ties in the order of the labels, as arc_pruning.group_rank does for sorted arcs
+		selection = '''
+			SELECT *, row_number() OVER (PARTITION BY t1 ORDER BY score DESC, t2) - 1 AS out_rank,
+				row_number() OVER (PARTITION BY t2 ORDER BY score DESC, t1) - 1 AS in_rank
+			FROM scored_arcs'''
+		keep = 'out_rank < limit1 OR in_rank < limit2'
+	elif not quantile is None:
+		trips = ['t1', 't2'] if use_t2_quantile else ['t1']
+		selection = f'''
+			SELECT scored_arcs.*, {', '.join(f'{trip}_quantiles.quantile AS {trip}_quantile' for trip in trips)}
+			FROM scored_arcs
+			{' '.join(f'JOIN ({_trip_quantiles(trip, quantile_values)}) {trip}_quantiles ON {trip}_quantiles.pos = scored_arcs.{trip}' for trip in trips)}'''
+		keep = ' OR '.join(f'CAST(score AS DOUBLE) >= {threshold.format(trip + "_quantile")}' for trip in trips)
+	else:
+		selection = 'SELECT * FROM scored_arcs'
+		keep = 'true'
+	query = f'''
+		WITH scored_arcs AS (SELECT *, {score} AS score FROM ({arcs})),
+		selected_arcs AS ({selection})
+		SELECT {', '.join(columns)} FROM selected_arcs WHERE {keep} ORDER BY t1, t2'''
+	params = {'profit_cutoff': profit_cutoff}
+	if not max_deadhead is None:
+		params['max_deadhead'] = max_deadhead
+	if arc_limits is None and not quantile is None:
+		params['quantile'] = quantile
+
+	num_trips = len(dst_codes)
+	connection = duckdb.connect(config={} if temp_directory is None else {'temp_directory': temp_directory})
+	try:
+		has_cost = ~numpy.isnan(deadhead_matrix.empty_cost)
+		origins, destinations = numpy.nonzero(has_cost)
+		connection.register('deadheads', pyarrow.table({
+			'origin': origins.astype(numpy.int32),
+			'destination': destinations.astype(numpy.int32),
+			'empty_miles': deadhead_matrix.empty_miles[has_cost],
+			'empty_cost': deadhead_matrix.empty_cost[has_cost]}))
+		connection.register('trips', pyarrow.table({
+			'pos': numpy.arange(num_trips, dtype=numpy.int64),
+			'dst': dst_codes.astype(numpy.int32),
+			'orgn': orgn_codes.astype(numpy.int32),
+			'profit': trip_profit,
+			'must_take': must_take.astype(bool),
+			'arc_limit': numpy.zeros(num_trips, dtype=numpy.int64) if arc_limits is None else arc_limits}))
+
+		missing_pairs = _missing_pairs(connection)
+		is_first = True
+		for batch in connection.execute(query, params).fetch_record_batch(block_size):
+			block = {name: batch.column(name).to_numpy(zero_copy_only=False).astype(dtypes[name], copy=False) for name in columns}
+			block['missing_pairs'] = missing_pairs if is_first else numpy.zeros(0, dtype=numpy.int64)
+			is_first = False
+			yield block
+		if is_first:
+			yield dict(collect_blocks([], dtypes=dtypes), missing_pairs=missing_pairs)
+	finally:
+		connection.close()
+
+
+def _trip_quantiles(trip: str, quantile_values: str) -> str:
+	'''
+	returns the query of the quantile of the arcs of each trip position (pos) in column t1 or t2, interpolated
+	as arc_builder.group_quantile interpolates it, so the quantiles are the same to the last bit; quantile_cont
+	rounds differently when the quantile falls on a value
+	'''
+	return f'''
+		SELECT pos, CASE WHEN fraction = 0 THEN lower ELSE lower + (upper - lower) * fraction END AS quantile
+		FROM (
+			SELECT pos, sorted_values[CAST(floor(position) AS BIGINT) + 1] AS lower,
+				sorted_values[least(CAST(floor(position) AS BIGINT) + 2, len(sorted_values))] AS upper,
+				position - floor(position) AS fraction
+			FROM (
+				SELECT pos, sorted_values, CAST($quantile AS DOUBLE) * (len(sorted_values) - 1) AS position
+				FROM (SELECT {trip} AS pos, list_sort(list({quantile_values})) AS sorted_values FROM scored_arcs GROUP BY {trip})))'''
+
+
+def _missing_pairs(connection) -> numpy.ndarray:
+	'''
+	returns the (destination, origin) zip3 pairs without a deadhead entry that any two distinct
+	trips connect through, encoded as destination * (NUM_ZIP3 + 1) + origin
+	'''
+	pairs = connection.execute(f'''
+		WITH destinations AS (SELECT dst, count(*) AS n FROM trips GROUP BY dst),
+		origins AS (SELECT orgn, count(*) AS n FROM trips GROUP BY orgn),
+		same_trip AS (SELECT dst, orgn, count(*) AS n FROM trips GROUP BY dst, orgn)
+		SELECT CAST(d.dst AS BIGINT) * {NUM_ZIP3 + 1} + o.orgn AS pair
+		FROM destinations d
+		CROSS JOIN origins o
+		LEFT JOIN same_trip s ON s.dst = d.dst AND s.orgn = o.orgn
+		WHERE d.n * o.n > coalesce(s.n, 0)
+			AND NOT EXISTS (SELECT 1 FROM deadheads h WHERE h.origin = d.dst AND h.destination = o.orgn)
+		ORDER BY pair''').fetchnumpy()['pair']
+	return numpy.asarray(pairs, dtype=numpy.int64)
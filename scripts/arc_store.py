@@ -0,0 +1,443 @@
+'''
+This file contains the ArcStore class, which holds the arcs (potential trips or tours) of a
+DataManager as typed NumPy columns instead of a DataFrame. Only the columns the models read are
+kept: the label and the two trip positions of each arc, its scores and its must-take flags packed
+into one byte. The per-trip values the scores are computed from stay in trip_df, and to_frame
+gathers them back into a DataFrame when the arcs need to be inspected.
+
+The DiskArcStore keeps the same columns in memory-mapped .npy files written in chunks, for
+instances whose arcs do not fit in memory next to the solver.
+'''
+
+import os
+import shutil
+import weakref
+from collections.abc import Iterator
+
+import numpy
+import pandas
+from numpy.lib import format as npy_format
+
+from arc_builder import group_members, group_members_chunked, group_quantile
+
+#the bit of each must-take flag in the flags column
+FLAG_BITS = {'must_take_orgn': 1, 'must_take_dest': 2}
+
+#where the arcs of a DataManager are stored: 'memory' (ArcStore) or 'disk' (DiskArcStore)
+ARC_STORAGES = ['memory', 'disk']
+
+#the number of arcs read or written at once by a DiskArcStore
+ARC_CHUNK_SIZE = 2000000
+
+#the size of the header of the .npy column files; numpy pads the header of a one dimensional array
+#to 128 bytes whatever its length, so it can be written once the length is known
+NPY_HEADER_SIZE = 128
+
+
+class ArcStore:
+	'''
+	This class stores one entry per arc in parallel NumPy arrays. Arcs are identified by their
+	row position; labels holds the index each arc would have in the list of trip permutations
+	(or combinations, for tours), which is the key of the model variables.
+	'''
+
+	__slots__ = ('labels', 't1', 't2', 'columns')
+
+	def __init__(self, labels: numpy.ndarray, t1: numpy.ndarray, t2: numpy.ndarray, columns: dict=None):
+		'''
+			labels: the label of each arc
+			t1: the trip position of the first trip of each arc
+			t2: the trip position of the second trip of each arc
+			columns: the other columns of the arcs, by name
+		'''
+		self.labels = numpy.asarray(labels, dtype=numpy.int64)
+		self.t1 = numpy.asarray(t1, dtype=numpy.int32)
+		self.t2 = numpy.asarray(t2, dtype=numpy.int32)
+		self.columns = {}
+		for name, values in (columns or {}).items():
+			self[name] = values
+
+
+	def __len__(self) -> int:
+		return len(self.labels)
+
+
+	def __contains__(self, name: str) -> bool:
+		return name in self.columns
+
+
+	def __getitem__(self, name: str) -> numpy.ndarray:
+		return self.columns[name]
+
+
+	def __setitem__(self, name: str, values: numpy.ndarray):
+		values = numpy.asarray(values)
+		if values.shape != self.labels.shape:
+			raise ValueError('Arc column ' + name + ' has ' + str(len(values)) + ' values for ' + str(len(self)) + ' arcs.')
+		self.columns[name] = values
+
+
+	@staticmethod
+	def pack_flags(**flags: numpy.ndarray) -> numpy.ndarray:
+		"""Packs boolean arrays named in FLAG_BITS into a flags column.
+
+		Args:
+			**flags (numpy.ndarray): The boolean value of each flag for each arc
+
+		Returns:
+			numpy.ndarray: The uint8 flags of each arc
+		"""
+		packed = None
+		for name, values in flags.items():
+			bits = numpy.where(values, FLAG_BITS[name], 0).astype(numpy.uint8)
+			packed = bits if packed is None else packed | bits
+		return packed
+
+
+	def flag(self, name: str) -> numpy.ndarray:
+		'''
+		returns whether each arc has the flag named in FLAG_BITS
+		'''
+		return (self.columns['flags'] & FLAG_BITS[name]) != 0
+
+
+	def compact(self, keep: numpy.ndarray):
+		"""Keeps only some of the arcs, in order. The store is compacted in place one column at a time,
+		so a filter never holds a second copy of every column the way a DataFrame mask does.
+
+		Args:
+			keep (numpy.ndarray): A boolean array indicating which arcs to keep, the row positions
+				of the arcs to keep, or an iterator of the boolean masks of consecutive chunks of arcs
+		"""
+		if isinstance(keep, Iterator):
+			keep = numpy.concatenate([numpy.zeros(0, dtype=bool)] + list(keep))
+		keep = numpy.asarray(keep)
+		if keep.dtype == bool and keep.all():
+			return
+		positions = numpy.flatnonzero(keep) if keep.dtype == bool else keep
+		self.labels = self.labels[positions]
+		self.t1 = self.t1[positions]
+		self.t2 = self.t2[positions]
+		for name in self.columns:
+			self.columns[name] = self.columns[name][positions]
+
+
+	def drop(self, name: str):
+		'''
+		removes a column from the store
+		'''
+		self.columns.pop(name)
+
+
+	def chunks(self, *names: str, chunk_size: int=None):
+		'''
+		yields the named columns (labels, t1, t2 or the other columns) of consecutive chunks of arcs.
+		Defaults to a single chunk.
+		'''
+		chunk_size = max(1, len(self) if chunk_size is None else chunk_size)
+		for start in range(0, len(self), chunk_size):
+			yield tuple(numpy.asarray(self.column(name)[start:start + chunk_size]) for name in names)
+
+
+	def column(self, name: str) -> numpy.ndarray:
+		'''
+		returns a column by name, including the labels, t1 and t2
+		'''
+		if name in ('labels', 't1', 't2'):
+			return getattr(self, name)
+		return self.columns[name]
+
+
+	def group_members(self, name: str, num_groups: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+		'''
+		returns the CSR offsets and the arc positions sorted by the trip positions in column t1 or t2,
+		as arc_builder.group_members
+		'''
+		return group_members(self.column(name), num_groups)
+
+
+	def group_quantile(self, name: str, values_name: str, quantile: float, num_groups: int) -> numpy.ndarray:
+		'''
+		returns the quantile of column values_name among the arcs of each trip position in column t1 or t2,
+		as arc_builder.group_quantile
+		'''
+		return group_quantile(self.column(name), self.column(values_name), quantile, num_groups)
+
+
+	def take(self, positions: numpy.ndarray) -> 'ArcStore':
+		"""Returns a new store with the arcs at the given row positions.
+
+		Args:
+			positions (numpy.ndarray): The row positions of the arcs
+
+		Returns:
+			ArcStore: The in-memory store of the arcs
+		"""
+		return ArcStore(self.labels[positions], self.t1[positions], self.t2[positions],
+			{name: values[positions] for name, values in self.columns.items()})
+
+
+	def nbytes(self) -> int:
+		'''
+		returns the number of bytes held by the columns of the store
+		'''
+		return self.labels.nbytes + self.t1.nbytes + self.t2.nbytes + sum(values.nbytes for values in self.columns.values())
+
+
+	def to_frame(self, trip_df: pandas.DataFrame=None, trip_columns: iter=()) -> pandas.DataFrame:
+		"""Builds a DataFrame of the arcs, indexed by label, for debugging. The flags are unpacked into
+		one boolean column each.
+
+		Args:
+			trip_df (pandas.DataFrame, optional): The trip dataframe the trip positions refer to. When
+				given, t1 and t2 hold trip_df index labels instead of trip positions. Defaults to None.
+			trip_columns (iter, optional): Columns of trip_df to gather for both trips of each arc, as
+				<column>1 and <column>2. Defaults to ().
+
+		Returns:
+			pandas.DataFrame: The arcs
+		"""
+		frame = {
+			't1': self.t1 if trip_df is None else trip_df.index.values[self.t1],
+			't2': self.t2 if trip_df is None else trip_df.index.values[self.t2]}
+		for column in trip_columns:
+			frame[column + '1'] = trip_df[column].values[self.t1]
+			frame[column + '2'] = trip_df[column].values[self.t2]
+		for name, values in self.columns.items():
+			if name == 'flags':
+				frame.update({flag: self.flag(flag) for flag in FLAG_BITS})
+			else:
+				frame[name] = values
+		return pandas.DataFrame(frame, index=pandas.Index(self.labels))
+
+
+class DiskArcStore(ArcStore):
+	'''
+	This class stores the arcs in one memory-mapped .npy file per column in a folder of its own. The
+	arcs are appended in chunks and the files are opened once the store is finished, after which it is
+	used like an ArcStore: columns are read-only memory-mapped arrays, and compact, group_members and
+	group_quantile stream over the files chunk_size arcs at a time. Each compaction writes a new generation of the
+	files, so arrays still mapping the previous generation stay valid. The folder is removed when the
+	store is garbage collected.
+	'''
+
+	__slots__ = ('folder', 'chunk_size', 'generation', 'writers', '__weakref__')
+
+	def __init__(self, folder: str, chunk_size: int=ARC_CHUNK_SIZE):
+		'''
+			folder: the folder of the column files; it is created if needed
+			chunk_size: the number of arcs read or written at once
+		'''
+		super().__init__(numpy.zeros(0), numpy.zeros(0), numpy.zeros(0))
+		self.folder = folder
+		self.chunk_size = chunk_size
+		self.generation = 0
+		self.writers = {}
+		os.makedirs(folder, exist_ok=True)
+		weakref.finalize(self, shutil.rmtree, folder, True)
+
+
+	def append(self, labels: numpy.ndarray, t1: numpy.ndarray, t2: numpy.ndarray, columns: dict):
+		"""Appends a chunk of arcs to the column files. Every chunk must have the same columns; the
+		types of the first chunk are kept.
+
+		Args:
+			labels (numpy.ndarray): The label of each arc
+			t1 (numpy.ndarray): The trip position of the first trip of each arc
+			t2 (numpy.ndarray): The trip position of the second trip of each arc
+			columns (dict): The other columns of the arcs, by name
+		"""
+		chunk = dict(columns, labels=numpy.asarray(labels, dtype=numpy.int64),
+			t1=numpy.asarray(t1, dtype=numpy.int32), t2=numpy.asarray(t2, dtype=numpy.int32))
+		if len(self.writers) == 0:
+			self.writers = {name: _ColumnWriter(self._path(name), values.dtype) for name, values in chunk.items()}
+		elif chunk.keys() != self.writers.keys():
+			raise ValueError('Arc chunk has columns ' + str(sorted(chunk.keys())) + ' instead of ' + str(sorted(self.writers.keys())) + '.')
+		for name, values in chunk.items():
+			self.writers[name].write(values)
+
+
+	def finish(self):
+		'''
+		closes the column files being written and maps them as the columns of the store
+		'''
+		arrays = {name: writer.close() for name, writer in self.writers.items()}
+		self.writers = {}
+		if len(arrays) == 0:
+			return
+		self.labels = numpy.asarray(arrays.pop('labels'))
+		self.t1 = numpy.asarray(arrays.pop('t1'))
+		self.t2 = numpy.asarray(arrays.pop('t2'))
+		self.columns = {}
+		for name, values in arrays.items():
+			self[name] = values
+
+
+	def compact(self, keep: numpy.ndarray):
+		"""Keeps only some of the arcs, in order, by copying them to a new generation of the column
+		files chunk_size arcs at a time. Given the masks of the chunks, only one chunk of the filter is
+		held in memory at a time.
+
+		Args:
+			keep (numpy.ndarray): A boolean array indicating which arcs to keep, the row positions of
+				the arcs to keep, in order, or an iterator of the boolean masks of consecutive chunks of
+				arcs, such as those read with chunks
+		"""
+		num_arcs = len(self)
+		if isinstance(keep, Iterator):
+			def selections(masks):
+				start = 0
+				for mask in masks:
+					yield start + numpy.flatnonzero(mask)
+					start += len(mask)
+				if start != num_arcs:
+					raise ValueError('The arc masks cover ' + str(start) + ' of ' + str(num_arcs) + ' arcs.')
+			selections = selections(keep)
+		else:
+			keep = numpy.asarray(keep)
+			if keep.dtype == bool and keep.all():
+				return
+			positions = numpy.flatnonzero(keep) if keep.dtype == bool else keep
+			selections = (positions[start:start + self.chunk_size] for start in range(0, len(positions), self.chunk_size))
+		previous_files = self._files()
+		columns = {name: self.column(name) for name in ['labels', 't1', 't2'] + list(self.columns.keys())}
+		self.generation += 1
+		self.writers = {name: _ColumnWriter(self._path(name), values.dtype) for name, values in columns.items()}
+		try:
+			for chunk in selections:
+				for name, values in columns.items():
+					self.writers[name].write(values[chunk])
+		except:
+			for writer in self.writers.values():
+				writer.discard()
+			self.writers = {}
+			self.generation -= 1
+			raise
+		self.finish()
+		for filename in previous_files:
+			#the files stay on disk while other arrays map them; the folder is removed with the store
+			try:
+				os.remove(filename)
+			except OSError:
+				pass
+
+
+	def drop(self, name: str):
+		'''
+		removes a column from the store and its file, when no other array maps it
+		'''
+		path = self._path(name)
+		super().drop(name)
+		try:
+			os.remove(path)
+		except OSError:
+			pass
+
+
+	def chunks(self, *names: str, chunk_size: int=None):
+		'''
+		yields the named columns of consecutive chunks of arcs, chunk_size arcs at a time by default
+		'''
+		return super().chunks(*names, chunk_size=self.chunk_size if chunk_size is None else chunk_size)
+
+
+	def group_members(self, name: str, num_groups: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+		'''
+		returns the CSR offsets and the arc positions sorted by the trip positions in column t1 or t2,
+		with the positions in a memory-mapped file of the store
+		'''
+		if len(self) == 0:
+			return super().group_members(name, num_groups)
+		order = npy_format.open_memmap(os.path.join(self.folder, name + '_order.' + str(self.generation) + '.npy'),
+			mode='w+', dtype=numpy.int64, shape=(len(self),))
+		offsets = group_members_chunked(self.column(name), num_groups, order, self.chunk_size)
+		order.flush()
+		return offsets, numpy.asarray(order)
+
+
+	def group_quantile(self, name: str, values_name: str, quantile: float, num_groups: int) -> numpy.ndarray:
+		'''
+		returns the quantile of column values_name among the arcs of each trip position in column t1 or t2,
+		as arc_builder.group_quantile, reading the values of the trips about chunk_size arcs at a time
+		'''
+		offsets, order = self.group_members(name, num_groups)
+		values = self.column(values_name)
+		result = numpy.full(num_groups, numpy.nan)
+		start = 0
+		while start < num_groups:
+			#the next trips whose arcs fit in a chunk, and at least one trip
+			end = max(start + 1, min(num_groups, int(numpy.searchsorted(offsets, offsets[start] + self.chunk_size, side='right')) - 1))
+			group_ids = numpy.repeat(numpy.arange(end - start), numpy.diff(offsets[start:end + 1]))
+			result[start:end] = group_quantile(group_ids, values[order[offsets[start]:offsets[end]]], quantile, end - start)
+			start = end
+		del order
+		try:
+			os.remove(os.path.join(self.folder, name + '_order.' + str(self.generation) + '.npy'))
+		except OSError:
+			pass
+		return result
+
+
+	def _path(self, name: str) -> str:
+		'''
+		returns the file of a column in the current generation
+		'''
+		return os.path.join(self.folder, name + '.' + str(self.generation) + '.npy')
+
+
+	def _files(self) -> list:
+		'''
+		returns the column files of the current generation
+		'''
+		return [self._path(name) for name in ['labels', 't1', 't2'] + list(self.columns.keys())]
+
+
+class _ColumnWriter:
+	'''
+	This class appends chunks of values to a one dimensional .npy file whose length is not known
+	until it is closed.
+	'''
+
+	__slots__ = ('path', 'dtype', 'length', 'file')
+
+	def __init__(self, path: str, dtype: numpy.dtype):
+		self.path = path
+		self.dtype = numpy.dtype(dtype)
+		self.length = 0
+		self.file = open(path, 'wb')
+		self.file.write(b'\x00' * NPY_HEADER_SIZE)
+
+
+	def write(self, values: numpy.ndarray):
+		'''
+		appends values, converted to the type of the column
+		'''
+		numpy.ascontiguousarray(values, dtype=self.dtype).tofile(self.file)
+		self.length += len(values)
+
+
+	def discard(self):
+		'''
+		closes and removes the file being written
+		'''
+		self.file.close()
+		os.remove(self.path)
+
+
+	def close(self) -> numpy.ndarray:
+		'''
+		writes the header, closes the file and returns the column as a read-only memory-mapped array
+		'''
+		self.file.seek(0)
+		npy_format.write_array_header_1_0(self.file, {
+			'descr': npy_format.dtype_to_descr(self.dtype),
+			'fortran_order': False,
+			'shape': (self.length,)})
+		header_size = self.file.tell()
+		self.file.close()
+		if header_size != NPY_HEADER_SIZE:
+			raise ValueError('The header of ' + self.path + ' has ' + str(header_size) + ' bytes instead of ' + str(NPY_HEADER_SIZE) + '.')
+		if self.length == 0:
+			#an empty array cannot be memory-mapped
+			return numpy.zeros(0, dtype=self.dtype)
+		return numpy.load(self.path, mmap_mode='r')
@@ -7,12 +7,24 @@ created: 25 September 2023
 last modified: 09 December 2023
 '''
 
+import copy
 import pandas
 import pdb
 import numpy
-import itertools
-
+import shutil
+import tempfile
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+
+import arc_builder
+import arc_planner
+import arc_pruning
+import arc_sql
+from arc_store import ARC_CHUNK_SIZE, ArcStore, DiskArcStore
+from deadhead_matrix import DeadheadMatrix
+from zip_codes import NUM_ZIP3, trip_zip3_codes, zip3_labels, zip5_labels
 from file_manager import FileManager
+from trip_arc_index import TripArcIndex
 from utils import read_csv_with_log
 import logging
 
@@ -39,7 +51,18 @@ class DataManager:
 
 			  use_int32: bool=True,
 			  min_distance: float=None,
-			  max_distance: float=None):
+			  max_distance: float=None,
+			  deadhead_matrix: DeadheadMatrix=None,
+			  arcs_per_trip: int=None,
+			  arc_budget: int=None,
+			  plan_arcs: bool=False,
+			  memory_limit_mb: float=None,
+			  build_time_target: float=None,
+			  model_backend: str='pyomo',
+			  use_lanes: bool=False,
+			  arc_storage: str='memory',
+			  arc_chunk_size: int=ARC_CHUNK_SIZE,
+			  arc_engine: str='numpy'):
 		'''
 			file_manager is an instance of the FileManager class
 			tours is a boolean field indicating whether to use tours or trips
@@ -64,9 +87,37 @@ class DataManager:
 			max_distance: a float value indicating the maximum distance that must not be 
 				exceeded by all accepted trips during optimization. Leave as None to not use a
 				maximum distance.
+			deadhead_matrix: the DeadheadMatrix built from empty_miles_df when the empty miles
+				were read. Leave as None to build it here.
+			arcs_per_trip: the number of most profitable arcs to keep leaving and entering each
+				trip, in place of trip_eligibility_quantile. The best arcs of must-take trips are always kept.
+				Leave as None to not limit the arcs per trip.
+			arc_budget: the maximum number of arcs to keep, in place of trip_eligibility_quantile.
+				The arcs per trip are lowered until the arcs fit in the budget. Leave as None to
+				not use a budget.
+			plan_arcs: a boolean indicating whether to set arcs_per_trip and arc_budget with
+				arc_planner.plan_arc_budget, from a sample of the trips, so the arcs and the model
+				fit memory_limit_mb and build_time_target. The plan is written to the run log.
+			memory_limit_mb: the memory limit of the arc plan, in megabytes. Leave as None to use
+				a share of the machine memory.
+			build_time_target: the target time of the arc plan to build the arcs and the model,
+				in seconds. Leave as None to use arc_planner.DEFAULT_BUILD_TIME_TARGET.
+			model_backend: the model backend the arc plan is made for.
+			use_lanes: a boolean indicating whether to group the trips into lanes and build the
+				arcs between lanes (get_lanes) instead of the arcs between trips, for the lane flow
+				model. arc_store then holds the trip arcs of the solution once it is solved.
+			arc_storage: where the arcs are stored, one of arc_store.ARC_STORAGES. 'disk' writes
+				the arcs to memory-mapped files under the output folder as they are enumerated and
+				prunes, compacts and indexes them arc_chunk_size arcs at a time (see build_disk_arcs).
+			arc_chunk_size: the number of arcs read or written at once by the disk arc store.
+			arc_engine: how the trip arcs and tours are enumerated, filtered and ranked, one of
+				arc_sql.ARC_ENGINES. 'duckdb' runs the join, filters, top arcs per trip and profit
+				quantile as SQL in DuckDB (see sql_arc_blocks), which needs the duckdb and pyarrow packages.
+				The lane arcs are always built with arc_builder.
 		'''
 		logger.info('Initializing DataManager')
 		self.use_tours = use_tours
+		self.use_lanes = use_lanes
 		self.file_manager = file_manager
 		self.max_deadhead = max_deadhead
 		self.use_zip3 = True
@@ -74,6 +125,11 @@ class DataManager:
 		self.min_distance = min_distance
 		self.max_distance = max_distance
 		self.trip_eligibility_quantile = trip_eligibility_quantile
+		self.arcs_per_trip = arcs_per_trip
+		self.arc_budget = arc_budget
+		self.arc_storage = arc_storage
+		self.arc_chunk_size = arc_chunk_size
+		self.arc_engine = arc_engine
 		self.trip_cols = file_manager.params['data']['trips']['columns']
 		self.margin_target = margin_target
 		required_columns = [file_manager.params['data']['trips']['columns'][x[0]] for x in file_manager.params['data']['trips']['columnRequired'].items() if x[1]]
@@ -95,8 +151,8 @@ class DataManager:
 			self.trip_cols['trip_destination_zip']: 'trip_dst_zip',
 			self.trip_cols['must_take_flag']: 'must_take_flag'
 		}, axis=1)
-		self.trip_df['trip_orgn_zip'] = self.trip_df['trip_orgn_zip'].apply(lambda x: str(x).zfill(5))
-		self.trip_df['trip_dst_zip'] = self.trip_df['trip_dst_zip'].apply(lambda x: str(x).zfill(5))
+		self.trip_df['trip_orgn_zip'] = zip5_labels(self.trip_df['trip_orgn_zip'])
+		self.trip_df['trip_dst_zip'] = zip5_labels(self.trip_df['trip_dst_zip'])
 
 		if use_int32:
 			#check for any n/a values in trip_revenue, trip_cost, or trip_distance; If there are, remove them and log a warning
@@ -119,23 +175,36 @@ class DataManager:
 
 		self.original_trip_df = self.trip_df.iloc[:]
 		self.trip_df['trip_profit'] = self.trip_df['trip_revenue'] - self.trip_df['trip_cost']
+		#every stage works on the zip3 codes of the trips; the labels are only kept for the outputs
+		self.trip_df['trip_orgn_zip3'] = trip_zip3_codes(self.trip_df['trip_orgn_zip'])
+		self.trip_df['trip_dst_zip3'] = trip_zip3_codes(self.trip_df['trip_dst_zip'])
 
 		self.empty_miles_df = empty_miles_df
 		logger.info('Empty miles data read with ' + str(self.empty_miles_df.shape[0]) + ' rows and ' + str(self.empty_miles_df.shape[1]) + ' columns')
 		if use_int32:
 			self.empty_miles_df['empty_miles'] = self.empty_miles_df['empty_miles'].astype('int32')
 			self.empty_miles_df['empty_cost'] = self.empty_miles_df['empty_cost'].astype('float32')
-		if not use_tours:
+		if deadhead_matrix is None:
+			deadhead_matrix = DeadheadMatrix.from_empty_miles_df(self.empty_miles_df)
+		self.deadhead_matrix = deadhead_matrix
+		self.arc_plan = None
+		if plan_arcs:
+			self.plan_arcs(memory_limit_mb, build_time_target, model_backend)
+		if use_lanes:
+			self.get_lanes()
+			logger.info('Lanes calculated with ' + str(len(self.lane_counts)) + ' lanes and ' + str(len(self.lane_arcs['t1'])) + ' lane arcs')
+		elif not use_tours:
 			self.get_potential_trips(quantile=trip_eligibility_quantile)
 		else:
 			self.get_potential_tours(quantile=trip_eligibility_quantile)
-		logger.info('Potential trips calculated with ' + str(self.potential_trip_df.shape[0]) + ' rows and ' + str(self.potential_trip_df.shape[1]) + ' columns')
+		if not use_lanes:
+			logger.info('Potential trips calculated with ' + str(len(self.arc_store)) + ' arcs in ' + str(round(self.arc_store.nbytes() / 2**20, 1)) + ' MB')
 		logger.info('DataManager initialized')
 
 
 	def get_deadhead_cost(self, origin_zip: str, destination_zip: str, field='empty_cost') -> float:
 		"""calculates the deadhead cost between two zip codes, using 
-		either the cost matrix or the empty miles file
+		the deadhead matrix built from the empty miles file
 
 		Args:
 			origin_zip (str): _description_
@@ -144,125 +213,205 @@ class DataManager:
 		Returns:
 			float: the deadhead cost between two zip codes
 		"""
-		try:
-			return self.empty_miles_df.loc[(str(origin_zip), str(destination_zip)), field]
-		except:
-			print('exception for ' + str(origin_zip) + ' to ' + str(destination_zip))
-			return 99999
+		return self.deadhead_matrix.lookup(origin_zip, destination_zip, field=field)
+
 
 
+	def truncate_zips_to_zip3(self):
+		'''
+		replaces the trip origin and destination zips with their zip3, padded to five characters
+		'''
+		if self.use_zip3 or self.detect_zip3():
+			self.trip_df['trip_orgn_zip'] = zip3_labels(self.trip_df['trip_orgn_zip'])
+			self.trip_df['trip_dst_zip'] = zip3_labels(self.trip_df['trip_dst_zip'])
+
 
 	def get_potential_trips(self, quantile: float=0, use_32bit: bool=True):
 		'''
 		This functions gets all possible permutations of two trip and calculates the profit of the tour.
 		The profit of the trips is measured as the profit of the first trips, minus the deadhead
 		cost between the first trip and second trip. This cost calculation is used for the tsp model. 
+
+		The permutations are enumerated by integer trip position with arc_builder, so that the
+		deadhead lookup, the profit and distance scoring and the profit and deadhead filters are
+		all done on NumPy arrays. When max_deadhead is set, only trips in zip3 buckets within the
+		deadhead radius are paired. Arcs keep the index they would have in the list of permutations.
 		'''
+		self.truncate_zips_to_zip3()
+		num_trips = self.trip_df.shape[0]
+		dst_codes = self.trip_df['trip_dst_zip3'].values
+		orgn_codes = self.trip_df['trip_orgn_zip3'].values
+
+		trip_profit = self.trip_df['trip_profit'].values
+		must_take = self.trip_df['must_take_flag'].values.astype(bool)
+		enumerate_params = {
+			'dst_codes': dst_codes,
+			'orgn_codes': orgn_codes,
+			'trip_profit': trip_profit,
+			'must_take': must_take,
+			'deadhead_matrix': self.deadhead_matrix,
+			'max_deadhead': self.max_deadhead
+		}
+		sql_blocks = None
+		if self.arc_engine == 'duckdb':
+			sql_blocks = self.sql_arc_blocks(arc_sql.trip_arc_blocks, enumerate_params, quantile if quantile > 0 else None, use_32bit=use_32bit)
+		if self.arc_storage == 'disk':
+			arc_blocks = arc_builder.trip_arc_blocks if self.max_deadhead is None else arc_builder.neighbor_arc_blocks
+			self.build_disk_arcs(
+				arc_blocks(**enumerate_params) if sql_blocks is None else sql_blocks,
+				lambda block: self.trip_arc_columns(block['t1'], block['t2'], block['empty_miles'], block['empty_cost'], use_32bit),
+				arc_builder.permutation_index,
+				quantile if quantile > 0 and sql_blocks is None else None,
+				'float32' if use_32bit else None)
+			return
+		#with a maximum deadhead, only trips in neighboring zip3 buckets need to be paired
+		if not sql_blocks is None:
+			arcs = arc_builder.collect_blocks(sql_blocks)
+		elif self.max_deadhead is None:
+			arcs = arc_builder.enumerate_trip_arcs(**enumerate_params)
+		else:
+			arcs = arc_builder.enumerate_neighbor_arcs(**enumerate_params)
 
-		def grouper_helper(x: int, grouper: pandas.core.groupby.generic.DataFrameGroupBy) -> list:
-			"""This function is a helper function for the get_potential_tours function. It returns the indices of all trips that
-			are connected to the input trip. This function is necessary to handle cases where a trip is not connected to any 
-			other trips.
-
-			Args:
-				x (int): The index of the trip to check for connections
-				grouper (pandas.core.groupby.generic.DataFrameGroupBy): the pandas grouper object 
-					containing the trip to check for connections
-
-			Returns:
-				list: A list of indices of trips that are connected to the input trip
-			"""			
-			try:
-				return [x for x in grouper.groups[x]]
-			except:
-				return []
-			
-		if self.use_zip3 or self.detect_zip3():
-			self.trip_df['trip_orgn_zip'] = self.trip_df['trip_orgn_zip'].apply(lambda x: str(x)[:3])
-			self.trip_df['trip_orgn_zip'] = self.trip_df['trip_orgn_zip'].apply(lambda x: str(x).ljust(5, '0'))
-			self.trip_df['trip_dst_zip'] = self.trip_df['trip_dst_zip'].apply(lambda x: str(x)[:3])
-			self.trip_df['trip_dst_zip'] = self.trip_df['trip_dst_zip'].apply(lambda x: str(x).ljust(5, '0'))
-		potential_trips = [x for x in itertools.permutations(self.trip_df.index.values, 2)]
-		self.potential_trip_df = pandas.DataFrame(data=potential_trips, columns=['t1', 't2'])
-		if use_32bit:
-			self.potential_trip_df['t1'] = self.potential_trip_df['t1'].astype('int32')
-			self.potential_trip_df['t2'] = self.potential_trip_df['t2'].astype('int32')
-
-		self.potential_trip_df = self.potential_trip_df.merge(
-			self.trip_df[['trip_dst_zip', 'trip_profit', 'must_take_flag', 'trip_distance', 'trip_cost', 'trip_revenue']], left_on='t1', right_index=True)
-		self.potential_trip_df = self.potential_trip_df.rename(
-			{'trip_profit': 'trip_profit1', 'trip_dst_zip': 'trip_dst_zip1', 'must_take_flag': 'must_take_orgn'}
-			, axis=1)
-		if use_32bit:
-			self.potential_trip_df['trip_profit1'] = self.potential_trip_df['trip_profit1'].astype('int32')
-			self.potential_trip_df['trip_cost'] = self.potential_trip_df['trip_cost'].astype('int32')
-			self.potential_trip_df['trip_distance'] = self.potential_trip_df['trip_distance'].astype('int32')
-			self.potential_trip_df['trip_revenue'] = self.potential_trip_df['trip_revenue'].astype('int32')
-		self.potential_trip_df = self.potential_trip_df.merge(self.trip_df[['trip_orgn_zip', 'must_take_flag']], left_on='t2', right_index=True)
-		self.potential_trip_df = self.potential_trip_df.rename(
-			{'trip_orgn_zip': 'trip_orgn_zip2', 'must_take_flag': 'must_take_dest'}, axis=1)
-
-		self.potential_trip_df = self.potential_trip_df.merge(self.empty_miles_df, left_on=['trip_dst_zip1', 'trip_orgn_zip2'], right_index=True, how='left')
 		#check if any of the empty miles are missing
-		if self.potential_trip_df['empty_cost'].isnull().any():
-			missing_rows = self.potential_trip_df[self.potential_trip_df['empty_cost'].isnull()]
-			missing_rows = missing_rows[['trip_dst_zip1', 'trip_orgn_zip2']].drop_duplicates()
-			message = 'Missing empty miles for ' + str(missing_rows.shape[0]) + ' rows. These rows will be removed from the optimization.'
+		if len(arcs['missing_pairs']) > 0:
+			message = 'Missing empty miles for ' + str(len(arcs['missing_pairs'])) + ' rows. These rows will be removed from the optimization.'
 			logger.warning(message)
 			self.file_manager.add_message_to_log(message, 'warning')
-			self.potential_trip_df = self.potential_trip_df.dropna(subset=['empty_cost'])
-			# raise ValueError(f'Missing empty miles for ' + str(missing_rows.shape[0]) + ' rows')
-		
-		self.potential_trip_df['profit'] = self.potential_trip_df['trip_profit1'] \
-									- self.potential_trip_df['empty_cost']
-		self.potential_trip_df['distance'] = self.potential_trip_df['trip_distance'] \
-									+ self.potential_trip_df['empty_miles']
-		
-		self.potential_trip_df = self.potential_trip_df[
-			(self.potential_trip_df['must_take_dest']) |
-			(self.potential_trip_df['must_take_orgn']) |
-			(self.potential_trip_df['profit'] > -2000)]
-		self.potential_trip_df['is_must_take'] = self.potential_trip_df.apply(lambda x: 1 if (x['must_take_orgn'] or x['must_take_dest']) else 0, axis=1)
-		self.potential_trip_df['profit_adj'] = self.potential_trip_df['profit'] + self.potential_trip_df['is_must_take'] * 10000
-		if use_32bit:
-			self.potential_trip_df['profit'] = self.potential_trip_df['profit'].astype('float32')
-			self.potential_trip_df['profit_adj'] = self.potential_trip_df['profit_adj'].astype('int32')
-
-
-		if self.max_deadhead is not None:
-			self.potential_trip_df = self.potential_trip_df[
-				(self.potential_trip_df['empty_miles'] <= self.max_deadhead) |
-				(self.potential_trip_df['must_take_orgn'] == True)]
-
-		if quantile > 0:
-			t1_quantile_df = self.potential_trip_df.groupby('t1')['profit'].quantile(quantile)
-			t1_quantile_df = t1_quantile_df.rename('t1_quantile')
-			t2_quantile_df = self.potential_trip_df.groupby('t2')['profit'].quantile(quantile)
-			t2_quantile_df = t2_quantile_df.rename('t2_quantile')
-			self.potential_trip_df = self.potential_trip_df.merge(t1_quantile_df, left_on='t1', right_index=True)
-			self.potential_trip_df = self.potential_trip_df.merge(t2_quantile_df, left_on='t2', right_index=True)
+			#a left merge against the empty miles would have promoted these columns to floats
+			arcs['empty_miles'] = arcs['empty_miles'].astype('float64')
+
+		t1 = arcs['t1']
+		t2 = arcs['t2']
+		profit, profit_adj = self.set_trip_arcs(t1, t2, arcs['empty_miles'], arcs['empty_cost'], use_32bit)
+
+		if not self.arcs_per_trip is None or not self.arc_budget is None:
+			self.arc_store.compact(self.prune_arcs(t1, t2, profit_adj))
+		elif quantile > 0 and sql_blocks is None:
+			t1_quantile = arc_builder.group_quantile(t1, profit, quantile, num_trips)[t1]
+			t2_quantile = arc_builder.group_quantile(t2, profit, quantile, num_trips)[t2]
 			if use_32bit:
-				self.potential_trip_df['t1_quantile'] = self.potential_trip_df['t1_quantile'].astype('float32')
-				self.potential_trip_df['t2_quantile'] = self.potential_trip_df['t2_quantile'].astype('float32')
-
-			self.potential_trip_df = self.potential_trip_df[
-				(self.potential_trip_df['profit_adj'] >= self.potential_trip_df['t1_quantile']) |
-				(self.potential_trip_df['profit_adj'] >= self.potential_trip_df['t2_quantile'])]
-		
-		
-		self.potential_trip_df['margin_improvement'] = self.potential_trip_df['profit'] - self.potential_trip_df['trip_revenue'] * self.margin_target
+				t1_quantile = t1_quantile.astype('float32')
+				t2_quantile = t2_quantile.astype('float32')
+			self.arc_store.compact((profit_adj >= t1_quantile) | (profit_adj >= t2_quantile))
+
+		self.arc_index = TripArcIndex.from_arc_store(self.trip_df.index.values, self.arc_store)
+
+
+	def set_trip_arcs(self, t1: numpy.ndarray, t2: numpy.ndarray, empty_miles: numpy.ndarray, empty_cost: numpy.ndarray,
+		use_32bit: bool=True) -> tuple[numpy.ndarray, numpy.ndarray]:
+		"""Sets arc_store to the trip arcs t1 -> t2, with the columns of trip_arc_columns. Arcs are labeled
+		with the index they would have in the list of trip permutations.
+
+		Args:
+			t1 (numpy.ndarray): The trip position of the first trip of each arc
+			t2 (numpy.ndarray): The trip position of the second trip of each arc
+			empty_miles (numpy.ndarray): The deadhead miles of each arc
+			empty_cost (numpy.ndarray): The deadhead cost of each arc
+			use_32bit (bool, optional): Whether to store the columns as 32 bit values. Defaults to True.
+
+		Returns:
+			tuple[numpy.ndarray, numpy.ndarray]: The profit and the adjusted profit of each arc
+		"""
+		columns = self.trip_arc_columns(t1, t2, empty_miles, empty_cost, use_32bit)
+		profit = columns.pop('profit')
+		self.arc_store = ArcStore(arc_builder.permutation_index(t1, t2, self.trip_df.shape[0]), t1, t2, columns)
+		return profit, columns['profit_adj']
+
+
+	def trip_arc_columns(self, t1: numpy.ndarray, t2: numpy.ndarray, empty_miles: numpy.ndarray, empty_cost: numpy.ndarray,
+		use_32bit: bool=True) -> dict:
+		"""Computes the columns of the trip arcs t1 -> t2 that the tsp model reads: the adjusted profit, the
+		margin improvement, the distance and the must-take flags of each arc, along with its profit.
+
+		Args:
+			t1 (numpy.ndarray): The trip position of the first trip of each arc
+			t2 (numpy.ndarray): The trip position of the second trip of each arc
+			empty_miles (numpy.ndarray): The deadhead miles of each arc
+			empty_cost (numpy.ndarray): The deadhead cost of each arc
+			use_32bit (bool, optional): Whether to compute the columns as 32 bit values. Defaults to True.
+
+		Returns:
+			dict: The 'profit', 'profit_adj', 'margin_improvement', 'distance' and 'flags' of each arc
+		"""
+		trip_profit = self.trip_df['trip_profit'].values
+		must_take = self.trip_df['must_take_flag'].values.astype(bool)
+		trip_profit1 = trip_profit[t1].astype('int32') if use_32bit else trip_profit[t1]
+		trip_distance = self.trip_df['trip_distance'].values[t1]
+		trip_revenue = self.trip_df['trip_revenue'].values[t1]
+		if use_32bit:
+			trip_distance = trip_distance.astype('int32')
+			trip_revenue = trip_revenue.astype('int32')
+
+		profit = trip_profit1 - empty_cost
+		is_must_take = (must_take[t1] | must_take[t2]).astype('int64')
+		profit_adj = profit + is_must_take * 10000
 		if use_32bit:
-			self.potential_trip_df['margin_improvement'] = self.potential_trip_df['margin_improvement'].astype('float32')
-		leg_idx_df = pandas.DataFrame({'t1': self.trip_df.index.values})
-		grp_from = self.potential_trip_df.groupby('t1')
-		leg_idx_df['potential_trip_idcs_from'] = leg_idx_df['t1'].apply(lambda x: grouper_helper(x, grp_from))
-		del grp_from
-	
-		grp_to = self.potential_trip_df.groupby('t2')
-		leg_idx_df['potential_trip_idcs_to'] = leg_idx_df['t1'].apply(lambda x: grouper_helper(x, grp_to))
-		del grp_to
+			profit = profit.astype('float32')
+			profit_adj = profit_adj.astype('int32')
+		margin_improvement = profit - trip_revenue * self.margin_target
+		if use_32bit:
+			margin_improvement = margin_improvement.astype('float32')
+
+		return {
+			'profit': profit,
+			'profit_adj': profit_adj,
+			'margin_improvement': margin_improvement,
+			'distance': trip_distance + empty_miles,
+			'flags': ArcStore.pack_flags(must_take_orgn=must_take[t1], must_take_dest=must_take[t2])}
+
+
+	def get_lanes(self):
+		'''
+		This function groups the trips into lanes: trips with the same origin zip3, destination zip3 and
+		must-take flag. Every trip of a lane can follow every trip of another lane at the same deadhead,
+		so the arcs between lanes replace the (trips per lane)^2 arcs between their trips. The lane arcs
+		pass the same deadhead filter as get_potential_trips, and a lane is connected to itself when it
+		has at least two trips. The profit filter of get_potential_trips depends on the trip, so it is
+		not applied.
+
+		Sets trip_lane (the lane of each trip, by trip position), lane_counts (the number of trips in
+		each lane) and lane_arcs (the lanes 't1' and 't2', 'empty_miles' and 'empty_cost' of each arc).
+		'''
+		self.truncate_zips_to_zip3()
+		dst_codes = self.trip_df['trip_dst_zip3'].values.astype(numpy.int64)
+		orgn_codes = self.trip_df['trip_orgn_zip3'].values.astype(numpy.int64)
+		must_take = self.trip_df['must_take_flag'].values.astype(bool)
+		lane_keys = (orgn_codes * (NUM_ZIP3 + 1) + dst_codes) * 2 + must_take
+		lane_keys, self.trip_lane, self.lane_counts = numpy.unique(lane_keys, return_inverse=True, return_counts=True)
+		lane_must_take = (lane_keys % 2).astype(bool)
+		lane_dst = (lane_keys // 2) % (NUM_ZIP3 + 1)
+		lane_orgn = (lane_keys // 2) // (NUM_ZIP3 + 1)
+
+		#the lanes play the part of trips, with no profit filter
+		enumerate_arcs = arc_builder.enumerate_trip_arcs if self.max_deadhead is None else arc_builder.enumerate_neighbor_arcs
+		arcs = enumerate_arcs(
+			dst_codes=lane_dst,
+			orgn_codes=lane_orgn,
+			trip_profit=numpy.full(len(lane_keys), numpy.inf),
+			must_take=lane_must_take,
+			deadhead_matrix=self.deadhead_matrix,
+			max_deadhead=self.max_deadhead)
+		if len(arcs['missing_pairs']) > 0:
+			message = 'Missing empty miles for ' + str(len(arcs['missing_pairs'])) + ' lane pairs. These pairs will be removed from the optimization.'
+			logger.warning(message)
+			self.file_manager.add_message_to_log(message, 'warning')
 
-		self.leg_idx_df = leg_idx_df.set_index(['t1'])
+		#arc enumeration skips self-loops, but two trips of the same lane can follow each other
+		lanes = numpy.flatnonzero(self.lane_counts > 1)
+		self_miles = self.deadhead_matrix.empty_miles[lane_dst[lanes], lane_orgn[lanes]]
+		self_cost = self.deadhead_matrix.empty_cost[lane_dst[lanes], lane_orgn[lanes]]
+		keep = ~numpy.isnan(self_cost)
+		if not self.max_deadhead is None:
+			keep &= (self_miles <= self.max_deadhead) | lane_must_take[lanes]
+		t1 = numpy.concatenate((arcs['t1'], lanes[keep]))
+		t2 = numpy.concatenate((arcs['t2'], lanes[keep]))
+		order = numpy.lexsort((t2, t1))
+		self.lane_arcs = {
+			't1': t1[order],
+			't2': t2[order],
+			'empty_miles': numpy.concatenate((arcs['empty_miles'], self_miles[keep]))[order].astype(numpy.float64),
+			'empty_cost': numpy.concatenate((arcs['empty_cost'], self_cost[keep]))[order].astype(numpy.float64)
+		}
 
 
 	def get_potential_tours(self, quantile=0):
@@ -271,108 +420,296 @@ class DataManager:
 		The profit of the tours is measured as the sum of the profit of the two trips, minus the deadhead
 		cost of the two trips.
 		This function considers (t1, t2) and (t2, t1) to be the same tour, since the cost will be the same.
+
+		The combinations are enumerated by integer trip position with arc_builder.enumerate_tour_arcs, which
+		gathers both deadheads from the DeadheadMatrix in one pass and applies the deadhead and profit filters
+		block by block, so only the surviving tours are materialized. Tours keep the index they would have in
+		the list of combinations.
 		'''
+		self.truncate_zips_to_zip3()
+		num_trips = self.trip_df.shape[0]
+		trip_profit = self.trip_df['trip_profit'].values
+		must_take = self.trip_df['must_take_flag'].values.astype(bool)
+		enumerate_params = {
+			'dst_codes': self.trip_df['trip_dst_zip3'].values,
+			'orgn_codes': self.trip_df['trip_orgn_zip3'].values,
+			'trip_profit': trip_profit,
+			'must_take': must_take,
+			'deadhead_matrix': self.deadhead_matrix,
+			'max_deadhead': self.max_deadhead
+		}
+		sql_blocks = None
+		if self.arc_engine == 'duckdb':
+			sql_blocks = self.sql_arc_blocks(arc_sql.tour_arc_blocks, enumerate_params, quantile)
+		if self.arc_storage == 'disk':
+			def tour_columns(block: dict) -> dict:
+				profit = trip_profit[block['t1']] + trip_profit[block['t2']] - block['deadhead1'] - block['deadhead2']
+				#the tours are ranked by their float64 adjusted profit, as in memory
+				score = profit + (must_take[block['t1']] | must_take[block['t2']]).astype(numpy.int64) * 10000
+				return dict(self.tour_arc_columns(block['t1'], block['t2'], profit), profit=profit, score=score)
+			#as in memory, the tours are filtered by the quantile of t1 even when it is 0
+			self.build_disk_arcs(arc_builder.tour_arc_blocks(**enumerate_params) if sql_blocks is None else sql_blocks, tour_columns, arc_builder.combination_index,
+				quantile if sql_blocks is None else None, 'int32')
+			return
+		if sql_blocks is None:
+			arcs = arc_builder.enumerate_tour_arcs(**enumerate_params)
+		else:
+			arcs = arc_builder.collect_blocks(sql_blocks, dtypes=arc_builder.TOUR_ARC_DTYPES)
+		if len(arcs['missing_pairs']) > 0:
+			message = 'Missing empty miles for ' + str(len(arcs['missing_pairs'])) + ' rows. These rows will be removed from the optimization.'
+			logger.warning(message)
+			self.file_manager.add_message_to_log(message, 'warning')
 
-		def grouper_helper(
-					 x: int, 
-					 grp1: pandas.core.groupby.generic.DataFrameGroupBy, 
-					 grp2: pandas.core.groupby.generic.DataFrameGroupBy) -> list:
-			"""This function is a helper function for the get_potential_tours function. It returns the 
-			indices of all trips that are connected to the input trip. This function is necessary to handle 
-			cases where a trip is not connected to any other trips.
-
-			Args:
-				x (int): The group from each grouper to check for connections
-				grp1 (pandas.core.groupby.generic.DataFrameGroupBy): The first grouper, containing the first trip in the tour
-				grp2 (pandas.core.groupby.generic.DataFrameGroupBy): The second grouper, containing the second trip in the tour
-
-			Returns:
-				list: A list of indices of trips that are connected to the input trip
-			"""			
-			ret_list = []
-			try:
-				ret_list.extend([y for y in grp1.groups[x]])
-			except:
-				pass
+		t1 = arcs['t1']
+		t2 = arcs['t2']
+		profit = trip_profit[t1] + trip_profit[t2] - arcs['deadhead1'] - arcs['deadhead2']
+		profit_adj = profit + (must_take[t1] | must_take[t2]).astype(numpy.int64) * 10000
+		if not self.arcs_per_trip is None or not self.arc_budget is None:
+			keep = self.prune_arcs(t1, t2, profit_adj)
+		elif sql_blocks is None:
+			t1_quantile = arc_builder.group_quantile(t1, profit, quantile, num_trips)[t1].astype('int32')
+			keep = profit_adj >= t1_quantile
+		else:
+			#the quantile filter was applied in SQL
+			keep = numpy.ones(len(t1), dtype=bool)
+		t1 = t1[keep]
+		t2 = t2[keep]
 
-			try:
-				ret_list.extend([y for y in grp2.groups[x]])
-			except:
-				pass
-			return ret_list
+		self.arc_store = ArcStore(arc_builder.combination_index(t1, t2, num_trips), t1, t2, self.tour_arc_columns(t1, t2, profit[keep]))
+		self.arc_index = TripArcIndex.from_arc_store(self.trip_df.index.values, self.arc_store)
 
-		if self.use_zip3 or self.detect_zip3():
-			self.trip_df['trip_orgn_zip'] = self.trip_df['trip_orgn_zip'].apply(lambda x: str(x)[:3])
-			self.trip_df['trip_orgn_zip'] = self.trip_df['trip_orgn_zip'].apply(lambda x: str(x).ljust(5, '0'))
-			self.trip_df['trip_dst_zip'] = self.trip_df['trip_dst_zip'].apply(lambda x: str(x)[:3])
-			self.trip_df['trip_dst_zip'] = self.trip_df['trip_dst_zip'].apply(lambda x: str(x).ljust(5, '0'))
-		potential_trips = [x for x in itertools.combinations(self.trip_df.index.values, 2)]
-
-		self.potential_trip_df = pandas.DataFrame(data=potential_trips, columns=['t1', 't2'])
-		del potential_trips
-
-		self.potential_trip_df = self.potential_trip_df.merge(
-			self.trip_df[['trip_orgn_zip', 'trip_dst_zip', 'trip_profit', 'must_take_flag', 'trip_revenue']], left_on='t1', right_index=True)
-
-		self.potential_trip_df = self.potential_trip_df.rename(
-			{'trip_profit': 'trip_profit1', 'trip_orgn_zip': 'trip_orgn_zip1', 'trip_dst_zip': 'trip_dst_zip1',
-			'must_take_flag': 'must_take_orgn', 'trip_revenue': 'revenue1'}, axis=1)
-		self.potential_trip_df = self.potential_trip_df.merge(self.trip_df[['trip_orgn_zip', 'trip_dst_zip', 'trip_profit', 'must_take_flag', 'trip_revenue']],
-			left_on='t2', right_index=True)
-
-		self.potential_trip_df = self.potential_trip_df.rename(
-			{'trip_profit': 'trip_profit2',  'trip_orgn_zip': 'trip_orgn_zip2', 'trip_dst_zip': 'trip_dst_zip2',
-			'must_take_flag': 'must_take_dest', 'trip_revenue': 'revenue2'}, axis=1)
-		self.potential_trip_df['deadhead1'] = self.potential_trip_df.merge(
-			self.empty_miles_df, left_on=['trip_dst_zip1', 'trip_orgn_zip2'], right_index=True)['empty_cost']
-
-		self.potential_trip_df['deadhead2'] = self.potential_trip_df.merge(
-			self.empty_miles_df, left_on=['trip_dst_zip2', 'trip_orgn_zip1'], right_index=True)['empty_cost']
-
-		self.potential_trip_df['profit'] = self.potential_trip_df['trip_profit1'] \
-									+ self.potential_trip_df['trip_profit2'] \
-									- self.potential_trip_df['deadhead1'] \
-									- self.potential_trip_df['deadhead2']
-
-		self.potential_trip_df['revenue'] = self.potential_trip_df['revenue1'] + self.potential_trip_df['revenue2']
-
-		if self.max_deadhead is not None:
-			self.potential_trip_df = self.potential_trip_df[
-				(self.potential_trip_df['must_take_dest']) |
-				(self.potential_trip_df['must_take_orgn']) |
-				(self.potential_trip_df['deadhead1'] < self.max_deadhead)]
-			self.potential_trip_df = self.potential_trip_df[
-				(self.potential_trip_df['must_take_dest']) |
-				(self.potential_trip_df['must_take_orgn']) |
-				(self.potential_trip_df['deadhead2'] < self.max_deadhead)]
-			
-		self.potential_trip_df = self.potential_trip_df[
-			(self.potential_trip_df['must_take_dest']) |
-			(self.potential_trip_df['must_take_orgn']) |
-			(self.potential_trip_df['profit'] > -2000)]
-		self.potential_trip_df['is_must_take'] = self.potential_trip_df.apply(lambda x: 1 if (x['must_take_orgn'] or x['must_take_dest']) else 0, axis=1)
-		self.potential_trip_df['profit_adj'] = self.potential_trip_df['profit'] + self.potential_trip_df['is_must_take'] * 10000
-
-		self.potential_trip_df = self.potential_trip_df.drop(columns=['deadhead1', 'deadhead2', 'must_take_orgn', 'must_take_dest', 
-			'trip_orgn_zip1', 'trip_orgn_zip2', 'trip_dst_zip1', 'trip_dst_zip2', 'revenue1', 'revenue2'])
-
-		t1_quantile_df = self.potential_trip_df.groupby('t1')['profit'].quantile(quantile).astype('int32')
-		t1_quantile_df = t1_quantile_df.rename('t1_quantile').astype('int32')
-		self.potential_trip_df = self.potential_trip_df.merge(t1_quantile_df, left_on='t1', right_index=True)
-		self.potential_trip_df = self.potential_trip_df[
-			(self.potential_trip_df['profit_adj'] >= self.potential_trip_df['t1_quantile'])]
-		self.potential_trip_df = self.potential_trip_df.drop(columns=['t1_quantile'])
-	
-		self.potential_trip_df['margin_improvement'] = self.potential_trip_df['profit'] - self.potential_trip_df['revenue'] * self.margin_target
-
-		leg_idx_df = pandas.DataFrame({'t1': self.trip_df.index.values})
-		grp_from = self.potential_trip_df.groupby('t1')
-		grp_to = self.potential_trip_df.groupby('t2')
-		leg_idx_df['potential_trip_idcs'] = leg_idx_df['t1'].apply(lambda x: grouper_helper(x, grp_from, grp_to))
-		del grp_to
-		del grp_from
-
-		self.leg_idx_df = leg_idx_df.set_index('t1')
+
+	def tour_arc_columns(self, t1: numpy.ndarray, t2: numpy.ndarray, profit: numpy.ndarray) -> dict:
+		"""Computes the columns of the tours (t1, t2) that the two tour limit model reads. The adjusted profit
+		is stored as a float32, like the margin improvement, so it keeps the fraction of the tour profit.
+
+		Args:
+			t1 (numpy.ndarray): The trip position of the first trip of each tour
+			t2 (numpy.ndarray): The trip position of the second trip of each tour
+			profit (numpy.ndarray): The profit of each tour
+
+		Returns:
+			dict: The 'profit_adj', 'margin_improvement' and 'flags' of each tour
+		"""
+		trip_revenue = self.trip_df['trip_revenue'].values
+		must_take = self.trip_df['must_take_flag'].values.astype(bool)
+		return {
+			'profit_adj': (profit + (must_take[t1] | must_take[t2]).astype(numpy.int64) * 10000).astype('float32'),
+			'margin_improvement': (profit - (trip_revenue[t1] + trip_revenue[t2]) * self.margin_target).astype('float32'),
+			'flags': ArcStore.pack_flags(must_take_orgn=must_take[t1], must_take_dest=must_take[t2])}
+
+
+	def build_disk_arcs(self, blocks: iter, arc_columns: callable, arc_labels: callable, quantile: float=None,
+		quantile_dtype: str=None):
+		"""Sets arc_store to a DiskArcStore and writes the arc blocks to it as they are enumerated, so the
+		arcs in memory are bounded by the block size. The arcs are then pruned with arc_pruning.prune_arc_chunks
+		or filtered by the per-trip profit quantile, compacted and indexed over the files arc_chunk_size arcs
+		at a time. Pruning holds the positions of the arcs it keeps, which are stored in label order, as in
+		memory; the quantiles are read a chunk of trips at a time and the filter is passed to compact one
+		chunk at a time, so the other arcs are stored in enumeration order.
+
+		Args:
+			blocks (iter): The arc blocks of arc_builder, with 't1', 't2' and 'missing_pairs'
+			arc_columns (callable): Returns the columns of a block of arcs, with their 'profit' and, when
+				the arcs are not ranked by their stored 'profit_adj', their 'score'
+			arc_labels (callable): Returns the labels of arcs from t1, t2 and the number of trips
+			quantile (float, optional): The per-trip profit quantile to filter the arcs with when they
+				are not pruned. Defaults to None (no filter).
+			quantile_dtype (str, optional): The type the quantiles are compared to the scores as. Defaults
+				to None (float64).
+		"""
+		num_trips = self.trip_df.shape[0]
+		is_pruned = not self.arcs_per_trip is None or not self.arc_budget is None
+		use_quantile = not is_pruned and not quantile is None
+		self.arc_store = DiskArcStore(self.arc_folder(), self.arc_chunk_size)
+		missing_pairs = []
+		score_name = 'profit_adj'
+		for block in blocks:
+			missing_pairs.append(block.pop('missing_pairs'))
+			columns = arc_columns(block)
+			if not use_quantile:
+				columns.pop('profit')
+			if 'score' in columns:
+				score_name = 'score'
+				if not is_pruned and not use_quantile:
+					columns.pop('score')
+			self.arc_store.append(arc_labels(block['t1'], block['t2'], num_trips), block['t1'], block['t2'], columns)
+		self.arc_store.finish()
+		missing_pairs = numpy.unique(numpy.concatenate(missing_pairs + [numpy.zeros(0, dtype=numpy.int64)]))
+		if len(missing_pairs) > 0:
+			message = 'Missing empty miles for ' + str(len(missing_pairs)) + ' rows. These rows will be removed from the optimization.'
+			logger.warning(message)
+			self.file_manager.add_message_to_log(message, 'warning')
+		logger.info('Arcs written to ' + self.arc_store.folder + ' with ' + str(len(self.arc_store)) + ' arcs in ' + \
+			str(round(self.arc_store.nbytes() / 2**20, 1)) + ' MB')
+
+		if is_pruned:
+			keep = arc_pruning.prune_arc_chunks(self.arc_store.chunks('labels', 't1', 't2', score_name), num_trips,
+				arcs_per_trip=self.arcs_per_trip,
+				arc_budget=self.arc_budget,
+				must_keep_trips=self.trip_df['must_take_flag'].values.astype(bool))
+			logger.info('Arc pruning kept ' + str(len(keep)) + ' of ' + str(len(self.arc_store)) + ' arcs.')
+		elif use_quantile:
+			#the trip arcs keep the arcs in the quantile of either trip, the tours those in the quantile of t1
+			def trip_quantile(name: str) -> numpy.ndarray:
+				values = self.arc_store.group_quantile(name, 'profit', quantile, num_trips)
+				#trips without arcs have no quantile, and no arcs to compare it to
+				return numpy.where(numpy.isnan(values), 0, values).astype(quantile_dtype)
+			t1_quantile = trip_quantile('t1')
+			if self.use_tours:
+				keep = (score >= t1_quantile[t1] for t1, score in self.arc_store.chunks('t1', score_name))
+			else:
+				t2_quantile = trip_quantile('t2')
+				keep = ((score >= t1_quantile[t1]) | (score >= t2_quantile[t2]) for t1, t2, score in self.arc_store.chunks('t1', 't2', score_name))
+			self.arc_store.drop('profit')
+		if is_pruned or use_quantile:
+			self.arc_store.compact(keep)
+			if score_name == 'score':
+				self.arc_store.drop('score')
+
+		self.arc_index = TripArcIndex.from_arc_store(self.trip_df.index.values, self.arc_store)
+
+
+	def sql_arc_blocks(self, arc_blocks: callable, enumerate_params: dict, quantile: float=None, **params):
+		"""Yields the arc blocks of arc_sql.trip_arc_blocks or arc_sql.tour_arc_blocks, which join, filter and
+		rank the arcs in DuckDB, spilling to a folder from arc_folder that is removed once the arcs are read.
+		When the arcs are pruned, SQL keeps the top arcs of each trip under arc_pruning.trip_arc_limits, and
+		prune_arcs selects the same arcs from these as from all arcs. Otherwise SQL applies the quantile filter.
+
+		Args:
+			arc_blocks (callable): arc_sql.trip_arc_blocks or arc_sql.tour_arc_blocks
+			enumerate_params (dict): The trip and deadhead arrays and the max deadhead of the arcs
+			quantile (float, optional): The per-trip profit quantile to filter the arcs with when they
+				are not pruned. Defaults to None (no filter).
+			params: The other parameters of arc_blocks
+		"""
+		if not arc_sql.is_available():
+			raise ImportError("The 'duckdb' arc engine needs the duckdb and pyarrow packages")
+		arc_limits = arc_pruning.trip_arc_limits(self.trip_df.shape[0], self.arcs_per_trip, self.trip_df['must_take_flag'].values.astype(bool))
+		if not self.arcs_per_trip is None or not self.arc_budget is None:
+			quantile = None
+		folder = self.arc_folder()
+		try:
+			yield from arc_blocks(**enumerate_params, arc_limits=arc_limits, quantile=quantile, temp_directory=folder, **params)
+		finally:
+			shutil.rmtree(folder, ignore_errors=True)
+
+
+	def arc_folder(self) -> str:
+		'''
+		returns a new folder for the arc files of a DiskArcStore or the spill files of DuckDB, under the output folder of the run, or
+		the temporary folder when the file manager has none (i.e. the DBFileManager)
+		'''
+		parent = getattr(self.file_manager, 'output_folder', None) or tempfile.gettempdir()
+		return tempfile.mkdtemp(prefix='arcs_', dir=parent)
+
+
+	def plan_arcs(self, memory_limit_mb: float=None, build_time_target: float=None, model_backend: str='pyomo'):
+		"""Sets arcs_per_trip and arc_budget from arc_planner.plan_arc_budget and writes the chosen level
+		and its estimates to the run log.
+
+		Args:
+			memory_limit_mb (float, optional): The memory limit in megabytes. Defaults to None.
+			build_time_target (float, optional): The target build time in seconds. Defaults to None.
+			model_backend (str, optional): The model backend. Defaults to 'pyomo'.
+		"""
+		self.arc_plan = arc_planner.plan_arc_budget(
+			dst_codes=self.trip_df['trip_dst_zip3'].values,
+			orgn_codes=self.trip_df['trip_orgn_zip3'].values,
+			trip_profit=self.trip_df['trip_profit'].values,
+			must_take=self.trip_df['must_take_flag'].values.astype(bool),
+			deadhead_matrix=self.deadhead_matrix,
+			max_deadhead=self.max_deadhead,
+			use_tours=self.use_tours,
+			model_backend=model_backend,
+			memory_limit_mb=memory_limit_mb,
+			build_time_target=build_time_target)
+		self.arcs_per_trip = self.arc_plan['arcs_per_trip']
+		self.arc_budget = self.arc_plan['arc_budget']
+		message = 'Arc plan for ' + str(self.trip_df.shape[0]) + ' trips: ' + \
+			', '.join(key + ' ' + str(value) for key, value in self.arc_plan.items())
+		logger.info(message)
+		self.file_manager.add_message_to_log(message, 'general')
+
+
+	def prune_arcs(self, t1: numpy.ndarray, t2: numpy.ndarray, profit_adj: numpy.ndarray) -> numpy.ndarray:
+		"""Selects the arcs kept by arcs_per_trip and arc_budget with arc_pruning.prune_arcs, ranking the
+		arcs by adjusted profit and always keeping the best arcs of must-take trips.
+
+		Args:
+			t1 (numpy.ndarray): The trip position of the first trip of each arc
+			t2 (numpy.ndarray): The trip position of the second trip of each arc
+			profit_adj (numpy.ndarray): The adjusted profit of each arc
+
+		Returns:
+			numpy.ndarray: A boolean array indicating which arcs are kept
+		"""
+		keep = arc_pruning.prune_arcs(t1, t2, profit_adj, self.trip_df.shape[0],
+			arcs_per_trip=self.arcs_per_trip,
+			arc_budget=self.arc_budget,
+			must_keep_trips=self.trip_df['must_take_flag'].values.astype(bool))
+		logger.info('Arc pruning kept ' + str(int(keep.sum())) + ' of ' + str(len(keep)) + ' arcs.')
+		return keep
+
+
+	def restrict_arcs(self, is_kept: numpy.ndarray):
+		"""Keeps only some of the arcs in arc_store and rebuilds the trip-arc index. Arcs keep
+		their labels and their order.
+
+		Args:
+			is_kept (numpy.ndarray): A boolean array indicating which arcs to keep, by row position
+		"""
+		self.arc_store.compact(is_kept)
+		self.arc_index = TripArcIndex.from_arc_store(self.arc_index.trip_index, self.arc_store)
+
+
+	def arc_components(self) -> tuple[numpy.ndarray, numpy.ndarray]:
+		"""Finds the components of the arc graph that can be solved as separate models. In the tsp
+		model every accepted arc is on a cycle of trips, so an arc between two strongly connected
+		components is never accepted; the tours of the two tour limit model only need the weakly
+		connected components.
+
+		Returns:
+			tuple[numpy.ndarray, numpy.ndarray]: The component of each trip, by trip position, and
+				the component of each arc, by row position, with -1 for arcs between components
+		"""
+		t1 = self.arc_index.t1
+		t2 = self.arc_index.t2
+		num_trips = self.arc_index.num_trips()
+		graph = scipy.sparse.coo_matrix((numpy.ones(len(t1)), (t1, t2)), shape=(num_trips, num_trips)).tocsr()
+		_, trip_components = connected_components(graph, directed=True, connection='weak' if self.use_tours else 'strong')
+		arc_components = numpy.where(trip_components[t1] == trip_components[t2], trip_components[t1], -1)
+		return trip_components, arc_components
+
+
+	def subset(self, trips: numpy.ndarray, arcs: numpy.ndarray) -> 'DataManager':
+		"""Returns a shallow copy of the DataManager restricted to some trips and arcs between them,
+		so a component of the arc graph can be solved as its own model. Trips and arcs keep their
+		index labels. The copy is sent to worker processes, so the empty miles are left out of it and
+		out of its file manager, along with the trips a DBFileManager holds; the deadhead matrix holds
+		the deadheads.
+
+		Args:
+			trips (numpy.ndarray): The trip positions to keep, in order
+			arcs (numpy.ndarray): The arc row positions to keep; both trips of each arc must be kept
+
+		Returns:
+			DataManager: The restricted DataManager
+		"""
+		subset = copy.copy(self)
+		positions = numpy.full(self.arc_index.num_trips(), -1, dtype=numpy.int64)
+		positions[trips] = numpy.arange(len(trips))
+		subset.trip_df = self.trip_df.iloc[trips]
+		subset.original_trip_df = subset.trip_df
+		arc_store = self.arc_store.take(arcs)
+		subset.arc_store = ArcStore(arc_store.labels, positions[arc_store.t1], positions[arc_store.t2], arc_store.columns)
+		subset.arc_index = TripArcIndex.from_arc_store(subset.trip_df.index.values, subset.arc_store)
+		subset.empty_miles_df = None
+		subset.file_manager = copy.copy(self.file_manager)
+		for name in ('empty_miles_df', 'trip_df'):
+			if hasattr(subset.file_manager, name):
+				setattr(subset.file_manager, name, None)
+		return subset
 
 
 	def get_accepted_trips(self,
@@ -397,38 +734,47 @@ class DataManager:
 			'trip_set': 'tour_id',
 			'trip_legs': 'tour_position'
 		}, axis='columns')
-		consolidated_accepted_trips['tour_id'] = consolidated_accepted_trips['tour_id'].apply(lambda x: int(x))
-		consolidated_accepted_trips['tour_position'] = consolidated_accepted_trips['tour_position'].apply(lambda x: int(x))
-		try:
-			consolidated_accepted_trips['prior_two_trips'] = consolidated_accepted_trips.apply(
-				lambda x: numpy.array(x['full_tour'])
-							[[(x['tour_position'] - 2) % len(x['full_tour']), (x['tour_position'] - 1) % len(x['full_tour'])]],
-				axis=1)
-
-			consolidated_accepted_trips['next_two_trips'] = consolidated_accepted_trips.apply(
-				lambda x: numpy.array(x['full_tour'])
-							[[(x['tour_position'] + 1) % len(x['full_tour']), (x['tour_position'] + 2) % len(x['full_tour'])]],
-				axis=1)
-		except:
-			pass
+		consolidated_accepted_trips['tour_id'] = consolidated_accepted_trips['tour_id'].astype('int64')
+		consolidated_accepted_trips['tour_position'] = consolidated_accepted_trips['tour_position'].astype('int64')
+
+		#the trips of all tours end to end, so the trip at position p of a tour is tour_trips[tour_offsets[tour] + p]
+		tour_codes, tour_ids = pandas.factorize(consolidated_accepted_trips['tour_id'])
+		first_rows = numpy.unique(tour_codes, return_index=True)[1]
+		full_tours = consolidated_accepted_trips['full_tour'].values[first_rows]
+		tour_lengths = numpy.array([len(x) for x in full_tours], dtype=numpy.int64)
+		tour_offsets = numpy.concatenate(([0], numpy.cumsum(tour_lengths)[:-1]))
+		tour_trips = numpy.array([x for tour in full_tours for x in tour])
+		row_lengths = tour_lengths[tour_codes]
+		row_offsets = tour_offsets[tour_codes]
+		positions = consolidated_accepted_trips['tour_position'].values
+
+		def tour_neighbors(steps: list[int]) -> pandas.Series:
+			#the trip ids steps positions away in the tour, wrapping around, as one array per row
+			neighbors = tour_trips[row_offsets[:, None] + (positions[:, None] + numpy.array(steps)) % row_lengths[:, None]] \
+				if len(positions) > 0 else numpy.empty((0, len(steps)))
+			return pandas.Series(list(neighbors), index=consolidated_accepted_trips.index, dtype=object)
+		consolidated_accepted_trips['prior_two_trips'] = tour_neighbors([-2, -1])
+		consolidated_accepted_trips['next_two_trips'] = tour_neighbors([1, 2])
+		prior_trips = tour_neighbors([-1]).str[0]
+		next_trips = tour_neighbors([1]).str[0]
+
 		output_trip_df = self.original_trip_df.merge(
 			consolidated_accepted_trips,
 			left_index=True,
 			right_index=True,
 			how='left')
 
-		output_trip_df['prior_zip'] = output_trip_df.apply(
-			lambda x: None if pandas.isnull(x['deadhead_cost']) else output_trip_df[output_trip_df['trip_id'] == \
-							x['full_tour'][int((x['tour_position'] - 1) % len(x['full_tour']))]]
-							['trip_dst_zip'].values[0],
-			axis=1)
-		output_trip_df['next_zip'] = output_trip_df.apply(
-			lambda x: None if pandas.isnull(x['deadhead_cost']) else output_trip_df[output_trip_df['trip_id'] == \
-							x['full_tour'][int((x['tour_position'] + 1) % len(x['full_tour']))]]
-							['trip_orgn_zip'].values[0],
-			axis=1)
-
-		output_trip_df['accepted'] = output_trip_df['deadhead_cost'].apply(lambda x: 0 if pandas.isnull(x) else 1)
+		#a trip_id -> position index, so the zips of the prior and next trips are a join
+		trip_positions = pandas.Series(numpy.arange(len(output_trip_df)), index=output_trip_df['trip_id'].values)
+		trip_positions = trip_positions[~trip_positions.index.duplicated()]
+		is_accepted = output_trip_df['deadhead_cost'].notnull().values
+		for column, neighbor_trips, zip_column in (('prior_zip', prior_trips, 'trip_dst_zip'), ('next_zip', next_trips, 'trip_orgn_zip')):
+			neighbor_positions = trip_positions.reindex(neighbor_trips.reindex(output_trip_df.index[is_accepted]).values).values
+			zips = numpy.full(len(output_trip_df), None, dtype=object)
+			zips[is_accepted] = output_trip_df[zip_column].values[neighbor_positions.astype(numpy.int64)]
+			output_trip_df[column] = zips
+
+		output_trip_df['accepted'] = is_accepted.astype('int64')
 		if not output_full_tour:
 			output_trip_df = output_trip_df.drop(columns=['full_tour'])
 		return output_trip_df
\ No newline at end of file
@@ -4,6 +4,8 @@ import json
 import pandas
 
 import database.database_functions as dbf
+from deadhead_matrix import DeadheadMatrix
+from zip_codes import area_labels, zip3_labels
 
 
 #this class is responsble for handling input and output to/from the database.
@@ -20,6 +22,7 @@ class DBFileManager():
 		self.use_zip3 = False
 		self.database_configs = database_configs
 		self.empty_miles_df = None
+		self.deadhead_matrix = None
 		if run_id is None:
 			self.run_id = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
 
@@ -74,10 +77,8 @@ class DBFileManager():
 			self.params['data']['trips']['columns']['must_take_flag']: 'must_take_flag'
 		}, axis=1)
 		if self.use_zip3:
-			trip_df['trip_orgn_zip'] = trip_df['trip_orgn_zip'].apply(lambda x: str(x)[:3])
-			trip_df['trip_orgn_zip'] = trip_df['trip_orgn_zip'].apply(lambda x: str(x).ljust(5, '0'))
-			trip_df['trip_dst_zip'] = trip_df['trip_dst_zip'].apply(lambda x: str(x)[:3])
-			trip_df['trip_dst_zip'] = trip_df['trip_dst_zip'].apply(lambda x: str(x).ljust(5, '0'))
+			trip_df['trip_orgn_zip'] = zip3_labels(trip_df['trip_orgn_zip'])
+			trip_df['trip_dst_zip'] = zip3_labels(trip_df['trip_dst_zip'])
 		
 		self.trip_df = trip_df
 
@@ -99,6 +100,7 @@ class DBFileManager():
 
 		Modifies:
 			self.empty_miles_df (pandas.DataFrame): The empty miles dataframe
+			self.deadhead_matrix (DeadheadMatrix): The dense zip3 deadhead matrix
 		"""	
 		self.empty_miles_df = dbf.get_empty_miles(
 			con=con,
@@ -121,11 +123,10 @@ class DBFileManager():
 			return
 		if len(self.empty_miles_df['origin_zip'].iloc[0]) == 3:
 			self.use_zip3 = True
-			self.empty_miles_df['origin_zip'] = self.empty_miles_df['origin_zip'].apply(lambda x: str(x).ljust(5, '0'))
-		self.empty_miles_df['origin_zip'] = self.empty_miles_df['origin_zip'].apply(lambda x: str(x).zfill(5))
-		self.empty_miles_df['destination_zip'] = self.empty_miles_df['destination_zip'].apply(lambda x: str(x).ljust(5, '0'))
-		self.empty_miles_df['destination_zip'] = self.empty_miles_df['destination_zip'].apply(lambda x: str(x).zfill(5))
+		self.empty_miles_df['origin_zip'] = area_labels(self.empty_miles_df['origin_zip'])
+		self.empty_miles_df['destination_zip'] = area_labels(self.empty_miles_df['destination_zip'])
 		self.empty_miles_df.set_index(['origin_zip', 'destination_zip'], inplace=True)
+		self.deadhead_matrix = DeadheadMatrix.from_empty_miles_df(self.empty_miles_df)
 
 
 	def read_params(self) -> None:
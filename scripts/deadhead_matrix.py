@@ -0,0 +1,137 @@
+'''
+This file contains the DeadheadMatrix class, a dense zip3 x zip3 lookup of empty miles and
+empty costs. Every deadhead consumer in the optimizer gathers from this matrix with integer zip3
+codes instead of looking pairs up in the (origin_zip, destination_zip) MultiIndex.
+'''
+
+import logging
+
+import numpy
+import pandas
+
+from zip_codes import NUM_ZIP3, MISSING_CODE, zip3_code, zip3_codes
+
+logger = logging.getLogger("__main__")
+
+#sentinel stored in the empty miles matrix for pairs without an entry
+MISSING_MILES = -1
+#value returned by DeadheadMatrix.lookup for pairs without an entry
+MISSING_DEADHEAD = 99999
+
+
+class DeadheadMatrix:
+	'''
+	This class holds a float32 empty cost matrix and an int32 empty miles matrix, indexed by
+	[origin zip3 code, destination zip3 code]. The matrices have one extra row and column for
+	MISSING_CODE, so gathers never need to check codes first. Missing pairs have a cost of NaN
+	and MISSING_MILES miles.
+	'''
+
+	def __init__(self, empty_miles: numpy.ndarray, empty_cost: numpy.ndarray):
+		'''
+			empty_miles: an int32 array of shape (NUM_ZIP3 + 1, NUM_ZIP3 + 1), with
+				MISSING_MILES for missing pairs
+			empty_cost: a float32 array of shape (NUM_ZIP3 + 1, NUM_ZIP3 + 1), with NaN
+				for missing pairs
+		'''
+		self.empty_miles = empty_miles
+		self.empty_cost = empty_cost
+
+
+	@classmethod
+	def from_empty_miles_df(cls, empty_miles_df: pandas.DataFrame) -> 'DeadheadMatrix':
+		"""Builds the matrix from an empty miles dataframe indexed by (origin_zip, destination_zip).
+		When a pair appears more than once, the first entry is used.
+
+		Args:
+			empty_miles_df (pandas.DataFrame): The empty miles dataframe, with empty_miles
+				and empty_cost columns
+
+		Returns:
+			DeadheadMatrix: The dense deadhead matrix
+		"""
+		origins = zip3_codes(empty_miles_df.index.get_level_values(0))
+		destinations = zip3_codes(empty_miles_df.index.get_level_values(1))
+		keep = numpy.flatnonzero((origins != MISSING_CODE) & (destinations != MISSING_CODE))
+		_, first = numpy.unique(origins[keep].astype(numpy.int64) * (NUM_ZIP3 + 1) + destinations[keep], return_index=True)
+		keep = keep[first]
+
+		rows = origins[keep]
+		cols = destinations[keep]
+		miles = empty_miles_df['empty_miles'].values[keep]
+		cost = empty_miles_df['empty_cost'].values[keep]
+		#a pair with a null cost is treated as missing
+		has_cost = ~pandas.isnull(cost)
+
+		empty_miles = numpy.full((NUM_ZIP3 + 1, NUM_ZIP3 + 1), MISSING_MILES, dtype=numpy.int32)
+		empty_cost = numpy.full((NUM_ZIP3 + 1, NUM_ZIP3 + 1), numpy.nan, dtype=numpy.float32)
+		empty_miles[rows[has_cost], cols[has_cost]] = miles[has_cost]
+		empty_cost[rows[has_cost], cols[has_cost]] = cost[has_cost]
+
+		matrix = cls(empty_miles, empty_cost)
+		logger.info('Deadhead matrix built with ' + str(int(matrix.num_pairs())) + ' zip3 pairs')
+		return matrix
+
+
+	def num_pairs(self) -> int:
+		'''
+		returns the number of zip3 pairs with an entry in the matrix
+		'''
+		return (self.empty_miles != MISSING_MILES).sum()
+
+
+	def is_missing(self, origin_codes: numpy.ndarray, destination_codes: numpy.ndarray) -> numpy.ndarray:
+		'''
+		returns a boolean array indicating which (origin, destination) code pairs have no entry
+		'''
+		return self.empty_miles[origin_codes, destination_codes] == MISSING_MILES
+
+
+	def neighbor_pairs(self, max_deadhead: float) -> tuple[numpy.ndarray, numpy.ndarray]:
+		"""Lists the zip3 pairs that are within max_deadhead empty miles of each other. The
+		pairs are sorted by origin code, so the neighbors of each origin are contiguous.
+
+		Args:
+			max_deadhead (float): The maximum empty miles between the two zip3s
+
+		Returns:
+			tuple[numpy.ndarray, numpy.ndarray]: The origin and destination codes of each pair
+		"""
+		within_radius = (self.empty_miles != MISSING_MILES) & (self.empty_miles <= max_deadhead)
+		origins, destinations = numpy.nonzero(within_radius)
+		return origins.astype(numpy.int16), destinations.astype(numpy.int16)
+
+
+	def lookup(self, origin_zip: str, destination_zip: str, field: str='empty_cost') -> float:
+		"""Looks up a single pair of zip labels.
+
+		Args:
+			origin_zip (str): The origin zip label
+			destination_zip (str): The destination zip label
+			field (str, optional): 'empty_cost' or 'empty_miles'. Defaults to 'empty_cost'.
+
+		Returns:
+			float: The deadhead cost (or miles) between the two zips, or MISSING_DEADHEAD
+				if the pair has no entry
+		"""
+		origin_code = zip3_code(origin_zip)
+		destination_code = zip3_code(destination_zip)
+		if self.empty_miles[origin_code, destination_code] == MISSING_MILES:
+			return MISSING_DEADHEAD
+		return getattr(self, field)[origin_code, destination_code]
+
+
+	def lookup_codes(self, origin_codes: numpy.ndarray, destination_codes: numpy.ndarray, field: str='empty_cost') -> numpy.ndarray:
+		"""Looks up arrays of zip3 code pairs, following the same rules as lookup.
+
+		Args:
+			origin_codes (numpy.ndarray): The origin zip3 code of each pair
+			destination_codes (numpy.ndarray): The destination zip3 code of each pair
+			field (str, optional): 'empty_cost' or 'empty_miles'. Defaults to 'empty_cost'.
+
+		Returns:
+			numpy.ndarray: The deadhead cost (or miles) of each pair, or MISSING_DEADHEAD
+				for pairs without an entry
+		"""
+		values = getattr(self, field)[origin_codes, destination_codes]
+		return numpy.where(self.is_missing(origin_codes, destination_codes), MISSING_DEADHEAD, values)
@@ -21,6 +21,8 @@ class FileManager():
 		else: 
 			self.input_folder = top_level_folder + '/input/' + input_dataset + '/'
 		self.log_file = self.output_folder + '/log.txt'
+		self.empty_miles_df = None
+		self.deadhead_matrix = None
 		self.init_log()
 		self.read_params()
 
@@ -3,8 +3,10 @@
 Author: Daniel Kinn (daniel.j.kinn@gmail.com)
 Date: 2023-11-27
 """
+import concurrent.futures
 import json
 import logging
+import multiprocessing
 import numpy
 import pandas
 import os
@@ -15,12 +17,19 @@ import uuid
 from typing import Callable
 import traceback
 
+import arc_planner
+import arc_sql
+import arc_store
+import trip_partitioner
 import database.database_functions as dbf
 import file_manager as fm
 import db_file_manager as dfm
 import data_manager as dm
 from optimization.freight_model_two_tour_limit import FreightModelTwoTourLimit
+from optimization.freight_model_lane_flow import FreightModelLaneFlow
 from optimization.freight_model_tsp import FreightModelTSP
+from deadhead_matrix import DeadheadMatrix
+from zip_codes import trip_zip3_codes
 from utils import read_csv_with_log, read_empty_miles
 
 # Create a logger
@@ -46,6 +55,12 @@ logger.addHandler(file_handler)
 # Log a message
 logger.info('Logging initialized')
 
+#ways of meeting the margin target: 'iterative' reweights margin improvement in the objective
+#between solves, 'constraint' adds the target as a linear constraint and 'dinkelbach' searches
+#for the smallest margin weight that meets the target
+MARGIN_TARGET_METHODS = ['iterative', 'constraint', 'dinkelbach']
+SPLIT_METHODS = ['geographic', 'random']
+
 def run_from_config_with_error_handling(**run_params):
     '''
     runs the code from the configuration object. The configuration object
@@ -143,6 +158,22 @@ def run_from_configuration(
         SOLVER_OPTIMALITY_GAP = 0.001
 
         SOLVER_NAME = file_manager.params['solver']['solverName']
+        MODEL_BACKEND = file_manager.params['solver'].get('modelBackend', 'pyomo')
+        PERSISTENT_SOLVER = file_manager.params['solver'].get('persistentSolver', False)
+        ARC_PRICING = file_manager.params['solver'].get('arcPricing', False)
+        ARC_BUDGET = file_manager.params['solver'].get('arcBudget')
+        MEMORY_LIMIT_MB = file_manager.params['solver'].get('memoryLimitMB')
+        BUILD_TIME_TARGET = file_manager.params['solver'].get('buildTimeTarget')
+        SPLIT = file_manager.params['solver'].get('split', 1)
+        SPLIT_WORKERS = file_manager.params['solver'].get('splitWorkers')
+        SOLVER_THREADS = file_manager.params['solver'].get('solverThreads')
+        SPLIT_METHOD = file_manager.params['solver'].get('splitMethod', 'geographic')
+        DECOMPOSE = file_manager.params['solver'].get('decomposeComponents', True)
+        ARC_STORAGE = file_manager.params['solver'].get('arcStorage', 'memory')
+        ARC_ENGINE = file_manager.params['solver'].get('arcEngine', 'numpy')
+        MARGIN_METHOD = data_filters.get('MarginTargetMethod')
+        if pandas.isnull(MARGIN_METHOD):
+            MARGIN_METHOD = 'iterative'
         # SOLVER_NAME = 'glpk'
         MARGIN_TARGET = data_filters['MarginTarget']
         if pandas.isnull(MARGIN_TARGET):
@@ -153,8 +184,10 @@ def run_from_configuration(
             MODEL = 'two_tour_limit'
         elif model_type == 'tsp':
             MODEL = 'tsp'
+        elif model_type == 'lane_flow':
+            MODEL = 'lane_flow'
         else:
-            raise ValueError('Model must be either "two_tour_limit" or "tsp"')
+            raise ValueError('Model must be one of "two_tour_limit", "tsp" or "lane_flow"')
 
         if 'MinMiles' in data_filters:
             MINIMUM_DISTANCE = data_filters['MinMiles']
@@ -164,23 +197,6 @@ def run_from_configuration(
             MAXIMUM_DISTANCE = data_filters['MaxCapacity']
 
         try:
-            if file_manager.trip_df.shape[0] < 500:
-                TRIP_ELIGIBLITY_QUANTILE = 0.0
-            elif file_manager.trip_df.shape[0] < 1000:
-                TRIP_ELIGIBLITY_QUANTILE = 0.5
-            elif file_manager.trip_df.shape[0] < 2000:
-                TRIP_ELIGIBLITY_QUANTILE = 0.75
-            elif file_manager.trip_df.shape[0] < 4000:
-                TRIP_ELIGIBLITY_QUANTILE = 0.85
-            elif file_manager.trip_df.shape[0] < 6000:
-                TRIP_ELIGIBLITY_QUANTILE = 0.9
-            elif file_manager.trip_df.shape[0] < 8000:
-                TRIP_ELIGIBLITY_QUANTILE = 0.95
-            elif file_manager.trip_df.shape[0] < 10000:
-                TRIP_ELIGIBLITY_QUANTILE = 0.97
-            else:
-                TRIP_ELIGIBLITY_QUANTILE = 0.98
-            
             res = run_optimization(trial_name=None,
                             seed=SEED,
                             num_points=NUM_POINTS,
@@ -193,9 +209,22 @@ def run_from_configuration(
                             model=MODEL,
                             trip_df=file_manager.trip_df,
                             empty_miles_df=file_manager.empty_miles_df,
-                            trip_eligibility_quantile=TRIP_ELIGIBLITY_QUANTILE,
                             min_distance=MINIMUM_DISTANCE,
-                            max_distance=MAXIMUM_DISTANCE
+                            max_distance=MAXIMUM_DISTANCE,
+                            model_backend=MODEL_BACKEND,
+                            persistent_solver=PERSISTENT_SOLVER,
+                            margin_method=MARGIN_METHOD,
+                            arc_pricing=ARC_PRICING,
+                            arc_budget=ARC_BUDGET,
+                            memory_limit_mb=MEMORY_LIMIT_MB,
+                            build_time_target=BUILD_TIME_TARGET,
+                            split=SPLIT,
+                            split_workers=SPLIT_WORKERS,
+                            solver_threads=SOLVER_THREADS,
+                            split_method=SPLIT_METHOD,
+                            decompose=DECOMPOSE,
+                            arc_storage=ARC_STORAGE,
+                            arc_engine=ARC_ENGINE
                             )
             if not progress_callback is None:
                 (file_manager, trip_df, consolidated_trip_df, data_prep_time, optimization_time, output_df) = res
@@ -254,6 +283,34 @@ def validate_optimization_parameters(params: dict, file_manager: fm.FileManager)
         warning_msg = 'margin_target is greater than 1.'
         file_manager.add_message_to_log(warning_msg, 'warning')
 
+    margin_method = params['margin_method']
+    if margin_method not in MARGIN_TARGET_METHODS:
+        err_msg = 'margin_method must be one of ' + str(MARGIN_TARGET_METHODS)
+        file_manager.add_message_to_log(err_msg, 'error')
+        raise ValueError(err_msg)
+
+    split_method = params['split_method']
+    if split_method not in SPLIT_METHODS:
+        err_msg = 'split_method must be one of ' + str(SPLIT_METHODS)
+        file_manager.add_message_to_log(err_msg, 'error')
+        raise ValueError(err_msg)
+
+    arc_storage = params['arc_storage']
+    if arc_storage not in arc_store.ARC_STORAGES:
+        err_msg = 'arc_storage must be one of ' + str(arc_store.ARC_STORAGES)
+        file_manager.add_message_to_log(err_msg, 'error')
+        raise ValueError(err_msg)
+
+    arc_engine = params['arc_engine']
+    if arc_engine not in arc_sql.ARC_ENGINES:
+        err_msg = 'arc_engine must be one of ' + str(arc_sql.ARC_ENGINES)
+        file_manager.add_message_to_log(err_msg, 'error')
+        raise ValueError(err_msg)
+    if arc_engine == 'duckdb' and not arc_sql.is_available():
+        err_msg = "arc_engine 'duckdb' needs the duckdb and pyarrow packages to be installed"
+        file_manager.add_message_to_log(err_msg, 'error')
+        raise ValueError(err_msg)
+
     solver_time_limit = params['solver_time_limit']
     if solver_time_limit < 0:
         err_msg = 'solver_time_limit must be greater than or equal to 0'
@@ -266,37 +323,282 @@ def validate_optimization_parameters(params: dict, file_manager: fm.FileManager)
 
 
 def split_dataset(trip_df: pandas.DataFrame,
-                num_splits: int=1) -> list:
-    """This function splits the dataset into num_splits parts. For
-    now, it just randomly samples the dataset into num_splits parts,
-    that are mutually exclusive and fully exhaustive.
-    #TODO: Implement a more sophisticated splitting algorithm
+                num_splits: int,
+                file_manager: fm.FileManager,
+                deadhead_matrix: DeadheadMatrix,
+                max_deadhead: float=None,
+                method: str='geographic') -> list:
+    """This function splits the dataset into num_splits parts that are mutually exclusive
+    and fully exhaustive. The 'geographic' method uses trip_partitioner.partition_trips:
+    the tours of the lane circulation of the whole dataset are kept inside a part and the
+    parts are balanced sets of neighboring regions, so few profitable connections are cut.
+    The 'random' method shuffles the trips with a fixed seed.
 
     Args:
-        trip_df (pandas.DataFrame): The trip dataframe to split
-        empty_miles_df (pandas.DataFrame): The empty miles dataframe
-            split. Only entries in empty_miles_df that appear in the
-            corresponding trip_df will be included in each split
-        num_splits (int): The number of splits to use
+        trip_df (pandas.DataFrame): The trip dataframe to split, with the input column names
+        num_splits (int): The number of splits to use, or 'auto' to choose it from the
+            number of trip arcs (trip_partitioner.DEFAULT_ARCS_PER_PART per split)
+        file_manager (fm.FileManager): The FileManager for this problem
+        deadhead_matrix (DeadheadMatrix): The deadhead matrix of the empty miles
+        max_deadhead (float, optional): The maximum deadhead. Defaults to None.
+        method (str, optional): One of SPLIT_METHODS. Defaults to 'geographic'.
 
     Returns:
         list: A list of dataframes, each representing a split
     """
-    trip_dfs = []
-    remaining_indices = trip_df.index.tolist()
-    random_seed = 1
-    numpy.random.seed(random_seed)
-    for i in range(num_splits):
-        if i == num_splits - 1:
-            split_indices = remaining_indices
+    if num_splits == 1:
+        return [trip_df]
+    if method == 'random':
+        if num_splits == 'auto':
+            num_splits = 1
+        parts = numpy.random.RandomState(1).permutation(len(trip_df)) % num_splits
+    else:
+        trip_cols = file_manager.params['data']['trips']['columns']
+        trip_profit = (trip_df[trip_cols['trip_revenue']] - trip_df[trip_cols['trip_cost']]).fillna(0).values
+        partition = trip_partitioner.partition_trips(
+            dst_codes=trip_zip3_codes(trip_df[trip_cols['trip_destination_zip']]),
+            orgn_codes=trip_zip3_codes(trip_df[trip_cols['trip_origin_zip']]),
+            trip_profit=trip_profit,
+            deadhead_matrix=deadhead_matrix,
+            max_deadhead=max_deadhead,
+            num_parts=None if num_splits == 'auto' else num_splits)
+        num_splits = partition['num_parts']
+        parts = partition['parts']
+        file_manager.add_message_to_log('Split ' + str(len(trip_df)) + ' trips (' + str(partition['num_trip_arcs']) + \
+            ' trip arcs) into ' + str(num_splits) + ' parts of ' + ', '.join(str(x) for x in partition['part_sizes']) + \
+            ' trips; ' + str(round(100 * partition['cut_value_fraction'], 2)) + '% of the lane circulation profit of ' + \
+            str(round(partition['circulation_value'], 2)) + ' is on arcs cut between parts', message_type='general')
+
+    return [trip_df.iloc[numpy.flatnonzero(parts == i)] for i in range(num_splits)]
+
+
+def create_freight_model(model: str,
+                         data_manager: dm.DataManager,
+                         file_manager: fm.FileManager,
+                         **model_params):
+    """Creates the optimization model object for a model name.
+
+    Args:
+        model (str): The model to be used; must be one of ['tsp', 'two_tour_limit', 'lane_flow']
+        data_manager (dm.DataManager): The DataManager for this problem
+        file_manager (fm.FileManager): The FileManager for this problem
+        model_params: keyword arguments passed to the FreightModel constructor
+
+    Returns:
+        FreightModel: The model object
+    """
+    if model == 'two_tour_limit':
+        return FreightModelTwoTourLimit(data_manager, file_manager, **model_params)
+    elif model == 'tsp':
+        return FreightModelTSP(data_manager, file_manager, **model_params)
+    elif model == 'lane_flow':
+        return FreightModelLaneFlow(data_manager, file_manager, **model_params)
+    raise ValueError('model must be one of "two_tour_limit", "tsp" or "lane_flow"')
+
+
+def get_margin(consolidated_trip_df: pandas.DataFrame) -> float:
+    '''
+    returns the overall margin of a solution; a solution without revenue has a margin of 0
+    if it has no profit, and 1 otherwise
+    '''
+    if consolidated_trip_df['revenue'].sum() == 0:
+        if consolidated_trip_df['profit'].sum() == 0:
+            return 0
+        return 1
+    return consolidated_trip_df['profit'].sum() / consolidated_trip_df['revenue'].sum()
+
+
+def solve_with_margin_constraint(model: str,
+                                 data_manager: dm.DataManager,
+                                 file_manager: fm.FileManager,
+                                 model_params: dict,
+                                 solve_params: dict) -> tuple[pandas.DataFrame, pandas.DataFrame, int]:
+    """Meets the margin target exactly with a single solve, by adding the linear constraint
+    sum(profit * x) >= margin_target * sum(revenue * x) to the model. If the constraint makes the
+    model infeasible (i.e. must-take trips cannot meet the target), the model is solved again
+    without it.
+
+    Args:
+        model (str): The model to be used; must be one of ['tsp', 'two_tour_limit', 'lane_flow']
+        data_manager (dm.DataManager): The DataManager for this problem
+        file_manager (fm.FileManager): The FileManager for this problem
+        model_params (dict): keyword arguments for the FreightModel constructor
+        solve_params (dict): keyword arguments for FreightModel.solve
+
+    Returns:
+        tuple[pandas.DataFrame, pandas.DataFrame, int]: The consolidated trip dataframe, the
+            trip leg dataframe and the number of solves
+    """
+    opt = create_freight_model(model, data_manager, file_manager, margin_constraint=True, **model_params)
+    try:
+        consolidated_trip_df, out_trip_df = opt.solve(**solve_params)
+        return consolidated_trip_df, out_trip_df, 1
+    except ValueError:
+        if not opt.termination_condition in ['infeasible', 'infeasibleOrUnbounded']:
+            raise
+    logger.info('The margin target constraint is infeasible; solving without it.')
+    opt = create_freight_model(model, data_manager, file_manager, **model_params)
+    consolidated_trip_df, out_trip_df = opt.solve(**solve_params)
+    return consolidated_trip_df, out_trip_df, 2
+
+
+def solve_with_margin_search(model: str,
+                             data_manager: dm.DataManager,
+                             file_manager: fm.FileManager,
+                             model_params: dict,
+                             solve_params: dict,
+                             max_solves: int=30) -> tuple[pandas.DataFrame, pandas.DataFrame, int]:
+    """Finds the smallest margin weight whose solution meets the margin target, with a
+    Dinkelbach-style parametric search. Each solution x is a line in the weight w:
+    profit_adj(x) + w * margin_improvement(x). The search keeps the best solution on each side of
+    the target (the empty solution always meets it), solves at the weight where their lines cross,
+    and stops when that solve finds nothing above the crossing, which makes the weight a
+    breakpoint. Each solve either ends the search or replaces one side, so it converges in a
+    finite (and in practice small) number of solves. The profit and slack of each solution are
+    read from the arc store after its solve, which the lane flow model sets to the arcs of its solution.
+
+    Args:
+        model (str): The model to be used; must be one of ['tsp', 'two_tour_limit', 'lane_flow']
+        data_manager (dm.DataManager): The DataManager for this problem
+        file_manager (fm.FileManager): The FileManager for this problem
+        model_params (dict): keyword arguments for the FreightModel constructor
+        solve_params (dict): keyword arguments for FreightModel.solve
+        max_solves (int, optional): The maximum number of solves. Defaults to 30.
+
+    Returns:
+        tuple[pandas.DataFrame, pandas.DataFrame, int]: The consolidated trip dataframe, the
+            trip leg dataframe and the number of solves
+    """
+    feasible = {'profit': 0, 'slack': 0, 'results': None}
+    infeasible = None
+    margin_weight = 0
+    warm_start_values = []
+    opt = None
+    num_solves = 0
+    while num_solves < max_solves:
+        num_solves += 1
+        if model_params.get('persistent') and not opt is None:
+            opt.margin_weight = margin_weight
+        else:
+            opt = create_freight_model(model, data_manager, file_manager, margin_weight=margin_weight, **model_params)
+        solve_start = time.time()
+        results = opt.solve(warm_start_values=warm_start_values, **solve_params)
+        #the lane flow model replaces the arc store with the arcs of its solution on every solve.
+        #the slack is summed as floats, as the solver sees it, so small negative slacks are not truncated to 0
+        is_accepted = numpy.round(opt.solution) == 1
+        solution = {
+            'profit': data_manager.arc_store['profit_adj'][is_accepted].sum(dtype=numpy.float64),
+            'slack': data_manager.arc_store['margin_improvement'][is_accepted].sum(dtype=numpy.float64),
+            'results': results}
+        logger.info('Margin search solve ' + str(num_solves) + ': weight ' + str(round(margin_weight, 6)) + ', margin ' + \
+            str(round(get_margin(results[0]), 4)) + ', ' + str(round(time.time() - solve_start, 2)) + ' seconds')
+        warm_start_values = [x for x in opt.accepted_idcs]
+
+        if num_solves > 1:
+            crossing = feasible['profit'] + margin_weight * feasible['slack']
+            if solution['profit'] + margin_weight * solution['slack'] <= crossing + 1e-6 * max(1, abs(crossing)):
+                if solution['slack'] >= 0 and solution['profit'] > feasible['profit']:
+                    feasible = solution
+                break
+        if solution['slack'] >= 0:
+            feasible = solution
+            if num_solves == 1: #the unweighted optimum already meets the target
+                break
         else:
-            split_indices = trip_df.sample(frac=1/num_splits).index.tolist()
-        iter_trip_df = trip_df.loc[split_indices]
-        trip_dfs.append(iter_trip_df)
-        remaining_indices = [x for x in remaining_indices if x not in split_indices]
+            infeasible = solution
+        margin_weight = (infeasible['profit'] - feasible['profit']) / (feasible['slack'] - infeasible['slack'])
+
+    if feasible['results'] is None: #only the empty solution meets the target
+        return (*infeasible['results'], num_solves)
+    return (*feasible['results'], num_solves)
+
+
+def optimize_split(iter_trip_df: pandas.DataFrame,
+                   file_manager: fm.FileManager,
+                   model: str,
+                   data_manager_params: dict,
+                   model_params: dict,
+                   solve_params: dict,
+                   margin_target: float,
+                   margin_method: str,
+                   arc_pricing: bool,
+                   data_manager: dm.DataManager=None) -> tuple[pandas.DataFrame, pandas.DataFrame, float, float]:
+    """Builds the DataManager of one split of the dataset and solves it, meeting the margin target
+    with margin_method. Splits are independent, so this runs in a worker process when
+    run_optimization solves the splits in parallel; everything it needs is passed in.
+
+    Args:
+        iter_trip_df (pandas.DataFrame): The trips of this split
+        file_manager (fm.FileManager): The FileManager for this problem
+        model (str): The model to be used; must be one of ['tsp', 'two_tour_limit', 'lane_flow']
+        data_manager_params (dict): keyword arguments for the DataManager constructor
+        model_params (dict): keyword arguments for the FreightModel constructor
+        solve_params (dict): keyword arguments for FreightModel.solve
+        margin_target (float): The margin target
+        margin_method (str): How the margin target is met; one of MARGIN_TARGET_METHODS
+        arc_pricing (bool): Whether to select the arcs by column generation before solving
+        data_manager (dm.DataManager, optional): A DataManager already built for this split.
+            Defaults to None, meaning it is built from iter_trip_df.
+
+    Returns:
+        tuple[pandas.DataFrame, pandas.DataFrame, float, float]: The consolidated results, the
+            accepted trips output, the data prep time and the optimization time of the split
+    """
+    start = time.time()
+    if data_manager is None:
+        data_manager = dm.DataManager(file_manager, trip_df=iter_trip_df, **data_manager_params)
+    data_prep_time = time.time() - start
+    start = time.time()
+    verbose = model_params['verbose']
+    persistent_solver = model_params['persistent']
+    if arc_pricing and not data_manager.use_lanes:
+        create_freight_model(model, data_manager, file_manager, margin_weight=0, **model_params).price_arcs()
+    if margin_target > 0 and margin_method == 'constraint':
+        consolidated_trip_df, out_trip_df, iters = solve_with_margin_constraint(model, data_manager, file_manager, model_params, solve_params)
+    elif margin_target > 0 and margin_method == 'dinkelbach':
+        consolidated_trip_df, out_trip_df, iters = solve_with_margin_search(model, data_manager, file_manager, model_params, solve_params)
+    else:
+        iters = 0
+        warm_start_values = []
+        margin_weight = 0
+        opt = None
+        while iters < 30:
+            iters += 1
+            if persistent_solver and not opt is None:
+                opt.margin_weight = margin_weight
+            else:
+                opt = create_freight_model(model, data_manager, file_manager, margin_weight=margin_weight, **model_params)
+            consolidated_trip_df, out_trip_df = opt.solve(warm_start_values=warm_start_values, **solve_params)
+            current_margin = get_margin(consolidated_trip_df)
+
+            if verbose:
+                print ('Margin for iteration ', iters, ' is ', current_margin)
+            if margin_target > 0 and current_margin < margin_target:
+                warm_start_values = [x for x in opt.accepted_idcs]
+                #the margin improvement of an arc is its profit less margin_target times its revenue
+                is_warm_start = numpy.isin(data_manager.arc_store.labels, warm_start_values)
+                current_objective = consolidated_trip_df['profit'].sum()
+                off_by = -data_manager.arc_store['margin_improvement'][is_warm_start].sum(dtype=numpy.float64) / current_objective
+                margin_weight *= (1+iters/100)
+                margin_weight += off_by * (2*iters)
         
-    return trip_dfs
+            else:
+                break
 
+    current_margin = get_margin(consolidated_trip_df)
+    if margin_target > 0:
+        file_manager.add_message_to_log('Margin target method ' + margin_method + ': ' + str(iters) + ' solves in ' + \
+            str(round(time.time() - start, 2)) + ' seconds, margin ' + str(round(current_margin, 4)), message_type='general')
+
+    if current_margin < margin_target:
+        message = 'Unable to meet margin threshold. Please try again with a lower margin target or higher margin trips.'
+        if data_manager.trip_df['must_take_flag'].sum() > 0:
+            message += ' It is possible that some of the must-take trips are preventing the margin target from being met.'
+        file_manager.add_message_to_log(message, 'error')
+
+    optimization_time = time.time() - start
+    output_df = data_manager.get_accepted_trips(out_trip_df)
+    return consolidated_trip_df, output_df, data_prep_time, optimization_time
 
 
 def run_optimization(trial_name: str,
@@ -317,7 +619,20 @@ def run_optimization(trial_name: str,
                      empty_miles_df: pandas.DataFrame=None,
                      min_distance: int=None,
                      max_distance: int=None,
-                     split: int=1):
+                     split: int=1,
+                     model_backend: str='pyomo',
+                     persistent_solver: bool=False,
+                     margin_method: str='iterative',
+                     arc_pricing: bool=False,
+                     arc_budget: int=None,
+                     memory_limit_mb: float=None,
+                     build_time_target: float=None,
+                     split_workers: int=None,
+                     solver_threads: int=None,
+                     split_method: str='geographic',
+                     decompose: bool=True,
+                     arc_storage: str='memory',
+                     arc_engine: str='numpy'):
     """This function runs the optimization, using the input parameters
 
     Args:
@@ -337,16 +652,69 @@ def run_optimization(trial_name: str,
         trip_eligibility_quantile (float, optional): The trip eligibility
             quantile to use for cutting out unlikely connections. Setting this
             parameter to higher values will speed up run-times. Maximum value
-            is 1. Defaults to 0.
+            is 1. Defaults to 0, meaning the arcs of each split are planned from
+            memory_limit_mb and build_time_target with arc_planner.
         model (str, optional): The model to be used; must be one of
-            ['tsp', 'two_tour_limit']. Defaults to 'two_tour_limit'.
+            ['tsp', 'two_tour_limit', 'lane_flow']. Defaults to 'two_tour_limit'. 'lane_flow'
+            solves the tsp model on lanes of trips with the same origin zip3, destination zip3 and
+            must-take flag, with no profit filter on the arcs between lanes.
         verbose (bool, optional): Whether to print debugging messages to
             console. Defaults to False.
         data_manager (dm.DataManager, optional): A DataManager instance
             to use for this problem. Defaults to None, meaning the DataManager
             class will be instantiated from this function.
-        split: int, optional: The number of splits to use for the optimization. Defaults to 1,
-            meaning no splits are used. 
+        split: int, optional: The number of splits to use for the optimization, or 'auto' to
+            choose it from the size of the dataset. Defaults to 1, meaning no splits are used.
+            The minimum and maximum distance are shared between the splits by number of trips.
+        model_backend (str, optional): How the model is built and handed to the solver;
+            must be one of ['pyomo', 'matrix', 'network', 'lagrangian']. 'matrix' writes the
+            model arrays straight to an LP file for the solver executable; 'network' solves the
+            model with no solver, as an assignment problem for the TSP model without distance
+            bounds and as a maximum weight matching for the two tour limit model; 'lagrangian'
+            relaxes the TSP distance bounds into the objective and solves a series of assignment
+            problems, logging the gap to its dual bound. Defaults to 'pyomo'.
+        persistent_solver (bool, optional): Whether to build the model once per split and
+            keep the solver instance alive through the margin target iterations, updating
+            only the margin weight of the objective. Defaults to False.
+        margin_method (str, optional): How the margin target is met; must be one of
+            MARGIN_TARGET_METHODS. 'iterative' reweights margin improvement in the
+            objective for up to 30 solves, 'constraint' enforces the target with one
+            linear constraint, and 'dinkelbach' runs a parametric search for the
+            smallest margin weight that meets the target. Defaults to 'iterative'.
+        arc_pricing (bool, optional): Whether to select the arcs of each split by column
+            generation instead of the trip eligibility quantile. All arcs within max_deadhead
+            are generated, the model starts from the best arcs of each trip, and arcs are
+            added while their reduced cost in the LP relaxation is positive; the model is
+            then solved on the priced arcs. Defaults to False.
+        arc_budget (int, optional): The maximum number of arcs per split. When set, each
+            trip keeps its most profitable arcs in and out (and all must-take arcs) up to
+            the budget, in place of the trip eligibility quantile. Defaults to None.
+        memory_limit_mb (float, optional): The memory limit used to plan the arcs of each
+            split when no trip eligibility quantile, arc budget or arc pricing is given.
+            Defaults to None, meaning a share of the machine memory.
+        build_time_target (float, optional): The target time, in seconds, to build the arcs
+            and the model of each split when the arcs are planned. Defaults to None, meaning
+            arc_planner.DEFAULT_BUILD_TIME_TARGET.
+        split_workers (int, optional): The number of worker processes that solve the splits
+            in parallel. Each split builds its own DataManager. Defaults to None, meaning one
+            worker per split up to the number of cores; 1 solves the splits in this process.
+        solver_threads (int, optional): The maximum number of threads of each solve. Defaults
+            to None, meaning the cores divided by split_workers when the splits run in parallel,
+            and the solver default otherwise. The components of a decomposed split share them.
+        split_method (str, optional): How the dataset is split; must be one of SPLIT_METHODS.
+            Defaults to 'geographic'; see split_dataset.
+        decompose (bool, optional): Whether to solve the components of the arc graph of each
+            split as separate models, in parallel worker processes, when there are no distance
+            bounds or margin constraint across them. Unlike splitting, this gives the same result
+            as one model. The models share the solver time limit. Defaults to True.
+        arc_storage (str, optional): Where the arcs of each split are stored; must be one of
+            arc_store.ARC_STORAGES. 'disk' writes the arcs to memory-mapped files under the output
+            folder in chunks, so arc generation and pruning do not need the whole arc table in
+            memory. Defaults to 'memory'.
+        arc_engine (str, optional): How the arcs of each split are enumerated, filtered and ranked;
+            must be one of arc_sql.ARC_ENGINES. 'duckdb' runs the arc pipeline as SQL in an embedded
+            DuckDB database, on all cores and spilling to disk, and needs the duckdb and pyarrow
+            packages. It gives the same arcs as 'numpy'. Defaults to 'numpy'.
     """   
 
     if file_manager is None:
@@ -361,18 +729,37 @@ def run_optimization(trial_name: str,
             'SOLVER_OPTIMALITY_GAP': solver_optimality_gap,
             'MARGIN_TARGET': margin_target,
             'MODEL': model,
-            'TRIP_ELIGIBILITY_QUANTILE': trip_eligibility_quantile
+            'TRIP_ELIGIBILITY_QUANTILE': trip_eligibility_quantile,
+            'MODEL_BACKEND': model_backend,
+            'PERSISTENT_SOLVER': persistent_solver,
+            'MARGIN_METHOD': margin_method,
+            'ARC_PRICING': arc_pricing,
+            'ARC_BUDGET': arc_budget,
+            'MEMORY_LIMIT_MB': memory_limit_mb,
+            'BUILD_TIME_TARGET': build_time_target,
+            'SPLIT': split,
+            'SPLIT_WORKERS': split_workers,
+            'SOLVER_THREADS': solver_threads,
+            'SPLIT_METHOD': split_method,
+            'DECOMPOSE': decompose,
+            'ARC_STORAGE': arc_storage,
+            'ARC_ENGINE': arc_engine
         })
 
     validate_optimization_parameters({
         'solver_optimality_gap': solver_optimality_gap,
         'max_deadhead': max_deadhead,
         'margin_target': margin_target,
-        'solver_time_limit': solver_time_limit
+        'solver_time_limit': solver_time_limit,
+        'margin_method': margin_method,
+        'split_method': split_method,
+        'arc_storage': arc_storage,
+        'arc_engine': arc_engine
     }, file_manager)
 
     start = time.time()
     use_tours = model == 'two_tour_limit' #use_tours parameter is only used in the two_tour_limit model
+    use_lanes = model == 'lane_flow'
     optimization_time = 0
     data_prep_time = 0
     if trip_df is None or empty_miles_df is None:
@@ -387,109 +774,93 @@ def run_optimization(trial_name: str,
         		)
     if empty_miles_df is None:
         empty_miles_df = read_empty_miles(file_manager)
+    if empty_miles_df is file_manager.empty_miles_df:
+        deadhead_matrix = file_manager.deadhead_matrix
+    else:
+        deadhead_matrix = DeadheadMatrix.from_empty_miles_df(empty_miles_df)
 
-    trip_dfs = split_dataset(trip_df, split)
+    trip_dfs = split_dataset(trip_df, split, file_manager, deadhead_matrix, max_deadhead, split_method)
+    split = len(trip_dfs)
     all_output_df = []
     all_consolidated_trip_df = []
-    if min_distance is not None:
-        iter_min_distance = int(min_distance / split)
-    else:
-        iter_min_distance = None
-    if max_distance is not None:
-        iter_max_distance = int(max_distance / split)
-    else:
-        iter_max_distance = None
+    if split > 1 and not data_manager is None:
+        err_msg = 'A DataManager can only be passed to run_optimization with split=1; each split builds its own.'
+        file_manager.add_message_to_log(err_msg, 'error')
+        raise ValueError(err_msg)
+    if split_workers is None:
+        split_workers = min(split, os.cpu_count() or 1)
+    split_workers = max(1, min(split_workers, split))
+    if split_workers > 1:
+        #the splits solved at the same time share the cores and the memory
+        if solver_threads is None:
+            solver_threads = max(1, (os.cpu_count() or 1) // split_workers)
+        if memory_limit_mb is None:
+            memory_limit_mb = arc_planner.default_memory_limit_mb()
+        memory_limit_mb /= split_workers
+    #the components of each split are solved by the cores left to it
+    component_workers = max(1, (os.cpu_count() or 1) // split_workers)
+
+    #without an explicit quantile, budget or arc pricing, the arcs are planned from a sample of the trips
+    #the lane flow model has no trip arcs to plan or price
+    plan_arcs = trip_eligibility_quantile == 0 and arc_budget is None and not arc_pricing and not use_lanes
+    data_manager_params = {
+        'use_tours': use_tours,
+        'seed': seed,
+        'random_selection': num_points,
+        'max_deadhead': max_deadhead,
+        'trip_eligibility_quantile': trip_eligibility_quantile,
+        'margin_target': margin_target,
+        'empty_miles_df': empty_miles_df,
+        'deadhead_matrix': deadhead_matrix,
+        'arc_budget': arc_budget,
+        'plan_arcs': plan_arcs,
+        'memory_limit_mb': memory_limit_mb,
+        'build_time_target': build_time_target,
+        'model_backend': model_backend,
+        'use_lanes': use_lanes,
+        'arc_storage': arc_storage,
+        'arc_engine': arc_engine
+    }
+    #each split gets a share of the distance bounds in proportion to its trips
+    split_data_manager_params = []
     for iter_trip_df in trip_dfs:
+        share = len(iter_trip_df) / len(trip_df)
+        split_data_manager_params.append(dict(data_manager_params,
+            min_distance=None if min_distance is None else int(min_distance * share),
+            max_distance=None if max_distance is None else int(max_distance * share)))
+    model_params = {
+        'verbose': verbose,
+        'write_model': write_model,
+        'persistent': persistent_solver
+    }
+    solve_params = {
+        'solver_name': solver_name,
+        'solver_time_limit': solver_time_limit,
+        'optimality_gap': solver_optimality_gap,
+        'backend': model_backend,
+        'solver_threads': solver_threads,
+        'decompose': decompose,
+        'component_workers': component_workers
+    }
+    split_params = (model_params, solve_params, margin_target, margin_method, arc_pricing)
+    if split_workers > 1:
+        #spawned workers do not inherit the threads of the caller (e.g. the GUI); results come back in split order
+        with concurrent.futures.ProcessPoolExecutor(max_workers=split_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(optimize_split, iter_trip_df, file_manager, model, iter_params, *split_params)
+                for iter_trip_df, iter_params in zip(trip_dfs, split_data_manager_params)]
+            split_results = [future.result() for future in futures]
+        file_manager.add_message_to_log('Solved ' + str(split) + ' splits with ' + str(split_workers) + ' workers and ' + \
+            str(solver_threads) + ' solver threads each', message_type='general')
+    else:
+        split_results = [optimize_split(iter_trip_df, file_manager, model, iter_params, *split_params, data_manager=data_manager)
+            for iter_trip_df, iter_params in zip(trip_dfs, split_data_manager_params)]
 
-        if iter_trip_df.shape[0] < 500:
-            trip_eligibility_quantile = 0.0
-        elif iter_trip_df.shape[0] < 1000:
-            trip_eligibility_quantile = 0.5
-        elif iter_trip_df.shape[0] < 2000:
-            trip_eligibility_quantile = 0.75
-        elif iter_trip_df.shape[0] < 4000:
-            trip_eligibility_quantile = 0.85
-        elif iter_trip_df.shape[0] < 6000:
-            trip_eligibility_quantile = 0.9
-        elif iter_trip_df.shape[0] < 8000:
-            trip_eligibility_quantile = 0.95
-        elif iter_trip_df.shape[0] < 10000:
-            trip_eligibility_quantile = 0.97
-        else:
-            trip_eligibility_quantile = 0.98
-        if data_manager is None:
-            data_manager = dm.DataManager(file_manager, use_tours=use_tours, seed=seed, random_selection=num_points, max_deadhead=max_deadhead, 
-                                        trip_eligibility_quantile=trip_eligibility_quantile, margin_target=margin_target,
-                                        trip_df=iter_trip_df, empty_miles_df=empty_miles_df, min_distance=iter_min_distance, 
-                                        max_distance=iter_max_distance)
-        end = time.time()
-        data_prep_time += end-start
-        start = time.time()
-        iters = 0
-        warm_start_values = []
-        margin_weight = 0
-        while iters < 30:
-            iters += 1
-            if model == 'two_tour_limit':
-                opt = FreightModelTwoTourLimit(data_manager,
-                                                file_manager,
-                                                verbose=verbose,
-                                                margin_weight=margin_weight,
-                                                write_model=write_model)
-            elif model == 'tsp':
-                opt = FreightModelTSP(data_manager,
-                                    file_manager,
-                                    verbose=verbose,
-                                    margin_weight=margin_weight,
-                                    write_model=write_model)
-            else: 
-                raise ValueError('model must be either "two_tour_limit" or "tsp"')
-            consolidated_trip_df, out_trip_df = opt.solve(warm_start_values=warm_start_values,
-                                                    solver_name=solver_name,
-                                                    solver_time_limit=solver_time_limit,
-                                                    optimality_gap=solver_optimality_gap)
-            
-            if consolidated_trip_df['revenue'].sum() == 0:
-                if consolidated_trip_df['profit'].sum() == 0:
-                    current_margin = 0
-                else:
-                    current_margin = 1
-            else:
-                current_margin = consolidated_trip_df['profit'].sum() / consolidated_trip_df['revenue'].sum()
-
-            if verbose:
-                print ('Margin for iteration ', iters, ' is ', current_margin)
-            if margin_target > 0 and current_margin < margin_target:
-                warm_start_values = [x for x in opt.accepted_idcs]
-                target_off_by = data_manager.potential_trip_df.loc[warm_start_values]
-                current_objective = consolidated_trip_df['profit'].sum()
-                off_by = -(target_off_by['profit'] - target_off_by['trip_revenue'] * margin_target).sum() / current_objective
-                # off_by = -target_off_by['margin_improvement'].sum()  / float(current_objective)
-                margin_weight *= (1+iters/100)
-                margin_weight += off_by * (2*iters)
-        
-            else:
-                break
-
-        if current_margin < margin_target:
-            message = 'Unable to meet margin threshold. Please try again with a lower margin target or higher margin trips.'
-            if data_manager.trip_df['must_take_flag'].sum() > 0:
-                message += ' It is possible that some of the must-take trips are preventing the margin target from being met.'
-            file_manager.add_message_to_log(message, 'error')
-
-        end = time.time()
-        optimization_time += end-start
-        # if verbose:
-        #     print ("data prep time: ", data_prep_time)
-        #     print ("optimization time: ", optimization_time)
-
-        #     print('total time: ', end-start)
-        #     print ('total profit: ', consolidated_trip_df['profit'].sum())
-        #     print ('total time: ', end-start)   
-        
-        iter_output_df = data_manager.get_accepted_trips(out_trip_df)
+    for consolidated_trip_df, iter_output_df, split_data_prep_time, split_optimization_time in split_results:
         all_output_df.append(iter_output_df)
         all_consolidated_trip_df.append(consolidated_trip_df)
+        data_prep_time += split_data_prep_time
+        optimization_time += split_optimization_time
+    end = time.time()
 
     output_df = pandas.concat(all_output_df)
     consolidated_trip_df = pandas.concat(all_consolidated_trip_df)
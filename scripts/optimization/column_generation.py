@@ -0,0 +1,102 @@
+'''
+This file contains the arc pricing loop (column generation) for the optimization models. Instead of
+discarding arcs up front with a profit quantile, the model starts from a small set of arcs, solves
+the LP relaxation on that set and uses the duals of its constraint rows to price every arc left out.
+Arcs whose reduced cost shows they would improve the relaxation are added and the loop repeats until
+none price out; the MIP is then solved on the final set.
+'''
+
+import logging
+
+import numpy
+import scipy.optimize
+
+from arc_pruning import prune_arcs
+from trip_arc_index import TripArcIndex
+from .matrix_model import MatrixModel
+
+logger = logging.getLogger("__main__")
+
+
+def solve_lp_relaxation(objective: numpy.ndarray, matrix, senses: numpy.ndarray, rhs: numpy.ndarray) -> tuple[float, numpy.ndarray]:
+	"""Solves max objective @ x subject to the constraint rows and 0 <= x <= 1 with the HiGHS
+	interface of scipy.optimize.linprog.
+
+	Args:
+		objective (numpy.ndarray): The objective coefficient of each variable
+		matrix (scipy.sparse.csr_matrix): The constraint matrix
+		senses (numpy.ndarray): The sense of each row ('E', 'L' or 'G')
+		rhs (numpy.ndarray): The right hand side of each row
+
+	Returns:
+		tuple[float, numpy.ndarray]: The objective value and the dual value of each row, signed so
+			that the reduced cost of a variable is objective - matrix.T @ duals; None if the LP
+			has no solution
+	"""
+	is_equality = senses == 'E'
+	#linprog minimizes with <= rows, so the objective and the >= rows are negated
+	row_sign = numpy.where(senses == 'G', -1.0, 1.0)
+	inequality_rows = numpy.flatnonzero(~is_equality)
+	equality_rows = numpy.flatnonzero(is_equality)
+	result = scipy.optimize.linprog(-objective,
+		A_ub=matrix[inequality_rows].multiply(row_sign[inequality_rows][:, None]).tocsr() if len(inequality_rows) > 0 else None,
+		b_ub=rhs[inequality_rows] * row_sign[inequality_rows] if len(inequality_rows) > 0 else None,
+		A_eq=matrix[equality_rows] if len(equality_rows) > 0 else None,
+		b_eq=rhs[equality_rows] if len(equality_rows) > 0 else None,
+		bounds=(0, 1),
+		method='highs')
+	if result.status != 0:
+		return None
+
+	duals = numpy.zeros(len(rhs))
+	if len(inequality_rows) > 0:
+		duals[inequality_rows] = -result.ineqlin.marginals * row_sign[inequality_rows]
+	if len(equality_rows) > 0:
+		duals[equality_rows] = -result.eqlin.marginals
+	return -result.fun, duals
+
+
+def price_arcs(matrix_model: MatrixModel, arc_index: TripArcIndex, is_selected: numpy.ndarray,
+	arcs_per_trip: int=10, max_rounds: int=50, gap_tolerance: float=1e-4, tolerance: float=1e-6) -> numpy.ndarray:
+	"""Grows a set of arcs by column generation. Each round solves the LP relaxation on the selected
+	arcs and computes the reduced cost of every arc from the row duals in one sparse product. Of the
+	arcs with a positive reduced cost, the arcs_per_trip best leaving and entering each trip are
+	added. Since every variable is at most 1, the relaxation value plus the positive reduced costs of
+	the arcs left out bounds the relaxation over all arcs. The loop stops when no arc prices out, when
+	that bound is within gap_tolerance of the relaxation value, after max_rounds rounds, or when the
+	relaxation on the selected arcs has no solution, in which case all arcs are selected.
+
+	Args:
+		matrix_model (MatrixModel): The model over all arcs
+		arc_index (TripArcIndex): The trip-arc index of all arcs
+		is_selected (numpy.ndarray): A boolean array indicating the initial arcs
+		arcs_per_trip (int, optional): The number of arcs added per trip and direction in each round. Defaults to 10.
+		max_rounds (int, optional): The maximum number of LP relaxations to solve. Defaults to 50.
+		gap_tolerance (float, optional): The relative gap between the relaxation and its bound at which to stop. Defaults to 1e-4.
+		tolerance (float, optional): The reduced cost above which an arc is added. Defaults to 1e-6.
+
+	Returns:
+		numpy.ndarray: A boolean array indicating the selected arcs
+	"""
+	matrix, senses, rhs = matrix_model.constraint_arrays()
+	matrix_by_column = matrix.tocsc()
+	objective = matrix_model.objective
+	is_selected = is_selected.copy()
+	for round_number in range(1, max_rounds + 1):
+		columns = numpy.flatnonzero(is_selected)
+		relaxation = solve_lp_relaxation(objective[columns], matrix_by_column[:, columns], senses, rhs)
+		if relaxation is None:
+			logger.warning('The LP relaxation on ' + str(len(columns)) + ' priced arcs has no solution; keeping all arcs.')
+			return numpy.ones(len(objective), dtype=bool)
+		relaxation_value, duals = relaxation
+
+		reduced_costs = objective - matrix.T @ duals
+		is_candidate = ~is_selected & (reduced_costs > tolerance)
+		bound = relaxation_value + reduced_costs[is_candidate].sum()
+		logger.info('Arc pricing round ' + str(round_number) + ': LP relaxation ' + str(round(relaxation_value, 2)) + ' on ' +
+			str(len(columns)) + ' arcs, bound ' + str(round(bound, 2)) + ', ' + str(int(is_candidate.sum())) + ' arcs price out.')
+		if not is_candidate.any() or bound - relaxation_value <= gap_tolerance * max(abs(relaxation_value), 1):
+			break
+		is_selected |= is_candidate & prune_arcs(arc_index.t1, arc_index.t2, numpy.where(is_candidate, reduced_costs, -numpy.inf),
+			arc_index.num_trips(), arcs_per_trip=arcs_per_trip)
+	return is_selected
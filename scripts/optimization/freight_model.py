@@ -3,14 +3,95 @@ This is a superclass for the optimization modeler. The initial set-up
 and many of the functions for children classes are the same, so this
 class is used to avoid code duplication.
 '''
+import concurrent.futures
 import logging
+import multiprocessing
+import os
+import time
+import numpy
 import pandas
+import pyomo.environ as pe
+from pyomo.core.expr.numeric_expr import LinearExpression
 from pyomo.opt import SolverFactory
+from pyomo.solvers.plugins.solvers.persistent_solver import PersistentSolver
 from file_manager import FileManager
 from data_manager import DataManager
+from arc_pruning import prune_arcs
+from zip_codes import zip5_codes
+from . import column_generation
+from .matrix_model import MatrixModel
+from .network_model import cycle_sequences
+from arc_builder import group_members
 
 logging.basicConfig(level=logging.INFO)
 
+#persistent interfaces used when a model is kept alive across solves; the appsi interfaces update
+#their solver instance incrementally on every solve call
+PERSISTENT_SOLVERS = {
+	'gurobi': 'gurobi_persistent',
+	'cplex': 'cplex_persistent',
+	'xpress': 'xpress_persistent',
+	'mosek': 'mosek_persistent',
+	'highs': 'appsi_highs'
+}
+
+#the option that caps the number of threads of each solver interface; glpk is single-threaded
+THREAD_OPTIONS = {
+	'gurobi': 'Threads',
+	'gurobi_persistent': 'Threads',
+	'cplex': 'threads',
+	'cplex_persistent': 'threads',
+	'xpress': 'THREADS',
+	'xpress_persistent': 'THREADS',
+	'mosek': 'iparam.num_threads',
+	'mosek_persistent': 'iparam.num_threads',
+	'cbc': 'threads',
+	'highs': 'threads',
+	'appsi_highs': 'threads'
+}
+
+#components of the arc graph smaller than this many arcs are solved together, in one model
+COMPONENT_BUNDLE_ARCS = 20000
+
+
+def solve_component(model_class: type,
+	data_manager: DataManager,
+	margin_weight: float,
+	backend: str,
+	solver_name: str,
+	solver_time_limit: int,
+	optimality_gap: float,
+	warm_start_values: list,
+	solver_threads: int,
+	deadline: float=None) -> tuple[str, numpy.ndarray, float]:
+	"""Builds and solves the model of one group of components of the arc graph. This is a
+	module-level function so that it can run in a worker process.
+
+	Args:
+		model_class (type): The FreightModel subclass to build
+		data_manager (DataManager): The DataManager restricted to the components
+		margin_weight (float): The weight of the margin improvement in the objective
+		backend (str): The model backend (see FreightModel.solve)
+		solver_name (str): The name of the solver
+		solver_time_limit (int): The solver time limit, in seconds
+		optimality_gap (float): The optimality gap
+		warm_start_values (list): The arc labels of the warm start
+		solver_threads (int): The maximum number of solver threads
+		deadline (float, optional): The time.time() by which the solve must end; the time limit is cut
+			to the time left when the model starts. Defaults to None.
+
+	Returns:
+		tuple[str, numpy.ndarray, float]: The termination condition, the solution by arc row
+			position and the objective value
+	"""
+	model = model_class(data_manager, data_manager.file_manager, verbose=False, margin_weight=margin_weight)
+	model.solver_threads = solver_threads
+	if not deadline is None:
+		solver_time_limit = max(1, min(solver_time_limit, int(deadline - time.time())))
+	termination_condition = model.solve_with_backend(backend, solver_name, solver_time_limit, optimality_gap, warm_start_values)
+	return termination_condition, model.solution, getattr(model, 'objective_value', None)
+
+
 class FreightModel:
 
 	def __init__(self,
@@ -18,7 +99,9 @@ class FreightModel:
 		file_manager: FileManager,
 		verbose: bool=True,
 		margin_weight=0,
-		write_model: bool=False):
+		write_model: bool=False,
+		persistent: bool=False,
+		margin_constraint: bool=False):
 		"""Initializes the FreightModel class
 
 		Args:
@@ -30,12 +113,23 @@ class FreightModel:
 				improvement portion of the objective function
 			write_model (bool, optional): Whether or not to write the model to
 				an MPS file. Defaults to False.
+			persistent (bool, optional): Whether to build the model once and keep
+				the solver instance alive across calls to solve, updating only the
+				margin weight of the objective. Defaults to False.
+			margin_constraint (bool, optional): Whether to enforce the margin target
+				with the linear constraint sum(margin_improvement * x) >= 0 instead of
+				weighting margin improvement in the objective. Defaults to False.
 		"""		
 		self.data_manager = data_manager
 		self.file_manager = file_manager
 		self.verbose = verbose
 		self.margin_weight = margin_weight
 		self.write_model = write_model
+		self.persistent = persistent
+		self.margin_constraint = margin_constraint
+		self.solver = None
+		self.solver_threads = None
+		self.matrix_model = None
 		logging.info('FreightModel object created.')
 				
 
@@ -47,121 +141,177 @@ class FreightModel:
 		pass
 
 
+	def define_variables(self):
+		'''
+		adds one binary variable per arc to the model, indexed by the arc labels. The
+		variables are also kept in a list by row position, so constraint bodies can be built by
+		slicing with the arc positions of the trip-arc index.
+		'''
+		labels = self.data_manager.arc_store.labels
+		self.model.XX = pe.Var(labels, domain=pe.Binary)
+		self.variables = [self.model.XX[x] for x in labels]
+
+
+	def define_objective(self):
+		'''
+		adds the objective to the model: the adjusted profit plus, when there is a margin target, the
+		margin improvement weighted by the mutable parameter margin_weight. Changing the parameter
+		updates the objective without rebuilding it.
+		'''
+		arc_store = self.data_manager.arc_store
+		arc_positions = numpy.arange(len(arc_store))
+		profit = self.linear_expression(arc_positions, arc_store['profit_adj'].astype(numpy.int64))
+		if self.data_manager.margin_target <= 0 or self.margin_constraint:
+			self.model.obj = pe.Objective(expr=profit, sense=pe.maximize)
+		else:
+			self.model.margin_weight = pe.Param(initialize=self.margin_weight, mutable=True)
+			margin_improvement = self.linear_expression(arc_positions, arc_store['margin_improvement'].astype(numpy.int64))
+			self.model.obj = pe.Objective(expr=profit + self.model.margin_weight * margin_improvement, sense=pe.maximize)
+
+
+	def define_margin_constraint(self):
+		'''
+		when margin_constraint is set, adds the constraint that the accepted arcs meet the margin
+		target: sum(profit * x) >= margin_target * sum(revenue * x), which is
+		sum(margin_improvement * x) >= 0
+		'''
+		if not self.margin_constraint or self.data_manager.margin_target <= 0:
+			return
+		margin_improvement = self.data_manager.arc_store['margin_improvement'].astype(numpy.float64)
+		self.model.constraintMarginTarget = pe.Constraint(expr=self.linear_expression(numpy.arange(len(margin_improvement)), margin_improvement) >= 0)
+
+
+	def add_matrix_margin_constraint(self, matrix_model: MatrixModel):
+		'''
+		adds the margin target constraint of define_margin_constraint to a MatrixModel
+		'''
+		if not self.margin_constraint or self.data_manager.margin_target <= 0:
+			return
+		margin_improvement = self.data_manager.arc_store['margin_improvement'].astype(numpy.float64)
+		matrix_model.add_constraint('margin_target', numpy.arange(len(margin_improvement)), margin_improvement, 'G', 0)
+
+
+	def linear_expression(self, positions: numpy.ndarray, coefficients: numpy.ndarray=None) -> LinearExpression:
+		"""Builds the weighted sum of the arc variables at the given positions as a single
+		LinearExpression, without going through Pyomo's operator overloading.
+
+		Args:
+			positions (numpy.ndarray): The row positions of the arcs in the arc store
+			coefficients (numpy.ndarray, optional): The coefficient of each arc. Defaults to None,
+				meaning every coefficient is 1.
+
+		Returns:
+			LinearExpression: The linear expression
+		"""
+		variables = self.variables
+		linear_vars = [variables[position] for position in positions.tolist()]
+		if coefficients is None:
+			linear_coefs = [1] * len(linear_vars)
+		else:
+			linear_coefs = coefficients.tolist()
+		return LinearExpression(constant=0, linear_coefs=linear_coefs, linear_vars=linear_vars)
+
+
+	def define_matrix_model(self) -> MatrixModel:
+		'''
+		this function builds the same objective and constraints as define_model as a MatrixModel,
+		straight from the arc arrays. This function will be specific to each child.
+		'''
+		pass
+
+
+	def objective_coefficients(self) -> numpy.ndarray:
+		'''
+		returns the objective coefficient of each arc, by row position in the arc store: the
+		adjusted profit plus, when there is a margin target, the weighted margin improvement
+		'''
+		arc_store = self.data_manager.arc_store
+		coefficients = arc_store['profit_adj'].astype(numpy.int64).astype(numpy.float64)
+		if self.data_manager.margin_target > 0 and not self.margin_constraint:
+			coefficients += arc_store['margin_improvement'].astype(numpy.int64) * self.margin_weight
+		return coefficients
+
+
 	def get_human_readable_results(self) -> tuple[pandas.DataFrame, pandas.DataFrame]:
 		'''
-		once solved, this function iterates through the model and returns a human readable
-		table of results.
-		'''
-		self.accepted_trips = []
-		self.accepted_idcs = []
-		for x in self.data_manager.potential_trip_df.index.values:
-			if round(self.model.XX[x].value) == 1:
-				trip = self.data_manager.potential_trip_df.loc[x]['t1']
-				trip_ = self.data_manager.potential_trip_df.loc[x]['t2']
-				self.accepted_idcs.append(x)
-				if (trip_, trip) not in self.accepted_trips or not self.data_manager.use_tours:
-					self.accepted_trips.append((trip, trip_))
-		self.accepted_trips_df = pandas.DataFrame(self.accepted_trips, columns=['t1', 't2'])
+		once solved, this function reads the solution vector and returns a human readable table of
+		results. The accepted arcs give the successor of each trip; the tours are the cycles of the
+		successors (or the accepted pairs, with tours) and the legs are gathered from trip_df by position.
+		'''
+		data_manager = self.data_manager
+		arc_index = data_manager.arc_index
+		trip_df = data_manager.trip_df
+		accepted = numpy.flatnonzero(numpy.round(self.solution) == 1)
+		t1 = arc_index.t1[accepted]
+		t2 = arc_index.t2[accepted]
+		self.accepted_idcs = data_manager.arc_store.labels[accepted].tolist()
 
-		if self.data_manager.use_tours: #if we are using tours, then we have the tours as our accepted trips
-			all_connected_trips = self.accepted_trips
+		if data_manager.use_tours: #if we are using tours, then we have the tours as our accepted trips
+			#(t1, t2) and (t2, t1) are the same tour; keep the first
+			_, first = numpy.unique(numpy.minimum(t1, t2) * arc_index.num_trips() + numpy.maximum(t1, t2), return_index=True)
+			first = numpy.sort(first)
+			t1 = t1[first]
+			t2 = t2[first]
+			trips = numpy.column_stack((t1, t2)).ravel()
+			trip_sets = numpy.repeat(numpy.arange(len(t1)), 2)
+			legs = numpy.tile([0, 1], len(t1))
 		else: #otherwise, we need to construct the tours from our accepted trips
-			all_connected_trips = []
-			unhandled_trips = [x for x in self.accepted_trips_df['t1'].values if x in self.accepted_trips_df['t2'].values]
-			while len(unhandled_trips) > 0:
-				connected_trip = []
-				trip = unhandled_trips.pop()
-				connected_trip.append(trip)
-				next_trip = self.accepted_trips_df[self.accepted_trips_df['t1'] == trip]['t2'].values[0]
-				while next_trip not in connected_trip:
-					connected_trip.append(next_trip)
-					unhandled_trips.remove(next_trip)
-					trip = next_trip
-					next_trip = self.accepted_trips_df[self.accepted_trips_df['t1'] == trip]['t2'].values[0]
-				all_connected_trips.append(connected_trip)
-
-		trip_sets = []
-		froms = []
-		tos = []
-		trip_ids = []
-		trip_idcs = []
-		is_deadheads = []
-		deadhead_costs = []
-		revenues = []
-		trip_costs = []
-		trip_miles = []
-		deadhead_miles = []
-		trip_legs = []
-		full_tours = []
-
-		for connected_trip_idx, connected_trip in enumerate(all_connected_trips):
-			full_tour = [self.data_manager.trip_df.loc[x]['trip_id'] for x in connected_trip]
-			for leg, trip_idx in enumerate(connected_trip):
-				trip = self.data_manager.trip_df.loc[trip_idx]
-				trip_id = trip['trip_id']
-				from_ = trip['trip_orgn_zip']
-				
-				#check to see if we need a deadhead trip from the prior trip
-				if leg > 0 and (from_ != tos[-1]):
-					deadhead_costs.append(self.data_manager.get_deadhead_cost(destination_zip=str(from_), origin_zip=str(tos[-1])))
-					deadhead_miles.append(self.data_manager.get_deadhead_cost(destination_zip=str(from_), origin_zip=str(tos[-1]), field='empty_miles'))
-					trip_sets.append(connected_trip_idx)
-					froms.append(tos[-1])
-					tos.append(from_)
-					is_deadheads.append(True)
-					trip_ids.append(trip_id)
-					revenues.append(0)
-					trip_costs.append(0)
-					trip_miles.append(0)
-					trip_idcs.append(trip_idx)
-					trip_legs.append(leg)
-					full_tours.append(full_tour)
-
-				revenues.append(self.data_manager.trip_df.loc[trip_idx]['trip_revenue'])
-				trip_costs.append(self.data_manager.trip_df.loc[trip_idx]['trip_cost'])
-				trip_miles.append(self.data_manager.trip_df.loc[trip_idx]['trip_distance'])
-				trip_sets.append(connected_trip_idx)
-				froms.append(from_)
-				tos.append(trip['trip_dst_zip'])
-				is_deadheads.append(False)
-				trip_ids.append(trip_id)
-				trip_idcs.append(trip_idx)
-				deadhead_costs.append(0)
-				deadhead_miles.append(0)
-				trip_legs.append(leg)
-				full_tours.append(full_tour)
-			
-			orgn = self.data_manager.trip_df.loc[connected_trip[0]]['trip_orgn_zip']
-
-			if orgn != tos[-1]:
-				deadhead_costs.append(self.data_manager.get_deadhead_cost(origin_zip=str(tos[-1]), destination_zip=str(orgn)))
-				deadhead_miles.append(self.data_manager.get_deadhead_cost(origin_zip=str(tos[-1]), destination_zip=str(orgn), field='empty_miles'))
-				trip_sets.append(connected_trip_idx)
-				froms.append(tos[-1])
-				tos.append(orgn)
-				is_deadheads.append(True)
-				trip_ids.append(self.data_manager.trip_df.loc[connected_trip[0]]['trip_id'])
-				revenues.append(0)
-				trip_costs.append(0)
-				trip_miles.append(0)
-				trip_idcs.append(connected_trip[0])
-				trip_legs.append(0)			
-				full_tours.append(full_tour)
+			trips, trip_sets, legs = cycle_sequences(t1, t2, arc_index.num_trips())
+		self.accepted_trips = list(zip(arc_index.trip_index[t1], arc_index.trip_index[t2]))
+		self.accepted_trips_df = pandas.DataFrame(self.accepted_trips, columns=['t1', 't2'])
+
+		#each trip gets up to three rows: a deadhead from the prior trip, the trip itself and, after the last
+		#trip of its set, the deadhead back to the first trip of the set
+		num_sets = trip_sets[-1] + 1 if len(trip_sets) > 0 else 0
+		set_starts = numpy.flatnonzero(legs == 0)
+		first_trips = numpy.repeat(trips[set_starts], numpy.diff(numpy.append(set_starts, len(trips))))
+		previous_trips = numpy.roll(trips, 1)
+		is_last = numpy.append(trip_sets[1:] != trip_sets[:-1], True) if len(trips) > 0 else numpy.zeros(0, dtype=bool)
+		#the zips are compared and gathered as shared integer codes, and only the labels of the legs are looked up
+		(orgn_zips, dst_zips), zip_labels = zip5_codes(trip_df['trip_orgn_zip'], trip_df['trip_dst_zip'])
+		has_deadhead_before = (legs > 0) & (orgn_zips[trips] != dst_zips[previous_trips])
+		has_deadhead_after = is_last & (orgn_zips[first_trips] != dst_zips[trips])
+
+		rows = numpy.column_stack((has_deadhead_before, numpy.ones(len(trips), dtype=bool), has_deadhead_after)).ravel()
+		entry = numpy.repeat(numpy.arange(len(trips)), 3)[rows]
+		kind = numpy.tile([0, 1, 2], len(trips))[rows]
+		is_trip = kind == 1
+		is_return = kind == 2
+		trip = trips[entry]
+		first_trip = first_trips[entry]
+		#the trip a deadhead row is labeled with: the next trip, or the first trip of the set for the return
+		labeled_trip = numpy.where(is_return, first_trip, trip)
+		from_trip = numpy.where(kind == 0, previous_trips[entry], trip)
+		to_trip = numpy.where(is_return, first_trip, trip)
+		froms = zip_labels[numpy.where(is_trip, orgn_zips[trip], dst_zips[from_trip])]
+		tos = zip_labels[numpy.where(is_trip, dst_zips[trip], orgn_zips[to_trip])]
+
+		orgn_codes = trip_df['trip_orgn_zip3'].values
+		dst_codes = trip_df['trip_dst_zip3'].values
+		deadhead_origins = dst_codes[from_trip]
+		deadhead_destinations = orgn_codes[to_trip]
+		deadhead_matrix = data_manager.deadhead_matrix
+		def leg_values(trip_values: numpy.ndarray, deadhead_values: numpy.ndarray) -> numpy.ndarray:
+			#at least 64 bit, so that the sums per trip set cannot overflow
+			return numpy.where(is_trip, trip_values, deadhead_values).astype(numpy.result_type(trip_values, deadhead_values, numpy.int64))
+
+		full_tours = numpy.empty(num_sets, dtype=object)
+		full_tours[:] = [x.tolist() for x in numpy.split(trip_df['trip_id'].values[trips], set_starts[1:])] if num_sets > 0 else []
 
 		trip_df = pandas.DataFrame({
-			'trip_set': trip_sets,
-			'trip_idx': trip_idcs,
+			'trip_set': trip_sets[entry],
+			'trip_idx': trip_df.index.values[labeled_trip],
 			'from': froms,
-			'to':tos,
-			'is_deadhead': is_deadheads,
-			'trip_id': trip_ids,
-			'revenue': revenues,
-			'cost': trip_costs,
-			'deadhead_cost': deadhead_costs,
-			'trip_distance': trip_miles,
-			'deadhead_distance': deadhead_miles,
-			'trip_legs': trip_legs,
-			'full_tour': full_tours
+			'to': tos,
+			'is_deadhead': ~is_trip,
+			'trip_id': trip_df['trip_id'].values[labeled_trip],
+			'revenue': leg_values(trip_df['trip_revenue'].values[trip], 0),
+			'cost': leg_values(trip_df['trip_cost'].values[trip], 0),
+			'deadhead_cost': leg_values(0, deadhead_matrix.lookup_codes(deadhead_origins, deadhead_destinations)),
+			'trip_distance': leg_values(trip_df['trip_distance'].values[trip], 0),
+			'deadhead_distance': leg_values(0, deadhead_matrix.lookup_codes(deadhead_origins, deadhead_destinations, field='empty_miles')),
+			'trip_legs': numpy.where(is_return, 0, legs[entry]),
+			'full_tour': full_tours[trip_sets[entry]]
 		})
 		trip_df['total_distance'] = trip_df['trip_distance'] + trip_df['deadhead_distance']
 
@@ -203,11 +353,37 @@ class FreightModel:
 		return consolidated_trip_df
 
 
+	def price_arcs(self, arcs_per_trip: int=10, max_rounds: int=50):
+		'''
+		restricts the arc store to the arcs selected by column generation, starting from the arcs_per_trip
+		best arcs leaving and entering each trip and the best arcs of must-take trips, and adding up to arcs_per_trip
+		arcs per trip and direction in each pricing round. The LP relaxations are priced with
+		the objective at the current margin weight. Must be called before the model is defined.
+		'''
+		start = time.time()
+		matrix_model = self.define_matrix_model()
+		arc_index = self.data_manager.arc_index
+		is_initial = prune_arcs(arc_index.t1, arc_index.t2, matrix_model.objective, arc_index.num_trips(),
+			arcs_per_trip=arcs_per_trip,
+			must_keep_trips=self.data_manager.trip_df['must_take_flag'].values.astype(bool))
+		is_selected = column_generation.price_arcs(matrix_model, arc_index, is_initial,
+			arcs_per_trip=arcs_per_trip, max_rounds=max_rounds)
+		message = 'Arc pricing kept ' + str(int(is_selected.sum())) + ' of ' + str(len(is_selected)) + ' arcs in ' + \
+			str(round(time.time() - start, 2)) + ' seconds.'
+		logging.info(message)
+		self.data_manager.file_manager.add_message_to_log(message, 'general')
+		self.data_manager.restrict_arcs(is_selected)
+
+
 	def solve(self,
 		solver_name: str,
 		solver_time_limit=None,
 		optimality_gap=None,
-		warm_start_values=[]
+		warm_start_values=[],
+		backend: str='pyomo',
+		solver_threads: int=None,
+		decompose: bool=False,
+		component_workers: int=1
 		) -> tuple[pandas.DataFrame, pandas.DataFrame]:
 		'''
 		attempts to solver the model with the input parameters. If it cannot solve the model 
@@ -223,6 +399,17 @@ class FreightModel:
 				a value >= 0. A value of 0.01, for example, indicates a minimum optimality gap of 1.00%.
 			warm_start_values: a list of trip indices to use as a warm start for the solver. If no warm start is desired,
 				use an empty list. If a warm start is desired, enter a list of trip indices to use as a warm start.
+			backend: 'pyomo' builds the model with Pyomo and solves it through a Pyomo solver interface; 'matrix' builds
+				the objective and constraint arrays directly, writes them to an LP file and runs the solver executable on it;
+				'network' solves the model with a combinatorial algorithm and no solver, falling back to 'pyomo' when
+				the model has constraints the algorithm does not support; 'lagrangian' moves the distance bounds
+				into the objective and solves the network subproblem for a series of multipliers, falling back
+				to 'pyomo' when it finds no solution that meets the bounds.
+			solver_threads: the maximum number of threads for the solver, for the solvers that take a thread
+				limit. Use None to leave the solver default.
+			decompose: whether to solve the components of the arc graph as separate models (see solve_components)
+				when the model has no constraint across them. The result is the same as solving the whole model.
+			component_workers: the number of worker processes that solve the components when decompose is set.
 		
 		Returns:
 			tuple[pandas.DataFrame, pandas.DataFrame]: A tuple containing two pandas DataFrames. The first DataFrame contains
@@ -230,22 +417,207 @@ class FreightModel:
 				results of the optimization, with one row per trip leg.
 		'''
 		logging.info('Solving model.')
-		self.define_model()
-		logging.info('Model defined.')
-		if len(warm_start_values) > 0:
-			for xx in self.data_manager.potential_trip_df.index.values:
-				self.model.XX[xx].value = 0
-			for yy in warm_start_values:
-				if yy in self.data_manager.potential_trip_df.index.values:
-					self.model.XX[yy].value = 1
-
 		solver_name = solver_name.lower()
-		self.solver = SolverFactory(solver_name)
-
 		if solver_time_limit is None or solver_time_limit == 'none' or solver_time_limit == 'None':
 			solver_time_limit = None
 		else:
 			solver_time_limit = int(solver_time_limit)
+		self.solver_threads = solver_threads
+
+		if decompose and self.is_decomposable():
+			termination_condition = self.solve_components(backend, solver_name, solver_time_limit, optimality_gap,
+				warm_start_values, component_workers)
+		else:
+			termination_condition = self.solve_with_backend(backend, solver_name, solver_time_limit, optimality_gap, warm_start_values)
+		self.termination_condition = termination_condition
+		logging.info('Model solved.')
+
+		if termination_condition == 'feasible':
+			message = 'Solver terminated with a feasible solution.'
+		
+		elif termination_condition == 'optimal':
+			message = 'Solver terminated with an optimal solution.'
+		
+		else:
+			message = 'Solver was unable to find a feasible solution. Increase maximum solve time or decrease problem size.'
+			raise ValueError(message)
+		
+		consolidated_trip_df, trip_df = self.get_human_readable_results()
+		logging.info(message)
+		return consolidated_trip_df, trip_df
+
+
+	def is_decomposable(self) -> bool:
+		'''
+		returns whether the components of the arc graph can be solved as separate models: the distance bounds
+		and the margin constraint are sums over all arcs, and a persistent model is kept whole across solves
+		'''
+		data_manager = self.data_manager
+		has_min_distance = not data_manager.min_distance is None and data_manager.min_distance > 0
+		has_max_distance = not data_manager.max_distance is None and data_manager.max_distance > 0
+		has_margin_constraint = self.margin_constraint and data_manager.margin_target > 0
+		return not (has_min_distance or has_max_distance or has_margin_constraint or self.persistent or data_manager.use_lanes)
+
+
+	def solve_components(self,
+		backend: str,
+		solver_name: str,
+		solver_time_limit: int,
+		optimality_gap: float,
+		warm_start_values: list,
+		component_workers: int=1) -> str:
+		"""Solves the components of the arc graph (DataManager.arc_components) as separate models and
+		sets self.solution to their solutions. Arcs between components and trips with no arcs in their
+		component are left out, since no solution uses them. Components smaller than COMPONENT_BUNDLE_ARCS
+		arcs are solved together, so a dataset of many small regions is not solved one tiny model at a time.
+
+		Args:
+			backend (str): The model backend (see solve)
+			solver_name (str): The name of the solver
+			solver_time_limit (int): The solver time limit of the whole solve, in seconds, shared by the models
+				in proportion to their arcs and cut to the time left of it when each model starts
+			optimality_gap (float): The optimality gap
+			warm_start_values (list): The arc labels of the warm start
+			component_workers (int, optional): The number of worker processes, which share solver_threads, or
+				the cores when it is None. Defaults to 1, meaning the models are solved in this process.
+
+		Returns:
+			str: 'optimal' when every model is solved to optimality, 'feasible' when every model has a
+				solution, and the termination condition of the first model without one otherwise
+		"""
+		data_manager = self.data_manager
+		trip_components, arc_components = data_manager.arc_components()
+		num_arcs = len(arc_components)
+		components, component_arcs = numpy.unique(arc_components[arc_components >= 0], return_counts=True)
+
+		#the largest components first, each in its own model until the models reach COMPONENT_BUNDLE_ARCS arcs;
+		#the last entry is the bundle of component -1, the arcs between components
+		component_bundles = numpy.full(trip_components.max(initial=-1) + 2, -1, dtype=numpy.int64)
+		num_bundles = 0
+		bundle_arcs = COMPONENT_BUNDLE_ARCS
+		order = numpy.argsort(-component_arcs, kind='stable')
+		for component, num_component_arcs in zip(components[order].tolist(), component_arcs[order].tolist()):
+			if bundle_arcs >= COMPONENT_BUNDLE_ARCS:
+				num_bundles += 1
+				bundle_arcs = 0
+			component_bundles[component] = num_bundles - 1
+			bundle_arcs += num_component_arcs
+		trip_bundles = component_bundles[trip_components]
+		arc_bundles = component_bundles[arc_components]
+		kept_trips = numpy.flatnonzero(trip_bundles >= 0)
+		kept_arcs = numpy.flatnonzero(arc_bundles >= 0)
+		trip_offsets, trip_order = group_members(trip_bundles[kept_trips], num_bundles)
+		arc_offsets, arc_order = group_members(arc_bundles[kept_arcs], num_bundles)
+		bundle_trips = [numpy.sort(kept_trips[trip_order[trip_offsets[b]:trip_offsets[b + 1]]]) for b in range(num_bundles)]
+		bundle_arcs = [numpy.sort(kept_arcs[arc_order[arc_offsets[b]:arc_offsets[b + 1]]]) for b in range(num_bundles)]
+
+		message = 'The arc graph has ' + str(len(components)) + ' components with arcs, solved as ' + str(num_bundles) + \
+			' models; the largest has ' + str(component_arcs.max(initial=0)) + ' of ' + str(num_arcs) + ' arcs, and ' + \
+			str(num_arcs - len(kept_arcs)) + ' arcs between components and ' + str(len(trip_components) - len(kept_trips)) + \
+			' trips with no arcs in their component are left out.'
+		logging.info(message)
+		self.file_manager.add_message_to_log(message, 'general')
+
+		#the models solved at the same time share the cores of this solve, and the models share its time limit
+		#in proportion to their arcs, up to the time left of it when they start
+		component_workers = max(1, min(component_workers, num_bundles))
+		solver_threads = self.solver_threads
+		if component_workers > 1:
+			solver_threads = max(1, (self.solver_threads or os.cpu_count() or 1) // component_workers)
+		time_limits = [solver_time_limit] * num_bundles
+		deadline = None
+		if not solver_time_limit is None:
+			time_limits = [min(solver_time_limit, max(1, int(solver_time_limit * component_workers * len(arcs) / len(kept_arcs))))
+				for arcs in bundle_arcs]
+			deadline = time.time() + solver_time_limit
+		model_params = [(self.margin_weight, backend, solver_name, time_limit, optimality_gap, warm_start_values, solver_threads, deadline)
+			for time_limit in time_limits]
+		if component_workers > 1:
+			#a bundle is copied and sent once a worker is free, so at most component_workers copies are held at once
+			results = [None] * num_bundles
+			futures = {}
+			with concurrent.futures.ProcessPoolExecutor(max_workers=component_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+				for bundle in range(num_bundles):
+					if len(futures) >= component_workers:
+						done, _ = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+						for future in done:
+							results[futures.pop(future)] = future.result()
+					subset = data_manager.subset(bundle_trips[bundle], bundle_arcs[bundle])
+					futures[executor.submit(solve_component, type(self), subset, *model_params[bundle])] = bundle
+				for future in concurrent.futures.as_completed(futures):
+					results[futures[future]] = future.result()
+		else:
+			results = [solve_component(type(self), data_manager.subset(trips, arcs), *params)
+				for trips, arcs, params in zip(bundle_trips, bundle_arcs, model_params)]
+
+		self.solution = numpy.zeros(num_arcs)
+		self.objective_value = 0
+		termination_condition = 'optimal'
+		for arcs, (bundle_termination, solution, objective_value) in zip(bundle_arcs, results):
+			if not bundle_termination in ('optimal', 'feasible'):
+				return bundle_termination
+			if bundle_termination == 'feasible':
+				termination_condition = 'feasible'
+			self.solution[arcs] = solution
+			if not objective_value is None:
+				self.objective_value += objective_value
+		return termination_condition
+
+
+	def solve_with_backend(self,
+		backend: str,
+		solver_name: str,
+		solver_time_limit: int,
+		optimality_gap: float,
+		warm_start_values: list) -> str:
+		'''
+		solves the model with the given backend (see solve), setting self.solution, and returns the termination condition
+		'''
+		if backend == 'pyomo':
+			termination_condition = self.solve_pyomo_model(solver_name, solver_time_limit, optimality_gap, warm_start_values)
+		elif backend == 'matrix':
+			termination_condition = self.solve_matrix_model(solver_name, solver_time_limit, optimality_gap, warm_start_values)
+		elif backend == 'network':
+			termination_condition = self.solve_network_model()
+			if termination_condition is None:
+				logging.info('The network backend does not support the constraints of this model; solving with pyomo.')
+				termination_condition = self.solve_pyomo_model(solver_name, solver_time_limit, optimality_gap, warm_start_values)
+		elif backend == 'lagrangian':
+			termination_condition = self.solve_lagrangian_model(optimality_gap)
+			if termination_condition is None:
+				logging.info('The lagrangian backend did not find a solution for this model; solving with pyomo.')
+				termination_condition = self.solve_pyomo_model(solver_name, solver_time_limit, optimality_gap, warm_start_values)
+		else:
+			raise ValueError('backend must be one of "pyomo", "matrix", "network" or "lagrangian"')
+		return termination_condition
+
+
+	def solve_pyomo_model(self,
+		solver_name: str,
+		solver_time_limit: int,
+		optimality_gap: float,
+		warm_start_values: list) -> str:
+		'''
+		builds the Pyomo model and solves it through the Pyomo solver interface. Sets self.solution to the value of
+		each variable by row position in the arc store and returns the termination condition.
+		'''
+		if self.persistent and not self.solver is None:
+			#the model and solver instance are kept from the previous solve; only the objective changes
+			if hasattr(self.model, 'margin_weight'):
+				self.model.margin_weight.value = self.margin_weight
+			if isinstance(self.solver, PersistentSolver):
+				self.solver.set_objective(self.model.obj)
+			logging.info('Model objective updated.')
+		else:
+			self.define_model()
+			logging.info('Model defined.')
+			self.solver = self.create_solver(solver_name)
+
+		if len(warm_start_values) > 0:
+			is_warm_start = numpy.isin(self.data_manager.arc_store.labels, warm_start_values)
+			for variable, value in zip(self.variables, is_warm_start.tolist()):
+				variable.value = int(value)
+
 		if not solver_time_limit is None:
 			if solver_name.lower() == 'glpk':
 				self.solver.options['tmlim'] = solver_time_limit
@@ -260,6 +632,9 @@ class FreightModel:
 			elif solver_name.lower() == 'mosek':
 				self.solver.options['dparam.optimizer_max_time'] = solver_time_limit
 
+		if not self.solver_threads is None and solver_name.lower() in THREAD_OPTIONS:
+			self.solver.options[THREAD_OPTIONS[solver_name.lower()]] = self.solver_threads
+
 		if not optimality_gap is None:
 			if solver_name.lower() == 'glpk':
 				self.solver.options['mipgap'] = optimality_gap
@@ -272,20 +647,81 @@ class FreightModel:
 			elif solver_name.lower() == 'mosek':
 				self.solver.options['dparam.mio_rel_gap_const'] = optimality_gap
 
-		self.results = self.solver.solve(self.model, tee=self.verbose)
-		logging.info('Model solved.')
-		if self.results['Solver'][0]['Termination condition'] == 'feasible':
-			message = 'Solver terminated with a feasible solution.'
-		
-		elif self.results['Solver'][0]['Termination condition'] == 'optimal':
-			message = 'Solver terminated with an optimal solution.'
-		
+		if isinstance(self.solver, PersistentSolver):
+			warm_start = len(warm_start_values) > 0 and self.solver.warm_start_capable()
+			self.results = self.solver.solve(tee=self.verbose, warmstart=warm_start)
 		else:
-			import pdb
-			pdb.set_trace()
-			message = 'Solver was unable to find a feasible solution. Increase maximum solve time or decrease problem size.'
-			raise ValueError(message)
-		
-		consolidated_trip_df, trip_df = self.get_human_readable_results()
-		logging.info(message)
-		return consolidated_trip_df, trip_df
\ No newline at end of file
+			self.results = self.solver.solve(self.model, tee=self.verbose)
+		termination_condition = self.results['Solver'][0]['Termination condition']
+		if termination_condition in ['feasible', 'optimal']:
+			self.solution = numpy.array([variable.value for variable in self.variables], dtype=float)
+			self.objective_value = self.model.obj()
+		return termination_condition
+
+
+	def create_solver(self, solver_name: str):
+		'''
+		returns the Pyomo solver interface for solver_name. In persistent mode, the persistent
+		interface of the solver is used when one is available, and the model is loaded into it;
+		otherwise the model falls back to being rebuilt on every solve.
+		'''
+		if self.persistent:
+			persistent_name = PERSISTENT_SOLVERS.get(solver_name, solver_name)
+			if persistent_name in PERSISTENT_SOLVERS.values():
+				solver = SolverFactory(persistent_name)
+				if solver.available(exception_flag=False):
+					if isinstance(solver, PersistentSolver):
+						solver.set_instance(self.model)
+					logging.info('Using persistent solver interface ' + persistent_name + '.')
+					return solver
+			logging.info('No persistent interface available for ' + solver_name + '; the model will be rebuilt for every solve.')
+			self.persistent = False
+		return SolverFactory(solver_name)
+
+
+	def solve_network_model(self) -> str:
+		'''
+		solves the model with a combinatorial algorithm instead of a MIP solver, setting self.solution. This
+		function will be specific to each child; it returns None when the model has constraints the algorithm
+		does not support, and the termination condition otherwise.
+		'''
+		return None
+
+
+	def solve_lagrangian_model(self, optimality_gap: float=None) -> str:
+		'''
+		solves the model by Lagrangian relaxation of its side constraints, setting self.solution, self.dual_bound
+		and self.lagrangian_gap. This function will be specific to each child; it returns None when the model
+		has constraints the method does not support or no solution is found, and the termination condition otherwise.
+		'''
+		return None
+
+
+	def solve_matrix_model(self,
+		solver_name: str,
+		solver_time_limit: int,
+		optimality_gap: float,
+		warm_start_values: list) -> str:
+		'''
+		builds the MatrixModel and solves it with the solver executable. Sets self.solution to the value of each
+		variable by row position in the arc store and returns the termination condition.
+		'''
+		if self.persistent and not self.matrix_model is None:
+			#the constraints do not depend on the margin weight, so only the objective is rebuilt
+			self.matrix_model.objective = self.objective_coefficients()
+		else:
+			self.matrix_model = self.define_matrix_model()
+			logging.info('Matrix model defined.')
+		warm_start = None
+		if len(warm_start_values) > 0:
+			warm_start = numpy.isin(self.data_manager.arc_store.labels, warm_start_values).astype(float)
+
+		termination_condition, self.solution = self.matrix_model.solve(solver_name,
+			solver_time_limit=solver_time_limit,
+			optimality_gap=optimality_gap,
+			warm_start=warm_start,
+			threads=self.solver_threads,
+			verbose=self.verbose,
+			model_filename='model.lp' if self.write_model else None)
+		self.objective_value = self.matrix_model.objective @ self.solution
+		return termination_condition
@@ -0,0 +1,199 @@
+'''
+This file contains the FreightModelLaneFlow class, a subclass of the FreightModelTSP class. It solves the
+same modified traveling salesman problem, but on lanes instead of trips: trips with the same origin zip3,
+destination zip3 and must-take flag are interchangeable as far as the deadhead is concerned, so the arcs
+between two lanes are replaced by one integer flow variable. Each trip keeps its own binary variable, so
+per-trip profit, revenue and distance are exact. The lane flows are expanded back into trip arcs once
+the model is solved, so the results are read the same way as for the tsp model.
+'''
+import logging
+import numpy
+import scipy.sparse
+from scipy.optimize import LinearConstraint, milp
+
+from arc_builder import group_members
+from trip_arc_index import TripArcIndex
+from . import freight_model_tsp
+
+logger = logging.getLogger("__main__")
+
+
+def expand_lane_flows(trip_lane: numpy.ndarray, is_used: numpy.ndarray, lane_t1: numpy.ndarray, lane_t2: numpy.ndarray,
+	flows: numpy.ndarray, num_lanes: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+	"""Turns lane flows into trip arcs. Each unit of flow on lane arc A -> B links a used trip of lane A
+	to a used trip of lane B; since the flow out of and into each lane equals its number of used trips,
+	every used trip gets exactly one next and one prior trip. The flows leaving a lane to itself are
+	matched to the first used trips of the lane and the flows entering it from itself to the last, so a
+	trip is only linked to itself when every used trip of the lane is linked within the lane; the links
+	of those lanes are rotated by one trip.
+
+	Args:
+		trip_lane (numpy.ndarray): The lane of each trip, by trip position
+		is_used (numpy.ndarray): A boolean array indicating the used trips
+		lane_t1 (numpy.ndarray): The first lane of each lane arc
+		lane_t2 (numpy.ndarray): The second lane of each lane arc
+		flows (numpy.ndarray): The integer flow on each lane arc
+		num_lanes (int): The number of lanes
+
+	Returns:
+		tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The trip positions t1 and t2 of each trip arc and
+			the lane arc it came from
+	"""
+	used = numpy.flatnonzero(is_used)
+	lane_offsets, order = group_members(trip_lane[used], num_lanes)
+	used_by_lane = used[order]
+
+	lane_arc = numpy.repeat(numpy.arange(len(flows)), flows)
+	source_lane = lane_t1[lane_arc]
+	target_lane = lane_t2[lane_arc]
+	is_self = source_lane == target_lane
+
+	#flows leaving a lane: the flows to the lane itself first
+	order = numpy.lexsort((~is_self, source_lane))
+	lane_arc, source_lane, target_lane, is_self = lane_arc[order], source_lane[order], target_lane[order], is_self[order]
+	rank = numpy.arange(len(lane_arc)) - numpy.searchsorted(source_lane, source_lane, side='left')
+	t1 = used_by_lane[lane_offsets[source_lane] + rank]
+
+	#flows entering a lane: the flows from the lane itself last, in the order they leave it
+	order = numpy.lexsort((is_self, target_lane))
+	sorted_target = target_lane[order]
+	rank = numpy.arange(len(lane_arc)) - numpy.searchsorted(sorted_target, sorted_target, side='left')
+	t2 = numpy.empty(len(lane_arc), dtype=numpy.int64)
+	t2[order] = used_by_lane[lane_offsets[sorted_target] + rank]
+
+	for lane in numpy.unique(source_lane[t1 == t2]):
+		links = numpy.flatnonzero(is_self & (source_lane == lane))
+		t2[links] = numpy.roll(t1[links], -1)
+	return t1, t2, lane_arc
+
+
+class FreightModelLaneFlow(freight_model_tsp.FreightModelTSP):
+	'''
+	This class solves the modified traveling salesman problem as an integer flow between lanes, with one
+	binary variable per trip (the trip is used) and one integer variable per lane arc (the number of trips
+	of the first lane followed by a trip of the second lane). The flow out of and into each lane equals its
+	number of used trips. Must-take trips are in lanes of their own and keep the 10000 bonus of the adjusted
+	profit, which makes them preferred over any other trip. The model is solved with the HiGHS interface of
+	scipy.optimize.milp, whatever the backend, and needs a DataManager built with use_lanes.
+	'''
+
+	def solve_with_backend(self,
+		backend: str,
+		solver_name: str,
+		solver_time_limit: int,
+		optimality_gap: float,
+		warm_start_values: list) -> str:
+		'''
+		solves the lane flow model; the backend, solver name and warm start do not apply to it
+		'''
+		if backend != 'pyomo':
+			logger.info('The lane flow model is solved with scipy.optimize.milp; ignoring the ' + backend + ' backend.')
+		return self.solve_lane_model(solver_time_limit, optimality_gap)
+
+
+	def solve_lane_model(self, solver_time_limit: int=None, optimality_gap: float=None) -> str:
+		'''
+		builds and solves the lane flow model, then sets the arc store, the trip-arc index and self.solution
+		to the trip arcs of the solution. Returns the termination condition.
+		'''
+		data_manager = self.data_manager
+		trip_df = data_manager.trip_df
+		lane_arcs = data_manager.lane_arcs
+		trip_lane = data_manager.trip_lane
+		lane_counts = data_manager.lane_counts
+		num_trips = len(trip_lane)
+		num_lanes = len(lane_counts)
+		num_lane_arcs = len(lane_arcs['t1'])
+		self_arcs = numpy.flatnonzero(lane_arcs['t1'] == lane_arcs['t2'])
+		self_lanes = lane_arcs['t1'][self_arcs]
+		num_self = len(self_arcs)
+		#variables: used trips, lane arc flows, then two indicators per lane connected to itself
+		trip_vars = numpy.arange(num_trips)
+		flow_vars = num_trips + numpy.arange(num_lane_arcs)
+		used_lane_vars = num_trips + num_lane_arcs + numpy.arange(num_self)
+		two_used_vars = used_lane_vars + num_self
+		num_vars = num_trips + num_lane_arcs + 2 * num_self
+
+		trip_profit = trip_df['trip_profit'].values.astype(numpy.float64)
+		must_take = trip_df['must_take_flag'].values.astype(bool)
+		margin_improvement = trip_profit - trip_df['trip_revenue'].values * data_manager.margin_target
+		objective = numpy.zeros(num_vars)
+		objective[trip_vars] = trip_profit + must_take * 10000
+		objective[flow_vars] = -lane_arcs['empty_cost']
+		if data_manager.margin_target > 0 and not self.margin_constraint:
+			objective[trip_vars] += margin_improvement * self.margin_weight
+			objective[flow_vars] -= lane_arcs['empty_cost'] * self.margin_weight
+
+		rows, columns, values, lower, upper = [], [], [], [], []
+		def add_rows(row_ids, entry_columns, entry_values, row_lower, row_upper):
+			offset = len(lower)
+			rows.append(numpy.asarray(row_ids) + offset)
+			columns.append(numpy.asarray(entry_columns))
+			values.append(numpy.asarray(entry_values, dtype=numpy.float64))
+			lower.extend(numpy.broadcast_to(row_lower, (numpy.max(row_ids, initial=-1) + 1,)).tolist())
+			upper.extend(numpy.broadcast_to(row_upper, (numpy.max(row_ids, initial=-1) + 1,)).tolist())
+
+		# Constraints 1 and 2: the flow out of and into each lane equals its number of used trips
+		for lane_end in ('t1', 't2'):
+			add_rows(numpy.concatenate((lane_arcs[lane_end], trip_lane)), numpy.concatenate((flow_vars, trip_vars)),
+				numpy.concatenate((numpy.ones(num_lane_arcs), -numpy.ones(num_trips))), 0, 0)
+
+		# Constraint 3: a lane connected to itself cannot link a single used trip to itself. With u the used
+		# trips of the lane, s = 1 when u >= 1 and t = 1 only when u >= 2: flow <= u - s + t
+		lane_of_trip_in_self_lane = numpy.full(num_lanes, -1)
+		lane_of_trip_in_self_lane[self_lanes] = numpy.arange(num_self)
+		self_trips = numpy.flatnonzero(lane_of_trip_in_self_lane[trip_lane] >= 0)
+		self_row = lane_of_trip_in_self_lane[trip_lane[self_trips]]
+		add_rows(numpy.concatenate((numpy.arange(num_self), self_row, numpy.arange(num_self), numpy.arange(num_self))),
+			numpy.concatenate((flow_vars[self_arcs], self_trips, used_lane_vars, two_used_vars)),
+			numpy.concatenate((numpy.ones(num_self), -numpy.ones(len(self_trips)), numpy.ones(num_self), -numpy.ones(num_self))),
+			-numpy.inf, 0)
+		add_rows(numpy.concatenate((self_row, numpy.arange(num_self))), numpy.concatenate((self_trips, used_lane_vars)),
+			numpy.concatenate((numpy.ones(len(self_trips)), -lane_counts[self_lanes])), -numpy.inf, 0)
+		add_rows(numpy.concatenate((self_row, numpy.arange(num_self))), numpy.concatenate((self_trips, two_used_vars)),
+			numpy.concatenate((-numpy.ones(len(self_trips)), 2 * numpy.ones(num_self))), -numpy.inf, 0)
+
+		# Constraints 4 and 5: (optional) bounds on the total miles traveled
+		has_min_distance = not data_manager.min_distance is None and data_manager.min_distance > 0
+		has_max_distance = not data_manager.max_distance is None and data_manager.max_distance > 0
+		if has_min_distance or has_max_distance:
+			add_rows(numpy.zeros(num_trips + num_lane_arcs, dtype=numpy.int64), numpy.concatenate((trip_vars, flow_vars)),
+				numpy.concatenate((trip_df['trip_distance'].values, lane_arcs['empty_miles'])),
+				data_manager.min_distance if has_min_distance else -numpy.inf,
+				data_manager.max_distance if has_max_distance else numpy.inf)
+
+		# Constraint 6: (optional) the accepted trips must meet the margin target
+		if self.margin_constraint and data_manager.margin_target > 0:
+			add_rows(numpy.zeros(num_trips + num_lane_arcs, dtype=numpy.int64), numpy.concatenate((trip_vars, flow_vars)),
+				numpy.concatenate((margin_improvement, -lane_arcs['empty_cost'])), 0, numpy.inf)
+
+		matrix = scipy.sparse.csr_matrix((numpy.concatenate(values), (numpy.concatenate(rows), numpy.concatenate(columns))),
+			shape=(len(lower), num_vars))
+		upper_bounds = numpy.ones(num_vars)
+		upper_bounds[flow_vars] = numpy.minimum(lane_counts[lane_arcs['t1']], lane_counts[lane_arcs['t2']])
+		logger.info('Lane flow model defined with ' + str(num_trips) + ' trips, ' + str(num_lanes) + ' lanes and ' +
+			str(num_lane_arcs) + ' lane arcs.')
+
+		options = {'disp': self.verbose}
+		if not solver_time_limit is None:
+			options['time_limit'] = solver_time_limit
+		if not optimality_gap is None:
+			options['mip_rel_gap'] = optimality_gap
+		self.results = milp(-objective,
+			constraints=LinearConstraint(matrix, numpy.array(lower), numpy.array(upper)),
+			integrality=numpy.ones(num_vars),
+			bounds=(numpy.zeros(num_vars), upper_bounds),
+			options=options)
+		if self.results.x is None:
+			return 'infeasible'
+
+		values = numpy.round(self.results.x).astype(numpy.int64)
+		t1, t2, lane_arc = expand_lane_flows(trip_lane, values[trip_vars] == 1, lane_arcs['t1'], lane_arcs['t2'],
+			values[flow_vars], num_lanes)
+		order = numpy.lexsort((t2, t1))
+		t1, t2, lane_arc = t1[order], t2[order], lane_arc[order]
+		data_manager.set_trip_arcs(t1, t2, lane_arcs['empty_miles'][lane_arc], lane_arcs['empty_cost'][lane_arc])
+		data_manager.arc_index = TripArcIndex.from_arc_store(trip_df.index.values, data_manager.arc_store)
+		self.solution = numpy.ones(len(t1))
+		self.objective_value = -self.results.fun
+		return 'optimal' if self.results.status == 0 else 'feasible'
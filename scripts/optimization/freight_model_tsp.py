@@ -8,8 +8,11 @@ tour elimination and without the requirement that all trips must be assigned. Th
 maximum limit to the number of tours that can be created.
 '''
 import logging
+import numpy
 import pyomo.environ as pe
 from . import freight_model
+from .matrix_model import MatrixModel
+from .network_model import solve_assignment, solve_distance_lagrangian
 
 logger = logging.getLogger("__main__")
 
@@ -20,67 +23,165 @@ class FreightModelTSP(freight_model.FreightModel):
 	maximum limit to the number of tours that can be created.
 	'''
 
+	def log_isolated_must_take_trips(self):
+		'''
+		logs an error for each must-take trip that has no potential prior trips
+		'''
+		isolated_must_take = self.data_manager.trip_df.index[
+			(self.data_manager.arc_index.in_degree() == 0) & self.data_manager.trip_df['must_take_flag'].values.astype(bool)]
+		for tt in isolated_must_take:
+			message = 'Trip ' + str(tt) + ' is a must-take trip, but has no potential prior trips to connect to that meet the deadhead threshold.'
+			self.data_manager.file_manager.add_message_to_log(message, 'error')
+
+
 	def define_model(self):
 		self.model = pe.ConcreteModel(name="Modified Traveling Salesman Problem")
+		arc_index = self.data_manager.arc_index
+		arc_positions = numpy.arange(len(arc_index.arc_labels))
 		
 		self.trip_set = pe.Set(initialize=self.data_manager.trip_df.index.values, doc='Trips')
 		"""Build the decision variables"""
-		self.model.XX = pe.Var(self.data_manager.potential_trip_df.index.values, domain=pe.Binary)
+		self.define_variables()
 		
-		def objective_rule(model):
-			if self.data_manager.margin_target <= 0:
-				return sum(model.XX[x] * int(self.data_manager.potential_trip_df.loc[x, 'profit_adj']) for x in self.data_manager.potential_trip_df.index.values)
-			else:
-				return sum(model.XX[x] * int(self.data_manager.potential_trip_df.loc[x, 'profit_adj']) for x in self.data_manager.potential_trip_df.index.values) +\
-					sum(model.XX[x] * int(self.data_manager.potential_trip_df.loc[x, 'margin_improvement']) 
-						for x in self.data_manager.potential_trip_df.index.values) * self.margin_weight
-		self.model.obj = pe.Objective(rule=objective_rule, sense=pe.maximize)
+		self.define_objective()
 		logger.info('Objective function generated: maximize profit and margin improvement added to model.')
 
 		# Constraint 1: all trips must be connected to one other post trip
 		def constraint_equal_connections(model, tt: int):
-			other_trips_from = self.data_manager.leg_idx_df.loc[tt]['potential_trip_idcs_from']
-			other_trips_to = self.data_manager.leg_idx_df.loc[tt]['potential_trip_idcs_to']
-			if len(other_trips_from) == 0:
-				return pe.Constraint.Skip
-			return sum(model.XX[x] for x in other_trips_from) == sum(model.XX[x] for x in other_trips_to)
-		self.model.constraint_equal_connections = pe.Constraint(self.trip_set, rule=constraint_equal_connections)
+			position = arc_index.position(tt)
+			other_trips_from = arc_index.outgoing_positions(position)
+			other_trips_to = arc_index.incoming_positions(position)
+			coefficients = numpy.concatenate((numpy.ones(len(other_trips_from)), -numpy.ones(len(other_trips_to))))
+			return self.linear_expression(numpy.concatenate((other_trips_from, other_trips_to)), coefficients) == 0
+		has_outgoing = arc_index.out_degree() > 0
+		self.model.constraint_equal_connections = pe.Constraint(arc_index.trip_index[has_outgoing].values, rule=constraint_equal_connections)
 		logger.info('Constraint 1 generated: all trips must be connected to one other post trip added to model.')
 
 
 		# Constraint 2: all trips must be connected to, at most, one other prior 
 		# trip (or exactly once if the trip is a "must-take")
-		def constraint_ticket_prior_connection(model, tt: int):
-			other_trips_to = self.data_manager.leg_idx_df.loc[tt]['potential_trip_idcs_to']
+		self.log_isolated_must_take_trips()
 
-			if len(other_trips_to) == 0:
-				if self.data_manager.trip_df.loc[tt]['must_take_flag']:
-					message = 'Trip ' + str(tt) + ' is a must-take trip, but has no potential prior trips to connect to that meet the deadhead threshold.'
-					self.data_manager.file_manager.add_message_to_log(message, 'error')
-				return pe.Constraint.Skip	
-
-			return sum(model.XX[x] for x in other_trips_to) <= 1
-		self.model.constraintTripPriorConnection = pe.Constraint(self.trip_set, rule=constraint_ticket_prior_connection)
+		def constraint_ticket_prior_connection(model, tt: int):
+			return self.linear_expression(arc_index.incoming_positions(arc_index.position(tt))) <= 1
+		has_incoming = arc_index.in_degree() > 0
+		self.model.constraintTripPriorConnection = pe.Constraint(arc_index.trip_index[has_incoming].values, rule=constraint_ticket_prior_connection)
 		logger.info('Constraint 2 generated: all trips must be connected to, at most, one other prior trip added to model.')
 
 
 		# Constraint 3: (optional) The total miles traveled must meet a minimum threshold
-		def constraint_distance_minimum(model):
-			return sum(model.XX[x] * self.data_manager.potential_trip_df.loc[x, 'distance'] \
-			  for x in self.data_manager.potential_trip_df.index.values) >= \
-				self.data_manager.min_distance
+		distance = self.data_manager.arc_store['distance']
 		if not self.data_manager.min_distance is None and self.data_manager.min_distance > 0:
-			self.model.constraintDistanceMinimum = pe.Constraint(rule=constraint_distance_minimum)
+			self.model.constraintDistanceMinimum = pe.Constraint(expr=self.linear_expression(arc_positions, distance) >= self.data_manager.min_distance)
 			logger.info('Constraint 3 generated: total miles traveled must meet a minimum threshold added to model.')
 
 		# Constraint 4: (optional) The total miles traveled must not exceed a maximum threshold
-		def constraint_distance_maximum(model):
-			return sum(model.XX[x] * self.data_manager.potential_trip_df.loc[x, 'distance'] \
-			  for x in self.data_manager.potential_trip_df.index.values) <= \
-				self.data_manager.max_distance
 		if not self.data_manager.max_distance is None and self.data_manager.max_distance > 0:
-			self.model.constraintDistanceMaximum = pe.Constraint(rule=constraint_distance_maximum)
+			self.model.constraintDistanceMaximum = pe.Constraint(expr=self.linear_expression(arc_positions, distance) <= self.data_manager.max_distance)
 			logger.info('Constraint 4 generated: total miles traveled must not exceed a maximum threshold added to model.')
 
+		# Constraint 5: (optional) The accepted trips must meet the margin target
+		self.define_margin_constraint()
+
 		if self.write_model:
-			self.model.write("model.lp")
\ No newline at end of file
+			self.model.write("model.lp")
+
+
+	def define_matrix_model(self) -> MatrixModel:
+		'''
+		builds the objective and constraints of define_model as a MatrixModel. Constraint rows
+		are generated from the trip-arc index for all trips at once.
+		'''
+		arc_index = self.data_manager.arc_index
+		matrix_model = MatrixModel("Modified Traveling Salesman Problem", self.objective_coefficients())
+		arc_positions = numpy.arange(len(arc_index.arc_labels))
+		ones = numpy.ones(len(arc_positions))
+
+		# Constraint 1: all trips must be connected to one other post trip
+		has_outgoing = arc_index.out_degree() > 0
+		rows = numpy.full(arc_index.num_trips(), -1)
+		rows[has_outgoing] = numpy.arange(has_outgoing.sum())
+		is_incoming_row = has_outgoing[arc_index.t2]
+		matrix_model.add_constraints('equal_connections',
+			row_ids=numpy.concatenate((rows[arc_index.t1], rows[arc_index.t2[is_incoming_row]])),
+			columns=numpy.concatenate((arc_positions, arc_positions[is_incoming_row])),
+			values=numpy.concatenate((ones, -ones[is_incoming_row])),
+			sense='E',
+			rhs=numpy.zeros(has_outgoing.sum()),
+			row_labels=arc_index.trip_index[has_outgoing])
+
+		# Constraint 2: all trips must be connected to, at most, one other prior trip
+		self.log_isolated_must_take_trips()
+		has_incoming = arc_index.in_degree() > 0
+		rows = numpy.full(arc_index.num_trips(), -1)
+		rows[has_incoming] = numpy.arange(has_incoming.sum())
+		matrix_model.add_constraints('trip_prior_connection',
+			row_ids=rows[arc_index.t2],
+			columns=arc_positions,
+			values=ones,
+			sense='L',
+			rhs=numpy.ones(has_incoming.sum()),
+			row_labels=arc_index.trip_index[has_incoming])
+
+		# Constraints 3 and 4: (optional) bounds on the total miles traveled
+		distance = self.data_manager.arc_store['distance']
+		if not self.data_manager.min_distance is None and self.data_manager.min_distance > 0:
+			matrix_model.add_constraint('distance_minimum', arc_positions, distance, 'G', self.data_manager.min_distance)
+		if not self.data_manager.max_distance is None and self.data_manager.max_distance > 0:
+			matrix_model.add_constraint('distance_maximum', arc_positions, distance, 'L', self.data_manager.max_distance)
+		self.add_matrix_margin_constraint(matrix_model)
+		return matrix_model
+
+
+	def solve_network_model(self) -> str:
+		'''
+		without distance bounds or a margin constraint, the model is an assignment problem on the
+		trip-arc graph and is solved exactly by network_model.solve_assignment
+		'''
+		has_min_distance = not self.data_manager.min_distance is None and self.data_manager.min_distance > 0
+		has_max_distance = not self.data_manager.max_distance is None and self.data_manager.max_distance > 0
+		if has_min_distance or has_max_distance or (self.margin_constraint and self.data_manager.margin_target > 0):
+			return None
+
+		self.log_isolated_must_take_trips()
+		arc_index = self.data_manager.arc_index
+		coefficients = self.objective_coefficients()
+		is_accepted = solve_assignment(arc_index.t1, arc_index.t2, coefficients, arc_index.num_trips())
+		self.solution = is_accepted.astype(float)
+		self.objective_value = coefficients @ self.solution
+		logger.info('Assignment problem solved with ' + str(int(is_accepted.sum())) + ' accepted arcs.')
+		return 'optimal'
+
+
+	def solve_lagrangian_model(self, optimality_gap: float=None) -> str:
+		'''
+		solves the model with its distance bounds (constraints 3 and 4) moved into the objective, so each
+		subproblem is the assignment problem of solve_network_model. The multiplier on distance is bisected
+		until the gap between the best solution meeting the bounds and the dual bound is within the
+		optimality gap, and the gap is logged.
+		'''
+		if self.margin_constraint and self.data_manager.margin_target > 0:
+			return None
+
+		min_distance = self.data_manager.min_distance if not self.data_manager.min_distance is None and self.data_manager.min_distance > 0 else None
+		max_distance = self.data_manager.max_distance if not self.data_manager.max_distance is None and self.data_manager.max_distance > 0 else None
+		gap_tolerance = optimality_gap if not optimality_gap is None else 1e-4
+		self.log_isolated_must_take_trips()
+		arc_index = self.data_manager.arc_index
+		is_accepted, self.objective_value, self.dual_bound, num_solves = solve_distance_lagrangian(
+			arc_index.t1, arc_index.t2, self.objective_coefficients(),
+			self.data_manager.arc_store['distance'], arc_index.num_trips(),
+			min_distance=min_distance,
+			max_distance=max_distance,
+			gap_tolerance=gap_tolerance)
+		if is_accepted is None:
+			logger.info('Lagrangian relaxation found no solution meeting the distance bounds in ' + str(num_solves) + ' subproblems.')
+			return None
+
+		self.solution = is_accepted.astype(float)
+		self.lagrangian_gap = (self.dual_bound - self.objective_value) / max(abs(self.dual_bound), 1)
+		message = 'Lagrangian relaxation solved ' + str(num_solves) + ' subproblems: objective ' + str(round(self.objective_value, 2)) +\
+			', dual bound ' + str(round(self.dual_bound, 2)) + ', gap ' + str(round(self.lagrangian_gap * 100, 2)) + '%.'
+		logger.info(message)
+		self.data_manager.file_manager.add_message_to_log(message, 'general')
+		return 'optimal' if self.lagrangian_gap <= gap_tolerance else 'feasible'
@@ -8,42 +8,94 @@ which trips to accept by accepting pairs of trips that increase network profitab
 when assigned together
 '''
 
+import numpy
 import pyomo.environ as pe
 from . import freight_model
+from .matrix_model import MatrixModel
+from .network_model import solve_matching
 
 
 class FreightModelTwoTourLimit(freight_model.FreightModel):
 
+	def log_isolated_must_take_trips(self):
+		'''
+		logs an error for each must-take trip that does not belong to any potential tour
+		'''
+		arc_index = self.data_manager.arc_index
+		isolated_must_take = self.data_manager.trip_df.index[
+			(arc_index.out_degree() + arc_index.in_degree() == 0) & self.data_manager.trip_df['must_take_flag'].values.astype(bool)]
+		for tt in isolated_must_take:
+			message = 'Trip ' + str(tt) + ' is a must-take trip, but has no potential trips to connect to that meet the deadhead threshold.'
+			self.data_manager.file_manager.add_message_to_log(message, 'error')
+
+
 	def define_model(self):
 		'''
 		This function defines the model, that is, the objective function and constraints
 		'''
 
 		self.model = pe.ConcreteModel(name="Two Trip Limit Model")
+		arc_index = self.data_manager.arc_index
 		
 		self.trip_set = pe.Set(initialize=self.data_manager.trip_df.index.values, doc='Trips')
 		"""Build the decision variables"""
-		self.model.XX = pe.Var(self.data_manager.potential_trip_df.index.values, domain=pe.Binary)
+		self.define_variables()
 
 
 		# Objective: maximum profit from assigned trips
-		def objective_rule(model):
-			if self.data_manager.margin_target <= 0:
-				return sum(model.XX[idx] * int(self.data_manager.potential_trip_df.loc[idx, 'profit_adj']) for idx in self.data_manager.potential_trip_df.index.values)
-			else:
-				return sum(model.XX[idx] * int(self.data_manager.potential_trip_df.loc[idx, 'profit_adj']) for idx in self.data_manager.potential_trip_df.index.values) +\
-					sum(model.XX[idx] * int(self.data_manager.potential_trip_df.loc[idx, 'margin_improvement']) 
-						for idx in self.data_manager.potential_trip_df.index.values) * self.margin_weight
-		self.model.obj = pe.Objective(rule=objective_rule, sense=pe.maximize)
+		self.define_objective()
 
 		# Constraint 1: all trips can be assigned at most once (or exactly once if the trip is a "must-take")
+		self.log_isolated_must_take_trips()
+
 		def trip_post_connection_limit(model, tt: int):
-			trips = self.data_manager.leg_idx_df.loc[tt]['potential_trip_idcs']
-			if len(trips) == 0:
-				if self.data_manager.trip_df.loc[tt]['must_take_flag']:
-					message = 'Trip ' + str(tt) + ' is a must-take trip, but has no potential trips to connect to that meet the deadhead threshold.'
-					self.data_manager.file_manager.add_message_to_log(message, 'error')
-				return pe.Constraint.Skip
-			
-			return sum(model.XX[x] for x in trips) <= 1
-		self.model.tripPostConnectionLimit = pe.Constraint(self.trip_set, rule=trip_post_connection_limit)
\ No newline at end of file
+			position = arc_index.position(tt)
+			trips = numpy.concatenate((arc_index.outgoing_positions(position), arc_index.incoming_positions(position)))
+			return self.linear_expression(trips) <= 1
+		has_tours = arc_index.out_degree() + arc_index.in_degree() > 0
+		self.model.tripPostConnectionLimit = pe.Constraint(arc_index.trip_index[has_tours].values, rule=trip_post_connection_limit)
+
+		# Constraint 2: (optional) The accepted tours must meet the margin target
+		self.define_margin_constraint()
+
+
+	def define_matrix_model(self) -> MatrixModel:
+		'''
+		builds the objective and constraints of define_model as a MatrixModel. Every tour
+		contributes one entry to the row of each of its two trips.
+		'''
+		arc_index = self.data_manager.arc_index
+		matrix_model = MatrixModel("Two Trip Limit Model", self.objective_coefficients())
+		arc_positions = numpy.arange(len(arc_index.arc_labels))
+
+		# Constraint 1: all trips can be assigned at most once
+		self.log_isolated_must_take_trips()
+		has_tours = arc_index.out_degree() + arc_index.in_degree() > 0
+		rows = numpy.full(arc_index.num_trips(), -1)
+		rows[has_tours] = numpy.arange(has_tours.sum())
+		matrix_model.add_constraints('trip_post_connection_limit',
+			row_ids=numpy.concatenate((rows[arc_index.t1], rows[arc_index.t2])),
+			columns=numpy.concatenate((arc_positions, arc_positions)),
+			values=numpy.ones(2 * len(arc_positions)),
+			sense='L',
+			rhs=numpy.ones(has_tours.sum()),
+			row_labels=arc_index.trip_index[has_tours])
+		self.add_matrix_margin_constraint(matrix_model)
+		return matrix_model
+
+
+	def solve_network_model(self) -> str:
+		'''
+		without a margin constraint, the model is a maximum weight matching on the graph of potential
+		tours and is solved exactly by network_model.solve_matching
+		'''
+		if self.margin_constraint and self.data_manager.margin_target > 0:
+			return None
+
+		self.log_isolated_must_take_trips()
+		arc_index = self.data_manager.arc_index
+		coefficients = self.objective_coefficients()
+		is_accepted = solve_matching(arc_index.t1, arc_index.t2, coefficients, arc_index.num_trips())
+		self.solution = is_accepted.astype(float)
+		self.objective_value = coefficients @ self.solution
+		return 'optimal'
@@ -0,0 +1,481 @@
+'''
+This file contains the MatrixModel class, a solver-independent form of the optimization models:
+an objective vector over the arcs of the arc store and blocks of sparse constraint rows in
+CSR form. The model is written to an LP or MPS file in one buffered pass and handed to the
+solver's command line executable; the solution file is read back into a numpy vector aligned with
+the arc store. This avoids building and walking a Pyomo model, which dominates the run time
+for large problems.
+'''
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+import numpy
+import scipy.sparse
+
+from arc_builder import group_members
+
+logger = logging.getLogger("__main__")
+
+#number of terms formatted per write when emitting a model file
+WRITE_CHUNK_SIZE = 100000
+
+#solver executables that can be run on a model file
+SOLVER_EXECUTABLES = {
+	'gurobi': 'gurobi_cl',
+	'cplex': 'cplex',
+	'glpk': 'glpsol',
+	'cbc': 'cbc',
+	'highs': 'highs',
+	'mosek': 'mosek'
+}
+
+SENSE_SYMBOLS = {'E': '=', 'L': '<=', 'G': '>='}
+
+
+class ConstraintBlock:
+	'''
+	This class holds a named block of constraint rows in CSR form. The columns of row i are
+	columns[offsets[i]:offsets[i + 1]], with coefficients in the same slice of values.
+	'''
+
+	def __init__(self, name: str, offsets: numpy.ndarray, columns: numpy.ndarray, values: numpy.ndarray,
+		sense: str, rhs: numpy.ndarray, row_labels: iter=None):
+		'''
+			name: the name of the block, used as the prefix of the row names
+			offsets: the CSR row offsets (length number of rows + 1)
+			columns: the variable position of each entry
+			values: the coefficient of each entry
+			sense: 'E' (=), 'L' (<=) or 'G' (>=)
+			rhs: the right hand side of each row
+			row_labels: labels used in the row names (i.e. trip indices). Defaults to the row number.
+		'''
+		if sense not in SENSE_SYMBOLS:
+			raise ValueError('Constraint sense must be one of ' + str(list(SENSE_SYMBOLS.keys())))
+		self.name = name
+		self.offsets = numpy.asarray(offsets, dtype=numpy.int64)
+		self.columns = numpy.asarray(columns, dtype=numpy.int64)
+		self.values = numpy.asarray(values, dtype=numpy.float64)
+		self.sense = sense
+		self.rhs = numpy.asarray(rhs, dtype=numpy.float64)
+		if row_labels is None:
+			row_labels = numpy.arange(len(self.rhs))
+		self.row_names = [name + '_' + str(label) for label in row_labels]
+
+
+	def num_rows(self) -> int:
+		'''
+		returns the number of rows in the block
+		'''
+		return len(self.rhs)
+
+
+	def num_entries(self) -> int:
+		'''
+		returns the number of nonzero entries in the block
+		'''
+		return len(self.columns)
+
+
+class MatrixModel:
+	'''
+	This class holds a binary program: maximize objective @ x subject to the constraint blocks,
+	with one binary variable per arc. Variables are named x<position>, where position is the
+	row position of the arc in the arc store.
+	'''
+
+	def __init__(self, name: str, objective: numpy.ndarray):
+		'''
+			name: the name of the model
+			objective: the objective coefficient of each variable
+		'''
+		self.name = name
+		self.objective = numpy.asarray(objective, dtype=numpy.float64)
+		self.blocks = []
+		self.variable_names = ['x' + str(position) for position in range(len(self.objective))]
+
+
+	def num_variables(self) -> int:
+		'''
+		returns the number of variables in the model
+		'''
+		return len(self.objective)
+
+
+	def num_rows(self) -> int:
+		'''
+		returns the number of constraint rows in the model
+		'''
+		return sum(block.num_rows() for block in self.blocks)
+
+
+	def add_constraints(self, name: str, row_ids: numpy.ndarray, columns: numpy.ndarray, values: numpy.ndarray,
+		sense: str, rhs: numpy.ndarray, row_labels: iter=None) -> ConstraintBlock:
+		"""Adds a block of constraint rows given in coordinate form. Entries are grouped by row
+		with a stable sort, so the terms of each row keep the order they were given in.
+
+		Args:
+			name (str): The name of the block
+			row_ids (numpy.ndarray): The row of each entry, between 0 and len(rhs) - 1
+			columns (numpy.ndarray): The variable position of each entry
+			values (numpy.ndarray): The coefficient of each entry
+			sense (str): 'E' (=), 'L' (<=) or 'G' (>=)
+			rhs (numpy.ndarray): The right hand side of each row
+			row_labels (iter, optional): Labels used in the row names. Defaults to None.
+
+		Returns:
+			ConstraintBlock: The block added to the model
+		"""
+		rhs = numpy.asarray(rhs, dtype=numpy.float64)
+		offsets, order = group_members(numpy.asarray(row_ids, dtype=numpy.int64), len(rhs))
+		block = ConstraintBlock(name, offsets, numpy.asarray(columns)[order], numpy.asarray(values)[order], sense, rhs, row_labels)
+		self.blocks.append(block)
+		return block
+
+
+	def add_constraint(self, name: str, columns: numpy.ndarray, values: numpy.ndarray, sense: str, rhs: float) -> ConstraintBlock:
+		'''
+		adds a single constraint row
+		'''
+		block = self.add_constraints(name, numpy.zeros(len(columns), dtype=numpy.int64), columns, values, sense, [rhs])
+		block.row_names = [name]
+		return block
+
+
+	def constraint_arrays(self) -> tuple[scipy.sparse.csr_matrix, numpy.ndarray, numpy.ndarray]:
+		"""Stacks the constraint blocks into one sparse matrix, with the rows in block order.
+
+		Returns:
+			tuple[scipy.sparse.csr_matrix, numpy.ndarray, numpy.ndarray]: The constraint matrix (rows by
+				variables), the sense of each row and the right hand side of each row
+		"""
+		matrices = [scipy.sparse.csr_matrix((block.values, block.columns, block.offsets), shape=(block.num_rows(), self.num_variables()))
+			for block in self.blocks]
+		matrix = scipy.sparse.vstack(matrices, format='csr') if len(matrices) > 0 else scipy.sparse.csr_matrix((0, self.num_variables()))
+		senses = numpy.concatenate([numpy.full(block.num_rows(), block.sense) for block in self.blocks] + [numpy.zeros(0, dtype='<U1')])
+		rhs = numpy.concatenate([block.rhs for block in self.blocks] + [numpy.zeros(0)])
+		return matrix, senses, rhs
+
+
+	def _format_terms(self, columns: numpy.ndarray, values: numpy.ndarray) -> str:
+		'''
+		formats a chunk of terms for the LP file, one term per line
+		'''
+		return ''.join(map('{:+} x{}\n'.format, values.tolist(), columns.tolist()))
+
+
+	def write_lp(self, filename: str):
+		'''
+		writes the model to a file in CPLEX LP format. Every variable appears in the objective
+		(with a zero coefficient if needed), so solvers number the columns in position order.
+		'''
+		positions = numpy.arange(self.num_variables())
+		with open(filename, 'w', buffering=1 << 20) as lp_file:
+			lp_file.write('\\* ' + self.name + ' *\\\n\nmaximize\n\nobj:\n')
+			for start in range(0, len(positions), WRITE_CHUNK_SIZE):
+				lp_file.write(self._format_terms(positions[start:start + WRITE_CHUNK_SIZE], self.objective[start:start + WRITE_CHUNK_SIZE]))
+			lp_file.write('\nsubject to\n')
+
+			for block in self.blocks:
+				for row in range(block.num_rows()):
+					lp_file.write('\n' + block.row_names[row] + ':\n')
+					start = block.offsets[row]
+					end = block.offsets[row + 1]
+					for chunk_start in range(start, end, WRITE_CHUNK_SIZE):
+						chunk_end = min(end, chunk_start + WRITE_CHUNK_SIZE)
+						lp_file.write(self._format_terms(block.columns[chunk_start:chunk_end], block.values[chunk_start:chunk_end]))
+					lp_file.write(SENSE_SYMBOLS[block.sense] + ' ' + repr(float(block.rhs[row])) + '\n')
+
+			lp_file.write('\nbinary\n')
+			for start in range(0, len(positions), WRITE_CHUNK_SIZE):
+				lp_file.write(''.join(map('x{}\n'.format, positions[start:start + WRITE_CHUNK_SIZE].tolist())))
+			lp_file.write('\nend\n')
+
+
+	def write_mps(self, filename: str):
+		'''
+		writes the model to a file in free MPS format, with an OBJSENSE section for maximization.
+		The constraint entries are regrouped by column with one stable sort.
+		'''
+		row_names = numpy.array([name for block in self.blocks for name in block.row_names], dtype=object)
+		row_starts = numpy.cumsum([0] + [block.num_rows() for block in self.blocks])
+		entry_rows = numpy.concatenate([row_starts[idx] + numpy.repeat(numpy.arange(block.num_rows()), numpy.diff(block.offsets))
+			for idx, block in enumerate(self.blocks)] + [numpy.zeros(0, dtype=numpy.int64)])
+		entry_columns = numpy.concatenate([block.columns for block in self.blocks] + [numpy.zeros(0, dtype=numpy.int64)])
+		entry_values = numpy.concatenate([block.values for block in self.blocks] + [numpy.zeros(0)])
+
+		#prepend the objective so it leads each column
+		num_variables = self.num_variables()
+		entry_columns = numpy.concatenate((numpy.arange(num_variables), entry_columns))
+		entry_values = numpy.concatenate((self.objective, entry_values))
+		entry_row_names = numpy.concatenate((numpy.full(num_variables, 'obj', dtype=object), row_names[entry_rows]))
+		_, order = group_members(entry_columns, num_variables)
+
+		with open(filename, 'w', buffering=1 << 20) as mps_file:
+			mps_file.write('NAME ' + re.sub(r'\s+', '_', self.name) + '\nOBJSENSE\n    MAX\nROWS\n N obj\n')
+			for block in self.blocks:
+				mps_file.write(''.join(' ' + block.sense + ' ' + name + '\n' for name in block.row_names))
+			mps_file.write("COLUMNS\n MARKER 'MARKER' 'INTORG'\n")
+			for start in range(0, len(order), WRITE_CHUNK_SIZE):
+				chunk = order[start:start + WRITE_CHUNK_SIZE]
+				mps_file.write(''.join(map(' x{} {} {!r}\n'.format,
+					entry_columns[chunk].tolist(), entry_row_names[chunk].tolist(), entry_values[chunk].tolist())))
+			mps_file.write(" MARKER 'MARKER' 'INTEND'\nRHS\n")
+			for block in self.blocks:
+				nonzero = numpy.flatnonzero(block.rhs)
+				mps_file.write(''.join(' rhs {} {!r}\n'.format(block.row_names[row], float(block.rhs[row])) for row in nonzero))
+			mps_file.write('BOUNDS\n')
+			for start in range(0, num_variables, WRITE_CHUNK_SIZE):
+				mps_file.write(''.join(map(' BV bnd {}\n'.format, self.variable_names[start:start + WRITE_CHUNK_SIZE])))
+			mps_file.write('ENDATA\n')
+
+
+	def write(self, filename: str):
+		'''
+		writes the model in the format given by the file extension (.lp or .mps)
+		'''
+		if filename.lower().endswith('.mps'):
+			self.write_mps(filename)
+		else:
+			self.write_lp(filename)
+
+
+	def solve(self,
+		solver_name: str,
+		solver_time_limit: int=None,
+		optimality_gap: float=None,
+		warm_start: numpy.ndarray=None,
+		threads: int=None,
+		verbose: bool=False,
+		model_format: str='lp',
+		model_filename: str=None) -> tuple[str, numpy.ndarray]:
+		"""Writes the model, runs the solver's command line executable on it and reads the
+		solution file back.
+
+		Args:
+			solver_name (str): One of the keys of SOLVER_EXECUTABLES. The executable must be
+				in your system's PATH environment variable.
+			solver_time_limit (int, optional): The solver time limit in seconds. Defaults to None.
+			optimality_gap (float, optional): The relative optimality gap. Defaults to None.
+			warm_start (numpy.ndarray, optional): A 0/1 starting solution, by variable position.
+				Only used by solvers that read a MIP start file. Defaults to None.
+			threads (int, optional): The maximum number of solver threads. Defaults to None,
+				meaning the solver default; glpk is single-threaded.
+			verbose (bool, optional): Whether to show the solver output. Defaults to False.
+			model_format (str, optional): 'lp' or 'mps'. Defaults to 'lp'.
+			model_filename (str, optional): If given, a copy of the model file is kept here.
+				Defaults to None.
+
+		Returns:
+			tuple[str, numpy.ndarray]: The termination condition ('optimal', 'feasible' or
+				'infeasible') and the value of each variable, by position
+		"""
+		solver_name = solver_name.lower()
+		if solver_name not in SOLVER_EXECUTABLES:
+			raise ValueError('The matrix backend supports the solvers ' + str(list(SOLVER_EXECUTABLES.keys())) + ', not ' + solver_name)
+		executable = shutil.which(SOLVER_EXECUTABLES[solver_name])
+		if executable is None:
+			raise ValueError('Solver executable ' + SOLVER_EXECUTABLES[solver_name] + ' not found in PATH.')
+		if model_format not in ['lp', 'mps']:
+			raise ValueError('model_format must be either "lp" or "mps"')
+
+		with tempfile.TemporaryDirectory() as folder:
+			model_path = os.path.join(folder, 'model.' + model_format)
+			solution_path = os.path.join(folder, 'model.sol')
+			self.write(model_path)
+			if not model_filename is None:
+				shutil.copyfile(model_path, model_filename)
+			logger.info('Model file written with ' + str(self.num_variables()) + ' variables and ' + str(self.num_rows()) + ' constraints.')
+
+			start_path = None
+			if not warm_start is None and solver_name == 'gurobi':
+				start_path = os.path.join(folder, 'start.mst')
+				with open(start_path, 'w') as start_file:
+					start_file.write(''.join(map('x{} {}\n'.format, range(self.num_variables()), numpy.round(warm_start).astype(int).tolist())))
+
+			command = self._solver_command(solver_name, executable, folder, model_path, solution_path, model_format,
+				solver_time_limit, optimality_gap, start_path, threads)
+			completed = subprocess.run(command, cwd=folder, stdout=None if verbose else subprocess.PIPE,
+				stderr=subprocess.STDOUT, text=True)
+			if completed.returncode != 0:
+				logger.warning(solver_name + ' exited with code ' + str(completed.returncode))
+			if solver_name == 'mosek':
+				solution_path = os.path.splitext(model_path)[0] + '.int'
+			if not os.path.exists(solution_path):
+				return 'infeasible', numpy.zeros(self.num_variables())
+			with open(solution_path, 'r') as solution_file:
+				return getattr(self, '_read_' + solver_name + '_solution')(solution_file)
+
+
+	def _solver_command(self, solver_name: str, executable: str, folder: str, model_path: str, solution_path: str,
+		model_format: str, solver_time_limit: int, optimality_gap: float, start_path: str, threads: int=None) -> list:
+		'''
+		returns the command line for running a solver on a model file
+		'''
+		if solver_name == 'gurobi':
+			command = [executable, 'ResultFile=' + solution_path]
+			if not solver_time_limit is None:
+				command.append('TimeLimit=' + str(solver_time_limit))
+			if not optimality_gap is None:
+				command.append('MIPGap=' + str(optimality_gap))
+			if not start_path is None:
+				command.append('InputFile=' + start_path)
+			if not threads is None:
+				command.append('Threads=' + str(threads))
+			return command + [model_path]
+
+		if solver_name == 'cplex':
+			command = [executable, '-c', 'read ' + model_path]
+			if not solver_time_limit is None:
+				command.append('set timelimit ' + str(solver_time_limit))
+			if not optimality_gap is None:
+				command.append('set mip tolerances mipgap ' + str(optimality_gap))
+			if not threads is None:
+				command.append('set threads ' + str(threads))
+			return command + ['optimize', 'write ' + solution_path + ' sol']
+
+		if solver_name == 'glpk':
+			command = [executable, '--' + ('lp' if model_format == 'lp' else 'freemps'), model_path, '-w', solution_path]
+			if model_format == 'mps':
+				command.append('--max')
+			if not solver_time_limit is None:
+				command += ['--tmlim', str(solver_time_limit)]
+			if not optimality_gap is None:
+				command += ['--mipgap', str(optimality_gap)]
+			return command
+
+		if solver_name == 'cbc':
+			command = [executable, model_path]
+			if not solver_time_limit is None:
+				command += ['sec', str(solver_time_limit)]
+			if not optimality_gap is None:
+				command += ['ratio', str(optimality_gap)]
+			if not threads is None:
+				command += ['threads', str(threads)]
+			return command + ['solve', 'solu', solution_path]
+
+		if solver_name == 'highs':
+			options_path = os.path.join(folder, 'highs.opt')
+			with open(options_path, 'w') as options_file:
+				if not solver_time_limit is None:
+					options_file.write('time_limit = ' + str(solver_time_limit) + '\n')
+				if not optimality_gap is None:
+					options_file.write('mip_rel_gap = ' + str(optimality_gap) + '\n')
+				if not threads is None:
+					options_file.write('threads = ' + str(threads) + '\n')
+			return [executable, '--model_file', model_path, '--options_file', options_path, '--solution_file', solution_path]
+
+		#mosek writes its integer solution next to the model file
+		command = [executable]
+		if not solver_time_limit is None:
+			command += ['-d', 'MSK_DPAR_OPTIMIZER_MAX_TIME', str(solver_time_limit)]
+		if not optimality_gap is None:
+			command += ['-d', 'MSK_DPAR_MIO_TOL_REL_GAP', str(optimality_gap)]
+		if not threads is None:
+			command += ['-d', 'MSK_IPAR_NUM_THREADS', str(threads)]
+		return command + [model_path]
+
+
+	def _values_from_names(self, names: list, values: list) -> numpy.ndarray:
+		'''
+		returns a vector of variable values by position from parallel lists of names and values.
+		Names that are not variables (i.e. constraint rows) are ignored.
+		'''
+		solution = numpy.zeros(self.num_variables())
+		for name, value in zip(names, values):
+			if name.startswith('x') and name[1:].isdigit():
+				solution[int(name[1:])] = float(value)
+		return solution
+
+
+	def _read_gurobi_solution(self, solution_file) -> tuple[str, numpy.ndarray]:
+		'''
+		reads a Gurobi .sol file: comment lines starting with # followed by "name value" lines
+		'''
+		tokens = [line.split() for line in solution_file if not line.startswith('#') and line.strip()]
+		if len(tokens) == 0:
+			return 'infeasible', numpy.zeros(self.num_variables())
+		return 'feasible', self._values_from_names([x[0] for x in tokens], [x[1] for x in tokens])
+
+
+	def _read_cplex_solution(self, solution_file) -> tuple[str, numpy.ndarray]:
+		'''
+		reads a CPLEX XML solution file
+		'''
+		text = solution_file.read()
+		status = re.search(r'solutionStatusString="([^"]*)"', text)
+		variables = re.findall(r'<variable name="([^"]*)"[^>]*value="([^"]*)"', text)
+		if status is None or len(variables) == 0:
+			return 'infeasible', numpy.zeros(self.num_variables())
+		termination = 'optimal' if 'optimal' in status.group(1) else 'feasible'
+		return termination, self._values_from_names([x[0] for x in variables], [x[1] for x in variables])
+
+
+	def _read_glpk_solution(self, solution_file) -> tuple[str, numpy.ndarray]:
+		'''
+		reads a GLPK raw solution file ("s mip rows cols status objective" followed by "i" row
+		lines and "j column value" lines). Columns are numbered from 1 in the order they appear
+		in the model file, which is the position order.
+		'''
+		termination = 'infeasible'
+		solution = numpy.zeros(self.num_variables())
+		for line in solution_file:
+			tokens = line.split()
+			if len(tokens) == 0:
+				continue
+			if tokens[0] == 's':
+				termination = {'o': 'optimal', 'f': 'feasible'}.get(tokens[4], 'infeasible')
+			elif tokens[0] == 'j':
+				solution[int(tokens[1]) - 1] = float(tokens[2])
+		return termination, solution
+
+
+	def _read_cbc_solution(self, solution_file) -> tuple[str, numpy.ndarray]:
+		'''
+		reads a CBC solution file: a status line followed by "index name value reduced_cost" lines
+		'''
+		lines = solution_file.readlines()
+		if len(lines) == 0 or 'infeasible' in lines[0].lower():
+			return 'infeasible', numpy.zeros(self.num_variables())
+		termination = 'optimal' if lines[0].startswith('Optimal') else 'feasible'
+		tokens = [line.replace('**', '').split() for line in lines[1:] if line.strip()]
+		return termination, self._values_from_names([x[1] for x in tokens], [x[2] for x in tokens])
+
+
+	def _read_highs_solution(self, solution_file) -> tuple[str, numpy.ndarray]:
+		'''
+		reads a HiGHS solution file: the model status, then a "# Columns n" section of
+		"name value" lines
+		'''
+		lines = solution_file.read().splitlines()
+		status = lines[1].strip().lower() if len(lines) > 1 else ''
+		if 'optimal' in status:
+			termination = 'optimal'
+		elif 'limit' in status:
+			termination = 'feasible'
+		else:
+			return 'infeasible', numpy.zeros(self.num_variables())
+		start = next((idx for idx, line in enumerate(lines) if line.startswith('# Columns')), None)
+		if start is None:
+			return 'infeasible', numpy.zeros(self.num_variables())
+		tokens = [line.split() for line in lines[start + 1:start + 1 + int(lines[start].split()[-1])]]
+		return termination, self._values_from_names([x[0] for x in tokens], [x[1] for x in tokens])
+
+
+	def _read_mosek_solution(self, solution_file) -> tuple[str, numpy.ndarray]:
+		'''
+		reads a MOSEK .int solution file: a header with the solution status, then a VARIABLES
+		section of "index name status activity ..." lines
+		'''
+		lines = solution_file.read().splitlines()
+		status = next((line.split(':')[-1].strip() for line in lines if line.startswith('SOLUTION STATUS')), '')
+		if status not in ['INTEGER_OPTIMAL', 'PRIMAL_FEASIBLE', 'OPTIMAL']:
+			return 'infeasible', numpy.zeros(self.num_variables())
+		termination = 'feasible' if status == 'PRIMAL_FEASIBLE' else 'optimal'
+		start = lines.index('VARIABLES') + 2
+		tokens = [line.split() for line in lines[start:] if line.strip()]
+		return termination, self._values_from_names([x[1] for x in tokens], [x[3] for x in tokens])
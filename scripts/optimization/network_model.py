@@ -0,0 +1,256 @@
+'''
+This file contains combinatorial engines for the optimization models, which solve them without a
+MIP solver. Without distance bounds, the TSP model (flow conservation and at most one prior trip
+per trip) is an assignment problem: every trip is split into a "from" node and a "to" node, each
+arc t1 -> t2 links the "from" node of t1 to the "to" node of t2, and a self-loop from each trip to
+itself means the trip is not used. A full matching is then a set of disjoint cycles, which is
+exactly a feasible solution of the model. The two tour limit model picks pairs of trips with each
+trip used at most once, which is a maximum weight matching on the graph of potential tours.
+
+The distance bounds of the TSP model are the only constraints that break the assignment structure.
+solve_distance_lagrangian moves them into the objective with a multiplier on distance, so every
+subproblem is again an assignment problem, and searches the multiplier by bisection.
+'''
+
+import networkx
+import numpy
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components, min_weight_full_bipartite_matching
+
+
+def solve_assignment(t1: numpy.ndarray, t2: numpy.ndarray, weights: numpy.ndarray, num_trips: int) -> numpy.ndarray:
+	"""Finds the set of disjoint cycles of arcs with the largest total weight, as a minimum weight
+	full matching on the split-node bipartite graph. The matching needs nonzero weights, so each
+	arc costs offset - weight and each self-loop costs offset, with offset larger than every
+	weight; every full matching has num_trips edges, so the offset does not change the optimum.
+
+	Args:
+		t1 (numpy.ndarray): The trip position of the first trip of each arc
+		t2 (numpy.ndarray): The trip position of the second trip of each arc
+		weights (numpy.ndarray): The objective coefficient of each arc
+		num_trips (int): The number of trips
+
+	Returns:
+		numpy.ndarray: A boolean array indicating which arcs are accepted
+	"""
+	weights = numpy.asarray(weights, dtype=numpy.float64)
+	offset = max(weights.max(initial=0), 0) + 1
+	self_loops = numpy.arange(num_trips)
+	costs = numpy.concatenate((offset - weights, numpy.full(num_trips, offset)))
+	biadjacency = scipy.sparse.csr_matrix(
+		(costs, (numpy.concatenate((t1, self_loops)), numpy.concatenate((t2, self_loops)))),
+		shape=(num_trips, num_trips))
+	_, successors = min_weight_full_bipartite_matching(biadjacency)
+	return successors[t1] == t2
+
+
+def solve_matching(t1: numpy.ndarray, t2: numpy.ndarray, weights: numpy.ndarray, num_trips: int) -> numpy.ndarray:
+	"""Finds the set of disjoint trip pairs with the largest total weight with the blossom
+	algorithm (networkx.max_weight_matching). Pairs with a weight of zero or less can never improve
+	a matching, so they are left out of the graph.
+
+	Args:
+		t1 (numpy.ndarray): The trip position of the first trip of each pair
+		t2 (numpy.ndarray): The trip position of the second trip of each pair
+		weights (numpy.ndarray): The objective coefficient of each pair
+		num_trips (int): The number of trips
+
+	Returns:
+		numpy.ndarray: A boolean array indicating which pairs are accepted
+	"""
+	weights = numpy.asarray(weights, dtype=numpy.float64)
+	t1 = numpy.asarray(t1, dtype=numpy.int64)
+	t2 = numpy.asarray(t2, dtype=numpy.int64)
+	is_positive = numpy.flatnonzero(weights > 0)
+	graph = networkx.Graph()
+	graph.add_weighted_edges_from(zip(t1[is_positive].tolist(), t2[is_positive].tolist(), weights[is_positive].tolist()))
+	matching = networkx.max_weight_matching(graph)
+
+	#pairs are unordered, so match them on (smaller position, larger position)
+	pair_keys = numpy.minimum(t1, t2) * num_trips + numpy.maximum(t1, t2)
+	matched_keys = numpy.array([min(u, v) * num_trips + max(u, v) for u, v in matching], dtype=numpy.int64)
+	return numpy.isin(pair_keys, matched_keys)
+
+
+def cycle_labels(t1: numpy.ndarray, t2: numpy.ndarray, num_trips: int) -> numpy.ndarray:
+	"""Labels the cycle each accepted arc belongs to. The accepted arcs of the TSP model form
+	disjoint cycles, so the cycles are the connected components of the graph of accepted arcs.
+
+	Args:
+		t1 (numpy.ndarray): The trip position of the first trip of each accepted arc
+		t2 (numpy.ndarray): The trip position of the second trip of each accepted arc
+		num_trips (int): The number of trips
+
+	Returns:
+		numpy.ndarray: The cycle label of each accepted arc
+	"""
+	graph = scipy.sparse.csr_matrix((numpy.ones(len(t1)), (t1, t2)), shape=(num_trips, num_trips))
+	_, labels = connected_components(graph, directed=True, connection='weak')
+	return labels[t1]
+
+
+def cycle_sequences(t1: numpy.ndarray, t2: numpy.ndarray, num_trips: int) -> tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+	"""Lists the trips of the cycles formed by the accepted arcs in tour order, following the
+	successor of each trip once, so in O(n). Each cycle starts at the first trip of the last arc
+	not yet in a cycle, and the cycles are numbered in that order.
+
+	Args:
+		t1 (numpy.ndarray): The trip position of the first trip of each accepted arc
+		t2 (numpy.ndarray): The trip position of the second trip of each accepted arc
+		num_trips (int): The number of trips
+
+	Returns:
+		tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]: The trip position, cycle number and
+			position in the cycle of each trip in a cycle
+	"""
+	successor = numpy.full(num_trips, -1, dtype=numpy.int64)
+	successor[t1] = t2
+	successor = successor.tolist()
+	is_visited = [False] * num_trips
+	trips, cycles, legs = [], [], []
+	for start in reversed(numpy.asarray(t1).tolist()):
+		if is_visited[start]:
+			continue
+		cycle, trip, leg = (cycles[-1] + 1 if cycles else 0), start, 0
+		while not is_visited[trip]:
+			is_visited[trip] = True
+			trips.append(trip)
+			cycles.append(cycle)
+			legs.append(leg)
+			trip, leg = successor[trip], leg + 1
+	return numpy.array(trips, dtype=numpy.int64), numpy.array(cycles, dtype=numpy.int64), numpy.array(legs, dtype=numpy.int64)
+
+
+def repair_maximum_distance(solutions: list[numpy.ndarray], t1: numpy.ndarray, t2: numpy.ndarray,
+	weights: numpy.ndarray, distance: numpy.ndarray, num_trips: int, max_distance: float) -> numpy.ndarray:
+	"""Builds a set of cycles that meets the maximum distance from the cycles of one or more
+	solutions, taking the highest weight per mile first while they fit in the distance budget and
+	share no trip with a cycle already taken. A set of trip-disjoint cycles keeps flow
+	conservation, so the result is feasible for the model.
+
+	Args:
+		solutions (list[numpy.ndarray]): Boolean arrays indicating which arcs are accepted
+		t1 (numpy.ndarray): The trip position of the first trip of each arc
+		t2 (numpy.ndarray): The trip position of the second trip of each arc
+		weights (numpy.ndarray): The objective coefficient of each arc
+		distance (numpy.ndarray): The distance of each arc
+		num_trips (int): The number of trips
+		max_distance (float): The maximum total distance
+
+	Returns:
+		numpy.ndarray: A boolean array indicating which arcs are accepted after the repair
+	"""
+	arcs, labels = [], []
+	for solution in solutions:
+		accepted = numpy.flatnonzero(solution)
+		arcs.append(accepted)
+		labels.append(cycle_labels(t1[accepted], t2[accepted], num_trips) + sum(len(x) for x in labels) * num_trips)
+	arcs = numpy.concatenate(arcs)
+	_, labels = numpy.unique(numpy.concatenate(labels), return_inverse=True)
+	cycle_weight = numpy.bincount(labels, weights=weights[arcs])
+	cycle_distance = numpy.bincount(labels, weights=distance[arcs])
+	cycle_offsets = numpy.concatenate(([0], numpy.cumsum(numpy.bincount(labels))))
+	cycle_arcs = arcs[numpy.argsort(labels, kind='stable')]
+
+	order = numpy.argsort(-cycle_weight / numpy.maximum(cycle_distance, 1), kind='stable')
+	is_trip_used = numpy.zeros(num_trips, dtype=bool)
+	repaired = numpy.zeros(len(weights), dtype=bool)
+	total_distance = 0
+	for cycle in order:
+		if cycle_weight[cycle] <= 0 or total_distance + cycle_distance[cycle] > max_distance:
+			continue
+		members = cycle_arcs[cycle_offsets[cycle]:cycle_offsets[cycle + 1]]
+		if is_trip_used[t1[members]].any():
+			continue
+		is_trip_used[t1[members]] = True
+		repaired[members] = True
+		total_distance += cycle_distance[cycle]
+	return repaired
+
+
+def solve_distance_lagrangian(t1: numpy.ndarray, t2: numpy.ndarray, weights: numpy.ndarray, distance: numpy.ndarray,
+	num_trips: int, min_distance: float=None, max_distance: float=None, gap_tolerance: float=1e-4,
+	max_solves: int=40) -> tuple[numpy.ndarray, float, float, int]:
+	"""Solves the TSP model with bounds on the total distance by Lagrangian relaxation. The bound
+	is moved into the objective as multiplier * (distance - bound), and each subproblem is an
+	assignment problem with weights + multiplier * distance. The multiplier is negative when the
+	maximum distance binds and positive when the minimum distance binds. The total distance of the
+	subproblem solution increases with the multiplier, so the multiplier is bisected between a value
+	whose solution meets the bound and one whose solution does not. Each subproblem gives an upper
+	bound on the optimum (the dual bound) and each solution that meets the bounds gives a lower
+	bound; when the maximum distance binds, the solutions that exceed it are repaired by dropping
+	cycles. The search stops when the gap between the bounds is within gap_tolerance.
+
+	Args:
+		t1 (numpy.ndarray): The trip position of the first trip of each arc
+		t2 (numpy.ndarray): The trip position of the second trip of each arc
+		weights (numpy.ndarray): The objective coefficient of each arc
+		distance (numpy.ndarray): The distance of each arc
+		num_trips (int): The number of trips
+		min_distance (float, optional): The minimum total distance, or None
+		max_distance (float, optional): The maximum total distance, or None
+		gap_tolerance (float, optional): The relative gap between the bounds at which to stop
+		max_solves (int, optional): The maximum number of subproblems to solve
+
+	Returns:
+		tuple[numpy.ndarray, float, float, int]: A boolean array indicating which arcs are accepted
+			(None if no solution meeting the bounds was found), the objective value of that
+			solution, the dual bound and the number of subproblems solved
+	"""
+	weights = numpy.asarray(weights, dtype=numpy.float64)
+	distance = numpy.asarray(distance, dtype=numpy.float64)
+	best_solution, best_value, dual_bound = None, -numpy.inf, numpy.inf
+	num_solves = 0
+
+	def meets_bounds(total_distance: float) -> bool:
+		return (min_distance is None or total_distance >= min_distance) and (max_distance is None or total_distance <= max_distance)
+
+	def evaluate(multiplier: float) -> float:
+		nonlocal best_solution, best_value, dual_bound, num_solves
+		num_solves += 1
+		is_accepted = solve_assignment(t1, t2, weights + multiplier * distance, num_trips)
+		total_distance = distance[is_accepted].sum()
+		bound = max_distance if multiplier < 0 else min_distance
+		dual_bound = min(dual_bound, (weights + multiplier * distance)[is_accepted].sum() - multiplier * (bound or 0))
+
+		candidates = [is_accepted]
+		if not max_distance is None and total_distance > max_distance:
+			#combine the cycles of this solution with those of the best solution meeting the bounds
+			solutions = [is_accepted] if best_solution is None else [is_accepted, best_solution]
+			candidates.append(repair_maximum_distance(solutions, t1, t2, weights, distance, num_trips, max_distance))
+		for candidate in candidates:
+			value = weights[candidate].sum()
+			if meets_bounds(distance[candidate].sum()) and value > best_value:
+				best_solution, best_value = candidate, value
+		return total_distance
+
+	def gap() -> float:
+		return (dual_bound - best_value) / max(abs(dual_bound), 1)
+
+	total_distance = evaluate(0)
+	if meets_bounds(total_distance):
+		return best_solution, best_value, dual_bound, num_solves
+
+	#the sign of the multiplier is set by the bound that is violated without it
+	direction = -1 if not max_distance is None and total_distance > max_distance else 1
+	infeasible_multiplier, feasible_multiplier = 0, None
+	step = max(abs(weights).max(initial=0), 1) / max(distance.max(initial=0), 1)
+	while feasible_multiplier is None and num_solves < max_solves:
+		total_distance = evaluate(direction * step)
+		if (direction < 0 and total_distance <= max_distance) or (direction > 0 and total_distance >= min_distance):
+			feasible_multiplier = direction * step
+		else:
+			infeasible_multiplier = direction * step
+			step *= 2
+	if feasible_multiplier is None:
+		return best_solution, best_value, dual_bound, num_solves
+
+	while num_solves < max_solves and gap() > gap_tolerance and \
+		abs(feasible_multiplier - infeasible_multiplier) > 1e-9 * max(abs(feasible_multiplier), 1):
+		multiplier = (infeasible_multiplier + feasible_multiplier) / 2
+		total_distance = evaluate(multiplier)
+		if (direction < 0 and total_distance <= max_distance) or (direction > 0 and total_distance >= min_distance):
+			feasible_multiplier = multiplier
+		else:
+			infeasible_multiplier = multiplier
+	return best_solution, best_value, dual_bound, num_solves
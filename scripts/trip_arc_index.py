@@ -0,0 +1,126 @@
+'''
+This file contains the TripArcIndex class, a CSR-style incidence structure between trips and the
+arcs (potential trips or tours) that start or end at them. It replaces per-trip Python lists of
+arc indices with offset and index arrays, so the arcs of a trip are a slice of a sorted array.
+'''
+
+import numpy
+import pandas
+
+from arc_builder import group_members
+from arc_store import ArcStore
+
+
+class TripArcIndex:
+	'''
+	This class stores, for every trip, the arcs leaving it (sorted by t1) and the arcs entering
+	it (sorted by t2). Arcs are stored by row position in the ArcStore; the methods taking
+	a trip label return arc labels (the ArcStore labels), which are the keys of the
+	model variables.
+	'''
+
+	def __init__(self, trip_index: iter, arc_labels: numpy.ndarray, t1: numpy.ndarray, t2: numpy.ndarray,
+		out_groups: tuple=None, in_groups: tuple=None):
+		'''
+			trip_index: the index of trip_df; trips are identified by their position in it
+			arc_labels: the label of each arc
+			t1: the trip position of the first trip of each arc
+			t2: the trip position of the second trip of each arc
+			out_groups: the (offsets, order) of the arcs grouped by t1, as arc_builder.group_members.
+				Defaults to None, meaning they are computed here.
+			in_groups: the (offsets, order) of the arcs grouped by t2. Defaults to None.
+		'''
+		self.trip_index = pandas.Index(trip_index)
+		self.arc_labels = numpy.asarray(arc_labels)
+		self.t1 = numpy.asarray(t1, dtype=numpy.int64)
+		self.t2 = numpy.asarray(t2, dtype=numpy.int64)
+		num_trips = len(self.trip_index)
+		self.out_offsets, self.out_arcs = group_members(self.t1, num_trips) if out_groups is None else out_groups
+		self.in_offsets, self.in_arcs = group_members(self.t2, num_trips) if in_groups is None else in_groups
+
+
+	@classmethod
+	def from_arc_store(cls, trip_index: iter, arc_store: ArcStore) -> 'TripArcIndex':
+		"""Builds the index from the labels and trip positions of an ArcStore. The arcs are grouped
+		by the store, so a DiskArcStore builds the index over its files.
+
+		Args:
+			trip_index (iter): The index of trip_df
+			arc_store (ArcStore): The arcs
+
+		Returns:
+			TripArcIndex: The incidence index
+		"""
+		num_trips = len(trip_index)
+		return cls(
+			trip_index=trip_index,
+			arc_labels=arc_store.labels,
+			t1=arc_store.t1,
+			t2=arc_store.t2,
+			out_groups=arc_store.group_members('t1', num_trips),
+			in_groups=arc_store.group_members('t2', num_trips))
+
+
+	def num_trips(self) -> int:
+		'''
+		returns the number of trips in the index
+		'''
+		return len(self.trip_index)
+
+
+	def position(self, trip: int) -> int:
+		'''
+		returns the position of a trip label in trip_df
+		'''
+		return self.trip_index.get_loc(trip)
+
+
+	def outgoing_positions(self, position: int) -> numpy.ndarray:
+		'''
+		returns the row positions of the arcs leaving the trip at the given position
+		'''
+		return self.out_arcs[self.out_offsets[position]:self.out_offsets[position + 1]]
+
+
+	def incoming_positions(self, position: int) -> numpy.ndarray:
+		'''
+		returns the row positions of the arcs entering the trip at the given position
+		'''
+		return self.in_arcs[self.in_offsets[position]:self.in_offsets[position + 1]]
+
+
+	def outgoing(self, trip: int) -> numpy.ndarray:
+		'''
+		returns the labels of the arcs leaving a trip (the arcs where it is t1)
+		'''
+		return self.arc_labels[self.outgoing_positions(self.position(trip))]
+
+
+	def incoming(self, trip: int) -> numpy.ndarray:
+		'''
+		returns the labels of the arcs entering a trip (the arcs where it is t2)
+		'''
+		return self.arc_labels[self.incoming_positions(self.position(trip))]
+
+
+	def incident(self, trip: int) -> numpy.ndarray:
+		'''
+		returns the labels of all arcs touching a trip, outgoing first. This is the set of
+		tours a trip belongs to in the two tour limit model.
+		'''
+		position = self.position(trip)
+		return self.arc_labels[numpy.concatenate((self.outgoing_positions(position), self.incoming_positions(position)))]
+
+
+	def out_degree(self) -> numpy.ndarray:
+		'''
+		returns the number of arcs leaving each trip, by trip position
+		'''
+		return numpy.diff(self.out_offsets)
+
+
+	def in_degree(self) -> numpy.ndarray:
+		'''
+		returns the number of arcs entering each trip, by trip position
+		'''
+		return numpy.diff(self.in_offsets)
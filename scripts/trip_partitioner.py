@@ -0,0 +1,256 @@
+'''
+This file contains the geographic partitioner used to split a dataset into parts that are solved
+separately. Trips are grouped into lanes (origin zip3, destination zip3), and the lanes are the
+nodes of a graph whose edges are the deadhead-feasible connections between them. Cutting arcs is
+only costly when the arcs would have been used, so the partitioner first solves the lane flow
+relaxation of the whole dataset (a circulation of trips between lanes, which is integral and solves
+in a fraction of the model time), and keeps the tours of that solution inside a part. The tours
+are ordered by region, using a recursive spectral bisection of the lane graph, and the parts are
+balanced slices of that order, so each part is a set of neighboring regions and at most one tour
+is cut at each boundary.
+'''
+
+import logging
+
+import numpy
+import scipy.optimize
+import scipy.sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import eigsh
+
+import arc_builder
+from deadhead_matrix import DeadheadMatrix
+from zip_codes import NUM_ZIP3
+from optimization.freight_model_lane_flow import expand_lane_flows
+from optimization.network_model import cycle_sequences
+
+logger = logging.getLogger("__main__")
+
+#the number of trip arcs per part used to choose the number of parts automatically
+DEFAULT_ARCS_PER_PART = 2000000
+#graphs up to this many lanes are bisected with a dense eigendecomposition
+DENSE_EIGEN_SIZE = 500
+
+
+def lane_graph(dst_codes: numpy.ndarray, orgn_codes: numpy.ndarray, trip_profit: numpy.ndarray,
+	deadhead_matrix: DeadheadMatrix, max_deadhead: float) -> dict:
+	"""Groups the trips into lanes and lists the deadhead-feasible connections between lanes. Every
+	trip of lane A can be followed by every trip of lane B at the same deadhead, and two trips of
+	the same lane can follow each other when the lane's destination is near its origin. The graph
+	weight of a connection is its value, max(mean profit of A - deadhead cost, 0) per trip arc,
+	spread over the connections of A in proportion to their value, since a trip uses one of them.
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix
+		max_deadhead (float): The maximum empty miles for a connection, or None for no limit
+
+	Returns:
+		dict: 'trip_lane' (the lane of each trip), 'lane_counts' (the trips of each lane), the lanes
+			't1' and 't2' and the 'empty_cost' of each connection, 'weights' (the symmetric sparse
+			lane graph) and 'num_trip_arcs' (the number of trip arcs the connections stand for)
+	"""
+	lane_keys = orgn_codes.astype(numpy.int64) * (NUM_ZIP3 + 1) + dst_codes
+	lane_keys, trip_lane, lane_counts = numpy.unique(lane_keys, return_inverse=True, return_counts=True)
+	num_lanes = len(lane_keys)
+	lane_dst = lane_keys % (NUM_ZIP3 + 1)
+	lane_orgn = lane_keys // (NUM_ZIP3 + 1)
+	lane_profit = numpy.bincount(trip_lane, weights=trip_profit, minlength=num_lanes) / lane_counts
+
+	#the lanes play the part of trips, with no profit filter
+	enumerate_arcs = arc_builder.enumerate_trip_arcs if max_deadhead is None else arc_builder.enumerate_neighbor_arcs
+	arcs = enumerate_arcs(
+		dst_codes=lane_dst,
+		orgn_codes=lane_orgn,
+		trip_profit=numpy.full(num_lanes, numpy.inf),
+		must_take=numpy.zeros(num_lanes, dtype=bool),
+		deadhead_matrix=deadhead_matrix,
+		max_deadhead=max_deadhead)
+	self_miles = deadhead_matrix.empty_miles[lane_dst, lane_orgn]
+	self_cost = deadhead_matrix.empty_cost[lane_dst, lane_orgn]
+	has_self_arcs = ~numpy.isnan(self_cost)
+	if not max_deadhead is None:
+		has_self_arcs &= self_miles <= max_deadhead
+	self_lanes = numpy.flatnonzero(has_self_arcs)
+	t1 = numpy.concatenate((arcs['t1'], self_lanes))
+	t2 = numpy.concatenate((arcs['t2'], self_lanes))
+	empty_cost = numpy.concatenate((arcs['empty_cost'], self_cost[self_lanes])).astype(numpy.float64)
+
+	pairs = lane_counts[t1].astype(numpy.float64) * (lane_counts[t2] - (t1 == t2))
+	arc_value = numpy.maximum(lane_profit[t1] - empty_cost, 0) * pairs
+	out_value = numpy.bincount(t1, weights=arc_value, minlength=num_lanes)
+	share = numpy.divide(arc_value, out_value[t1], out=numpy.zeros(len(t1)), where=out_value[t1] > 0)
+	weights = scipy.sparse.coo_matrix((arc_value * share, (t1, t2)), shape=(num_lanes, num_lanes)).tocsr()
+	return {
+		'trip_lane': trip_lane,
+		'lane_counts': lane_counts,
+		't1': t1,
+		't2': t2,
+		'empty_cost': empty_cost,
+		'weights': (weights + weights.T).tocsr(),
+		'num_trip_arcs': int(pairs.sum())
+	}
+
+
+def solve_lane_circulation(graph: dict, trip_profit: numpy.ndarray) -> tuple[numpy.ndarray, numpy.ndarray]:
+	"""Solves the LP relaxation of the lane flow model without side constraints: each trip is used
+	or not, and the flow out of and into each lane equals its number of used trips. Every flow
+	variable is in the out row of one lane and the in row of one lane, and every trip variable in
+	both rows of its lane with the opposite sign, so the constraint matrix is totally unimodular and
+	the simplex solution is integral.
+
+	Args:
+		graph (dict): The lane graph, from lane_graph
+		trip_profit (numpy.ndarray): The profit of each trip
+
+	Returns:
+		tuple[numpy.ndarray, numpy.ndarray]: A boolean array indicating the used trips, and the
+			integer flow on each lane connection
+	"""
+	trip_lane, lane_counts = graph['trip_lane'], graph['lane_counts']
+	num_lanes, num_trips, num_arcs = len(lane_counts), len(trip_lane), len(graph['t1'])
+	trips = num_arcs + numpy.arange(num_trips)
+	flows = numpy.arange(num_arcs)
+	matrix = scipy.sparse.csr_matrix((
+		numpy.concatenate((numpy.ones(2 * num_arcs), -numpy.ones(2 * num_trips))),
+		(numpy.concatenate((graph['t1'], num_lanes + graph['t2'], trip_lane, num_lanes + trip_lane)),
+		numpy.concatenate((flows, flows, trips, trips)))), shape=(2 * num_lanes, num_arcs + num_trips))
+	upper_bounds = numpy.concatenate((numpy.minimum(lane_counts[graph['t1']], lane_counts[graph['t2']]), numpy.ones(num_trips)))
+	result = scipy.optimize.linprog(numpy.concatenate((graph['empty_cost'], -trip_profit)),
+		A_eq=matrix, b_eq=numpy.zeros(2 * num_lanes),
+		bounds=numpy.column_stack((numpy.zeros(num_arcs + num_trips), upper_bounds)),
+		method='highs-ds')
+	if result.status != 0:
+		return numpy.zeros(num_trips, dtype=bool), numpy.zeros(num_arcs, dtype=numpy.int64)
+	values = numpy.round(result.x).astype(numpy.int64)
+	return values[trips] == 1, values[flows]
+
+
+def spectral_order(weights: scipy.sparse.csr_matrix) -> numpy.ndarray:
+	"""Orders the nodes of a graph so that strongly connected nodes are close together. Nodes are
+	ordered by connected component, largest first, and within each component by the Fiedler vector
+	(the second eigenvector of the normalized adjacency matrix).
+
+	Args:
+		weights (scipy.sparse.csr_matrix): The symmetric weighted adjacency matrix
+
+	Returns:
+		numpy.ndarray: The nodes in order
+	"""
+	num_nodes = weights.shape[0]
+	num_components, components = connected_components(weights, directed=False)
+	component_sizes = numpy.bincount(components, minlength=num_components)
+	fiedler = numpy.zeros(num_nodes)
+	for component in numpy.flatnonzero(component_sizes > 2):
+		nodes = numpy.flatnonzero(components == component)
+		sub_weights = weights[nodes][:, nodes]
+		degree = numpy.asarray(sub_weights.sum(axis=1)).ravel()
+		scale = scipy.sparse.diags(1 / numpy.sqrt(numpy.maximum(degree, 1e-12)))
+		normalized = scale @ sub_weights @ scale
+		if len(nodes) <= DENSE_EIGEN_SIZE:
+			_, vectors = numpy.linalg.eigh(normalized.toarray())
+			fiedler[nodes] = vectors[:, -2]
+		else:
+			_, vectors = eigsh(normalized, k=2, which='LA', v0=numpy.sqrt(degree + 1))
+			fiedler[nodes] = vectors[:, 0]
+		fiedler[nodes] *= scale.diagonal()
+	component_rank = numpy.argsort(numpy.argsort(-component_sizes, kind='stable'))
+	return numpy.lexsort((fiedler, component_rank[components]))
+
+
+def bisect_parts(nodes: numpy.ndarray, weights: scipy.sparse.csr_matrix, sizes: numpy.ndarray,
+	num_parts: int, parts: numpy.ndarray, first_part: int=0):
+	"""Splits nodes into num_parts parts of about equal size by recursive spectral bisection,
+	writing the part of each node to parts.
+
+	Args:
+		nodes (numpy.ndarray): The nodes to split
+		weights (scipy.sparse.csr_matrix): The adjacency matrix of the whole graph
+		sizes (numpy.ndarray): The size of each node of the whole graph
+		num_parts (int): The number of parts
+		parts (numpy.ndarray): The part of each node of the whole graph, updated in place
+		first_part (int, optional): The number of the first part. Defaults to 0.
+	"""
+	if num_parts == 1 or len(nodes) <= 1:
+		parts[nodes] = first_part
+		return
+	left_parts = num_parts // 2
+	order = nodes[spectral_order(weights[nodes][:, nodes])]
+	cumulative = numpy.cumsum(sizes[order])
+	cut = numpy.searchsorted(cumulative, cumulative[-1] * left_parts / num_parts)
+	#cut on the node boundary closest to the target size, keeping both sides non-empty
+	if cut < len(order) - 1 and (cut == 0 or cumulative[cut] - cumulative[-1] * left_parts / num_parts < \
+		cumulative[-1] * left_parts / num_parts - cumulative[cut - 1]):
+		cut += 1
+	cut = min(max(cut, 1), len(order) - 1)
+	bisect_parts(order[:cut], weights, sizes, left_parts, parts, first_part)
+	bisect_parts(order[cut:], weights, sizes, num_parts - left_parts, parts, first_part + left_parts)
+
+
+def partition_trips(dst_codes: numpy.ndarray, orgn_codes: numpy.ndarray, trip_profit: numpy.ndarray,
+	deadhead_matrix: DeadheadMatrix, max_deadhead: float, num_parts: int=None,
+	arcs_per_part: int=DEFAULT_ARCS_PER_PART) -> dict:
+	"""Partitions the trips into parts of equal size that keep the tours of the lane circulation
+	inside a part. The lanes are split into num_parts regions by recursive spectral bisection, each
+	tour is placed in the region of most of its trips (and each unused trip in the region of its
+	lane), and the trips are cut into equal slices in the order of (region, tour, position in the
+	tour).
+
+	Args:
+		dst_codes (numpy.ndarray): The destination zip3 code of each trip
+		orgn_codes (numpy.ndarray): The origin zip3 code of each trip
+		trip_profit (numpy.ndarray): The profit of each trip
+		deadhead_matrix (DeadheadMatrix): The deadhead matrix
+		max_deadhead (float): The maximum empty miles for a connection, or None for no limit
+		num_parts (int, optional): The number of parts. Defaults to None, meaning enough parts
+			for about arcs_per_part trip arcs each.
+		arcs_per_part (int, optional): The number of trip arcs per part when num_parts is None.
+
+	Returns:
+		dict: 'parts' (the part of each trip), 'num_parts', 'part_sizes' (the trips of each part),
+			'num_trip_arcs' (the trip arcs before partitioning), 'circulation_value' (the profit of
+			the lane circulation) and 'cut_value_fraction' (the share of that profit on tour arcs
+			cut between parts)
+	"""
+	trip_profit = numpy.asarray(trip_profit, dtype=numpy.float64)
+	num_trips = len(trip_profit)
+	graph = lane_graph(dst_codes, orgn_codes, trip_profit, deadhead_matrix, max_deadhead)
+	num_lanes = len(graph['lane_counts'])
+	if num_parts is None:
+		num_parts = int(numpy.ceil(graph['num_trip_arcs'] / arcs_per_part))
+	num_parts = max(1, min(num_parts, num_trips))
+
+	#the tours of the circulation, as trip arcs
+	is_used, flows = solve_lane_circulation(graph, trip_profit)
+	t1, t2, lane_arc = expand_lane_flows(graph['trip_lane'], is_used, graph['t1'], graph['t2'], flows, num_lanes)
+	arc_value = trip_profit[t1] - graph['empty_cost'][lane_arc]
+	tour_trips, tours, _ = cycle_sequences(t1, t2, num_trips)
+	num_tours = tours[-1] + 1 if len(tours) > 0 else 0
+	unused = numpy.flatnonzero(~is_used)
+	trip_order = numpy.concatenate((tour_trips, unused))
+	groups = numpy.concatenate((tours, num_tours + numpy.arange(len(unused))))
+
+	#the region of each group of trips is the region of most of its trips
+	lane_regions = numpy.zeros(num_lanes, dtype=numpy.int64)
+	bisect_parts(numpy.arange(num_lanes), graph['weights'], graph['lane_counts'], num_parts, lane_regions)
+	num_groups = num_tours + len(unused)
+	votes = numpy.zeros((num_groups, num_parts), dtype=numpy.int64)
+	numpy.add.at(votes, (groups, lane_regions[graph['trip_lane'][trip_order]]), 1)
+	group_regions = votes.argmax(axis=1)
+
+	order = numpy.lexsort((groups, group_regions[groups]))
+	parts = numpy.empty(num_trips, dtype=numpy.int64)
+	parts[trip_order[order]] = numpy.arange(num_trips) * num_parts // max(num_trips, 1)
+
+	total_value = arc_value.sum()
+	cut_value = arc_value[parts[t1] != parts[t2]].sum()
+	return {
+		'parts': parts,
+		'num_parts': num_parts,
+		'part_sizes': numpy.bincount(parts, minlength=num_parts),
+		'num_trip_arcs': graph['num_trip_arcs'],
+		'circulation_value': total_value,
+		'cut_value_fraction': cut_value / total_value if total_value > 0 else 0.
+	}
@@ -1,6 +1,8 @@
 import pandas
 
+from deadhead_matrix import DeadheadMatrix
 from file_manager import FileManager
+from zip_codes import area_labels
 
 def read_csv_with_log(
                     filename: str,
@@ -106,7 +108,9 @@ def field_name_validator(df: pandas.DataFrame, required_columns: iter,
 def read_empty_miles(file_manager: FileManager) -> pandas.DataFrame:
     '''
     Reads the empty miles file and returns a pandas dataframe with the origin_zip, 
-    destination_zip, empty_miles, and empty_cost columns.
+    destination_zip, empty_miles, and empty_cost columns. The dataframe and the
+    DeadheadMatrix built from it are also stored on the file manager, as
+    file_manager.empty_miles_df and file_manager.deadhead_matrix.
 
     Args:
         file_manager (FileManager): The file manager object
@@ -128,12 +132,12 @@ def read_empty_miles(file_manager: FileManager) -> pandas.DataFrame:
             file_manager.params['data']['empty_miles']['columns']['empty_miles']: 'empty_miles',
             file_manager.params['data']['empty_miles']['columns']['empty_cost']: 'empty_cost',
     }, axis=1)
-    empty_miles_df['origin_zip'] = empty_miles_df['origin_zip'].apply(lambda x: str(x).zfill(3))
-    empty_miles_df['destination_zip'] = empty_miles_df['destination_zip'].apply(lambda x: str(x).zfill(3))
-    empty_miles_df['origin_zip'] = empty_miles_df['origin_zip'].apply(lambda x: str(x).ljust(5, '0'))
-    empty_miles_df['destination_zip'] = empty_miles_df['destination_zip'].apply(lambda x: str(x).ljust(5, '0'))
+    empty_miles_df['origin_zip'] = area_labels(empty_miles_df['origin_zip'])
+    empty_miles_df['destination_zip'] = area_labels(empty_miles_df['destination_zip'])
     empty_miles_df= empty_miles_df.drop_duplicates(subset=['origin_zip', 'destination_zip'])
 
     empty_miles_df.set_index(['origin_zip', 'destination_zip'], inplace=True)
+    file_manager.empty_miles_df = empty_miles_df
+    file_manager.deadhead_matrix = DeadheadMatrix.from_empty_miles_df(empty_miles_df)
 
     return empty_miles_df
\ No newline at end of file
@@ -0,0 +1,148 @@
+'''
+This file contains the zip normalization shared by every ingest path. Raw zips (numbers, or strings
+with or without their leading zeros) are normalized once per distinct zip with vectorized string
+operations, and the optimizer works on integer codes from there: int16 zip3 codes, which index the DeadheadMatrix, and
+int32 zip5 codes with a table of their labels. Labels are only rebuilt for the outputs.
+'''
+
+import numpy
+import pandas
+
+#zip3 codes run from 0 to 999; any zip that cannot be expressed as a zip3 gets MISSING_CODE
+NUM_ZIP3 = 1000
+MISSING_CODE = NUM_ZIP3
+
+
+def _as_series(zips: iter) -> pandas.Series:
+	'''
+	returns the zips as a Series, keeping the index of a Series
+	'''
+	if isinstance(zips, pandas.Series):
+		return zips
+	return pandas.Series(zips, dtype=object)
+
+
+def _map_unique(zips: iter, normalize) -> tuple[numpy.ndarray, pandas.Series]:
+	'''
+	factorizes the zips and applies normalize to the distinct zips only, since a column of trips
+	repeats the same few thousand zips. Returns the position of each zip in the distinct zips
+	and the normalized distinct zips.
+	'''
+	positions, uniques = pandas.factorize(_as_series(zips), use_na_sentinel=False)
+	return positions, normalize(pandas.Series(uniques, dtype=object).astype(str))
+
+
+def _take_labels(zips: iter, normalize) -> pandas.Series:
+	'''
+	returns the normalized label of each zip, computed once per distinct zip
+	'''
+	zips = _as_series(zips)
+	positions, labels = _map_unique(zips, normalize)
+	return pandas.Series(labels.values[positions], index=zips.index, dtype=object)
+
+
+def zip5_labels(zips: iter) -> pandas.Series:
+	"""Normalizes raw zips to zip5 labels: the string of the zip, zero-padded to five characters.
+
+	Args:
+		zips (iter): The raw zips
+
+	Returns:
+		pandas.Series: The zip5 label of each zip, with the index of zips if it is a Series
+	"""
+	return _take_labels(zips, lambda labels: labels.str.zfill(5))
+
+
+def zip3_labels(zips: iter) -> pandas.Series:
+	"""Normalizes raw trip zips to zip3 labels: the first three characters of the zip5 label,
+	followed by '00'.
+
+	Args:
+		zips (iter): The raw zips
+
+	Returns:
+		pandas.Series: The zip3 label of each zip, with the index of zips if it is a Series
+	"""
+	return _take_labels(zips, lambda labels: labels.str.zfill(5).str[:3] + '00')
+
+
+def area_labels(zips: iter) -> pandas.Series:
+	"""Normalizes the zips of the empty miles, which are zip3 areas, to zip3 labels: the string of
+	the zip zero-padded to three characters, then padded with zeros on the right to five. Labels
+	that are already five characters long are kept.
+
+	Args:
+		zips (iter): The raw zips
+
+	Returns:
+		pandas.Series: The zip3 label of each zip, with the index of zips if it is a Series
+	"""
+	return _take_labels(zips, lambda labels: labels.str.zfill(3).str.ljust(5, '0'))
+
+
+def zip3_codes(zips: iter) -> numpy.ndarray:
+	"""Converts zip labels to integer zip3 codes. Labels are zero-padded to five characters,
+	and only labels in zip3 form (three digits followed by '00') get a code; anything else
+	(full five-digit zips, Canadian postal codes, blanks) is mapped to MISSING_CODE.
+
+	Args:
+		zips (iter): The zip labels to convert
+
+	Returns:
+		numpy.ndarray: The int16 zip3 code of each label
+	"""
+	positions, labels = _map_unique(zips, lambda labels: labels.str.zfill(5))
+	prefix = labels.str[:3]
+	is_zip3 = (prefix.str.isdigit() & (labels.str[3:] == '00')).values
+	codes = numpy.full(len(labels), MISSING_CODE, dtype=numpy.int16)
+	codes[is_zip3] = prefix[is_zip3].astype(numpy.int16).values
+	return codes[positions]
+
+
+def trip_zip3_codes(zips: iter) -> numpy.ndarray:
+	"""Converts raw trip zips to the zip3 codes of their zip3 labels (see zip3_labels) without
+	building the labels: the first three characters of the zip5 label, when they are digits.
+
+	Args:
+		zips (iter): The raw zips
+
+	Returns:
+		numpy.ndarray: The int16 zip3 code of each zip
+	"""
+	positions, prefix = _map_unique(zips, lambda labels: labels.str.zfill(5).str[:3])
+	is_zip3 = prefix.str.isdigit().values
+	codes = numpy.full(len(prefix), MISSING_CODE, dtype=numpy.int16)
+	codes[is_zip3] = prefix[is_zip3].astype(numpy.int16).values
+	return codes[positions]
+
+
+def zip3_code(zip_label: str) -> int:
+	"""Converts a single zip label to its zip3 code, following the same rules as zip3_codes.
+
+	Args:
+		zip_label (str): The zip label to convert
+
+	Returns:
+		int: The zip3 code of the label
+	"""
+	label = str(zip_label).zfill(5)
+	if label[:3].isdigit() and label[3:] == '00':
+		return int(label[:3])
+	return MISSING_CODE
+
+
+def zip5_codes(*zip_columns: iter) -> tuple[list[numpy.ndarray], numpy.ndarray]:
+	"""Converts columns of zips to int32 zip5 codes shared across the columns, so equal zip5
+	labels get equal codes whichever column they are in.
+
+	Args:
+		*zip_columns (iter): The columns of zips
+
+	Returns:
+		tuple[list[numpy.ndarray], numpy.ndarray]: The codes of each column, and the table of
+			labels: the label of code c is labels[c]
+	"""
+	labels = [zip5_labels(column) for column in zip_columns]
+	codes, table = pandas.factorize(pandas.concat(labels, ignore_index=True))
+	ends = numpy.cumsum([len(column) for column in labels])[:-1]
+	return [column_codes.astype(numpy.int32) for column_codes in numpy.split(codes, ends)], numpy.asarray(table, dtype=object)
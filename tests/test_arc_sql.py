@@ -0,0 +1,149 @@
+'''
+Checks that the DuckDB arc engine (arc_sql) gives the same arcs as arc_builder: the same arcs, columns
+and missing pairs, the same arcs after pruning with arc limits and the same arcs after the per-trip
+profit quantile filter of the DataManager. The trips and the deadhead matrix are generated in memory,
+so nothing is read from or written to the input and output folders.
+
+Usage: python -m pytest
+'''
+import os
+import sys
+
+import numpy
+import pytest
+
+pytest.importorskip('duckdb')
+pytest.importorskip('pyarrow')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts'))
+import arc_builder
+import arc_pruning
+import arc_sql
+from deadhead_matrix import MISSING_MILES, DeadheadMatrix
+from zip_codes import NUM_ZIP3
+
+NUM_TRIPS = 300
+NUM_CODES = 40
+#small blocks, so the arcs come back in several record batches
+BLOCK_SIZE = 1000
+
+
+@pytest.fixture(scope='module')
+def trips() -> dict:
+	'''
+	returns the enumeration parameters of random trips between NUM_CODES zip3 codes, with a deadhead
+	matrix that has no entry for about a fifth of the pairs
+	'''
+	rng = numpy.random.default_rng(0)
+	empty_miles = numpy.full((NUM_ZIP3 + 1, NUM_ZIP3 + 1), MISSING_MILES, dtype=numpy.int32)
+	empty_cost = numpy.full((NUM_ZIP3 + 1, NUM_ZIP3 + 1), numpy.nan, dtype=numpy.float32)
+	has_entry = rng.random((NUM_CODES, NUM_CODES)) < 0.8
+	miles = rng.integers(0, 800, (NUM_CODES, NUM_CODES))
+	empty_miles[:NUM_CODES, :NUM_CODES] = numpy.where(has_entry, miles, MISSING_MILES)
+	empty_cost[:NUM_CODES, :NUM_CODES] = numpy.where(has_entry, miles * 1.7 + rng.random((NUM_CODES, NUM_CODES)), numpy.nan)
+	return {
+		'dst_codes': rng.integers(0, NUM_CODES, NUM_TRIPS).astype(numpy.int16),
+		'orgn_codes': rng.integers(0, NUM_CODES, NUM_TRIPS).astype(numpy.int16),
+		'trip_profit': rng.normal(0, 800, NUM_TRIPS).round(2),
+		'must_take': rng.random(NUM_TRIPS) < 0.05,
+		'deadhead_matrix': DeadheadMatrix(empty_miles, empty_cost)}
+
+
+def trip_arcs(trips: dict, max_deadhead: float, **params) -> tuple[dict, dict]:
+	'''
+	returns the trip arcs of arc_builder and of arc_sql
+	'''
+	enumerate_arcs = arc_builder.enumerate_trip_arcs if max_deadhead is None else arc_builder.enumerate_neighbor_arcs
+	expected = enumerate_arcs(**trips, max_deadhead=max_deadhead)
+	actual = arc_builder.collect_blocks(arc_sql.trip_arc_blocks(**trips, max_deadhead=max_deadhead, use_32bit=False,
+		block_size=BLOCK_SIZE, **params))
+	return expected, actual
+
+
+def tour_arcs(trips: dict, max_deadhead: float, **params) -> tuple[dict, dict]:
+	'''
+	returns the tours of arc_builder and of arc_sql
+	'''
+	expected = arc_builder.enumerate_tour_arcs(**trips, max_deadhead=max_deadhead)
+	actual = arc_builder.collect_blocks(arc_sql.tour_arc_blocks(**trips, max_deadhead=max_deadhead, block_size=BLOCK_SIZE, **params),
+		dtypes=arc_builder.TOUR_ARC_DTYPES)
+	return expected, actual
+
+
+def trip_scores(trips: dict, arcs: dict) -> tuple[numpy.ndarray, numpy.ndarray]:
+	'''
+	returns the profit and the adjusted profit of trip arcs, as DataManager.trip_arc_columns without 32 bit values
+	'''
+	t1, t2 = arcs['t1'], arcs['t2']
+	profit = trips['trip_profit'][t1] - arcs['empty_cost']
+	return profit, profit + (trips['must_take'][t1] | trips['must_take'][t2]) * 10000
+
+
+def tour_scores(trips: dict, arcs: dict) -> tuple[numpy.ndarray, numpy.ndarray]:
+	'''
+	returns the profit and the adjusted profit of tours, as DataManager.get_potential_tours
+	'''
+	t1, t2 = arcs['t1'], arcs['t2']
+	profit = trips['trip_profit'][t1] + trips['trip_profit'][t2] - arcs['deadhead1'] - arcs['deadhead2']
+	return profit, profit + (trips['must_take'][t1] | trips['must_take'][t2]) * 10000
+
+
+def assert_same_arcs(expected: dict, actual: dict, keep: numpy.ndarray=None):
+	'''
+	asserts that actual holds the arcs of expected, or only those in keep, with the same columns and types
+	'''
+	assert expected.keys() == actual.keys()
+	for name, values in expected.items():
+		if name != 'missing_pairs' and not keep is None:
+			values = values[keep]
+		assert actual[name].dtype == values.dtype, name
+		numpy.testing.assert_array_equal(actual[name], values, err_msg=name)
+
+
+@pytest.mark.parametrize('max_deadhead', [None, 300])
+def test_trip_arcs(trips: dict, max_deadhead: float):
+	assert_same_arcs(*trip_arcs(trips, max_deadhead))
+
+
+@pytest.mark.parametrize('max_deadhead', [None, 300])
+def test_tour_arcs(trips: dict, max_deadhead: float):
+	expected, actual = tour_arcs(trips, max_deadhead)
+	if not max_deadhead is None:
+		#arc_builder reports the missing pairs of the tours it evaluates, arc_sql every missing pair that two
+		#distinct trips connect through, as for the trip arcs
+		assert numpy.isin(expected.pop('missing_pairs'), actual.pop('missing_pairs')).all()
+	assert_same_arcs(expected, actual)
+
+
+@pytest.mark.parametrize('use_tours', [False, True])
+@pytest.mark.parametrize('arcs_per_trip, arc_budget', [(3, None), (5, 400)])
+def test_pruned_arcs(trips: dict, use_tours: bool, arcs_per_trip: int, arc_budget: int):
+	#the arcs SQL keeps under the arc limits are pruned to the same arcs as all arcs
+	arc_limits = arc_pruning.trip_arc_limits(NUM_TRIPS, arcs_per_trip, trips['must_take'])
+	expected, actual = (tour_arcs if use_tours else trip_arcs)(trips, 300, arc_limits=arc_limits)
+	scores = tour_scores if use_tours else trip_scores
+	prune_params = {'arcs_per_trip': arcs_per_trip, 'arc_budget': arc_budget, 'must_keep_trips': trips['must_take']}
+	expected_keep = arc_pruning.prune_arcs(expected['t1'], expected['t2'], scores(trips, expected)[1], NUM_TRIPS, **prune_params)
+	actual_keep = arc_pruning.prune_arcs(actual['t1'], actual['t2'], scores(trips, actual)[1], NUM_TRIPS, **prune_params)
+	assert len(actual['t1']) < len(expected['t1'])
+	for name in ('t1', 't2'):
+		numpy.testing.assert_array_equal(actual[name][actual_keep], expected[name][expected_keep])
+
+
+@pytest.mark.parametrize('quantile', [0.5, 0.9])
+def test_trip_quantile(trips: dict, quantile: float):
+	#the arcs whose adjusted profit is at least the profit quantile of either trip
+	expected, actual = trip_arcs(trips, None, quantile=quantile)
+	profit, profit_adj = trip_scores(trips, expected)
+	t1_quantile = arc_builder.group_quantile(expected['t1'], profit, quantile, NUM_TRIPS)[expected['t1']]
+	t2_quantile = arc_builder.group_quantile(expected['t2'], profit, quantile, NUM_TRIPS)[expected['t2']]
+	assert_same_arcs(expected, actual, (profit_adj >= t1_quantile) | (profit_adj >= t2_quantile))
+
+
+@pytest.mark.parametrize('quantile', [0, 0.9])
+def test_tour_quantile(trips: dict, quantile: float):
+	#the tours whose adjusted profit is at least the truncated profit quantile of t1, even at quantile 0
+	expected, actual = tour_arcs(trips, None, quantile=quantile)
+	profit, profit_adj = tour_scores(trips, expected)
+	t1_quantile = arc_builder.group_quantile(expected['t1'], profit, quantile, NUM_TRIPS)[expected['t1']].astype('int32')
+	assert_same_arcs(expected, actual, profit_adj >= t1_quantile)